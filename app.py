@@ -19,6 +19,7 @@ from modules.ui_components import (
     render_ai_image_page
 )
 from modules.trang_khach_hang import render_customer_page
+from modules.notifier import telegram_queue_stats, retry_failed_telegram
 
 # ============================================
 # CẤU HÌNH TRANG & CSS
@@ -117,6 +118,14 @@ def main_app():
         )
         
         st.markdown("---")
+
+        # Hàng đợi Telegram (gửi nền)
+        tg = telegram_queue_stats()
+        st.caption(f"📨 Telegram: {tg['sent_24h']} đã gửi (24h) · {tg['pending']} chờ gửi · {tg['failed']} lỗi")
+        if tg["failed"]:
+            st.caption(f"⚠️ Lỗi gần nhất: {tg['last_error']}")
+            if st.button("🔁 Gửi lại tin lỗi", use_container_width=True):
+                st.toast(f"Đã xếp lại {retry_failed_telegram()} tin")
         
         # Nút Đăng xuất
         if st.button("🚪 Đăng xuất", use_container_width=True):
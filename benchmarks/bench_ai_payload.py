@@ -0,0 +1,83 @@
+"""
+Benchmark: ảnh gửi Gemini khi gen mẫu thêu.
+- Bản cũ: PIL.Image.open(bytes) gửi thẳng -> SDK encode WebP lossless ở độ phân giải gốc,
+  style_mau.jpg mở lại từ đĩa mỗi lần.
+- Bản mới: chuan_bi_anh_ai (JPEG, cạnh dài <= AI_INPUT_MAX_SIDE) + style ref cache trong process.
+Đo dung lượng payload ảnh và thời gian chuẩn bị (không gọi API).
+
+Chạy:
+    python benchmarks/bench_ai_payload.py [--sizes 4032x3024 1024x768] [--repeat 5]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+from google.generativeai.types import content_types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import ai_logic  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STYLE = os.path.join(ROOT, ai_logic.STYLE_REF_PATH)
+
+
+def make_photo(w, h, seed=0):
+    """Ảnh giả lập ảnh chụp: gradient + nhiễu, lưu JPEG q92 như ảnh điện thoại."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(x, (h, w)), np.broadcast_to(y, (h, w)), np.full((h, w), 128.0)], axis=-1)
+    arr = np.clip(base + rng.normal(0, 18, (h, w, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format="JPEG", quality=92)
+    return buf.getvalue()
+
+
+def legacy_payload(image_bytes):
+    """Bản cũ: các blob SDK thực sự gửi đi."""
+    parts = [Image.open(io.BytesIO(image_bytes))]
+    if os.path.exists(STYLE):
+        parts.append(Image.open(STYLE))
+    return sum(len(content_types.image_to_blob(p).data) for p in parts)
+
+
+def new_payload(image_bytes):
+    parts = [ai_logic.chuan_bi_anh_ai(image_bytes)]
+    style = ai_logic.lay_style_ref()
+    if style:
+        parts.append(style)
+    return sum(len(p["data"]) for p in parts)
+
+
+def bench(fn, data, repeat):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = fn(data)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000, size
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", nargs="+", default=["4032x3024", "2000x2000", "1024x768"])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    os.chdir(ROOT)  # STYLE_REF_PATH là đường dẫn tương đối như khi chạy app
+
+    print(f"{'ảnh':<12}{'cũ ms':>10}{'cũ KB':>10}{'mới ms':>10}{'mới KB':>10}{'giảm':>8}")
+    for spec in args.sizes:
+        w, h = map(int, spec.split("x"))
+        data = make_photo(w, h)
+        old_ms, old_size = bench(legacy_payload, data, args.repeat)
+        new_ms, new_size = bench(new_payload, data, args.repeat)
+        print(f"{spec:<12}{old_ms:>10.1f}{old_size / 1024:>10.0f}{new_ms:>10.1f}{new_size / 1024:>10.0f}"
+              f"{old_size / max(new_size, 1):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark: compress_image mới (draft + reduce + EXIF, JPEG/WEBP) so với bản cũ.
+
+Chạy:
+    python benchmarks/bench_compress_image.py [thư_mục_ảnh] [--repeat 3]
+
+Không truyền thư mục -> tự sinh bộ ảnh mẫu (12MP, 4MP, PNG có alpha, ảnh nhỏ)
+từ style_mau.jpg trong thư mục tạm.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.data_handler import compress_image  # noqa: E402
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def legacy_compress_image(image_file, max_width=1024):
+    """Bản compress_image trước khi tối ưu (decode full + LANCZOS 1 lần + optimize=True)."""
+    img = Image.open(image_file)
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    if img.width > max_width:
+        ratio = max_width / float(img.width)
+        img = img.resize((max_width, int(float(img.height) * ratio)), Image.Resampling.LANCZOS)
+    output_io = io.BytesIO()
+    img.save(output_io, format="JPEG", quality=85, optimize=True)
+    return output_io.getvalue()
+
+
+def build_sample_corpus(out_dir):
+    base_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "style_mau.jpg")
+    base = Image.open(base_path).convert("RGB")
+    samples = {
+        "phone_12mp.jpg": (4000, 3000, "JPEG"),
+        "phone_4mp.jpg": (2304, 1728, "JPEG"),
+        "screenshot_alpha.png": (1440, 2560, "PNG"),
+        "small_600.jpg": (600, 476, "JPEG"),
+    }
+    paths = []
+    for name, (w, h, fmt) in samples.items():
+        img = base.resize((w, h), Image.Resampling.BICUBIC)
+        if fmt == "PNG":
+            img = img.convert("RGBA")
+        path = os.path.join(out_dir, name)
+        img.save(path, format=fmt, quality=92) if fmt == "JPEG" else img.save(path, format=fmt)
+        paths.append(path)
+    return paths
+
+
+def bench(fn, data, repeat):
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(io.BytesIO(data))
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, len(out or b"")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", help="Thư mục chứa ảnh mẫu")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.corpus:
+        paths = sorted(os.path.join(args.corpus, f) for f in os.listdir(args.corpus) if f.lower().endswith(IMAGE_EXTS))
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        paths = build_sample_corpus(tmp.name)
+
+    variants = [
+        ("cũ (JPEG)", legacy_compress_image),
+        ("mới JPEG", lambda f: compress_image(f, fmt="JPEG")),
+        ("mới WEBP", lambda f: compress_image(f, fmt="WEBP")),
+    ]
+    totals = {name: [0.0, 0] for name, _ in variants}
+
+    header = f"{'Ảnh':28} {'Gốc KB':>8} " + " ".join(f"{name:>22}" for name, _ in variants)
+    print(header)
+    print("-" * len(header))
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        cells = []
+        for name, fn in variants:
+            dt, size = bench(fn, data, args.repeat)
+            totals[name][0] += dt
+            totals[name][1] += size
+            cells.append(f"{dt * 1000:8.1f} ms {size / 1024:8.1f} KB")
+        print(f"{os.path.basename(path)[:28]:28} {len(data) / 1024:8.1f} " + " ".join(f"{c:>22}" for c in cells))
+
+    print("-" * len(header))
+    base_t, base_b = totals[variants[0][0]]
+    for name, (t, b) in totals.items():
+        print(f"{name:12} tổng {t * 1000:9.1f} ms  {b / 1024:9.1f} KB  "
+              f"(x{base_t / t if t else 0:.2f} tốc độ, {b / base_b * 100 if base_b else 0:.0f}% dung lượng so với bản cũ)")
+
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark: chuẩn bị bảng Dashboard bằng cột (modules/order_prep.py) so với bản cũ
+dùng DataFrame.apply(axis=1) + Styler.apply theo từng dòng.
+
+Chạy:
+    python benchmarks/bench_dashboard_prep.py [--rows 10000 100000] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.order_prep import prepare_dashboard_table, highlight_urgent, tinh_kpi_don_hang  # noqa: E402
+
+STATUS_DONE = ["Hoàn thành", "Đã giao"]
+STATUS_CANCEL = ["Hủy", "Đã hủy"]
+IGNORE_STATUSES = STATUS_DONE + STATUS_CANCEL
+STATUSES = ["Mới", "Chờ sản xuất", "Đang sản xuất", "Hoàn thành", "Hủy", "Đã giao"]
+
+
+def legacy_prep(df_show):
+    """Bản cũ trong render_order_management (apply theo dòng)."""
+    df_show = df_show.copy()
+
+    def tinh_thuc_nhan(row):
+        if row['trang_thai'] in STATUS_DONE: return row['thanh_tien']
+        else: return row['da_coc']
+    df_show.apply(tinh_thuc_nhan, axis=1).sum()
+
+    df_show['is_urgent_active'] = df_show.apply(
+        lambda x: True if (x.get('co_hen_ngay') == True and str(x.get('trang_thai')).strip() not in IGNORE_STATUSES) else False,
+        axis=1
+    )
+    df_show = df_show.sort_values(by=['is_urgent_active', 'created_at'], ascending=[False, False])
+
+    def format_deadline(row):
+        try:
+            d_obj = pd.to_datetime(row['ngay_tra'])
+            d_str = d_obj.strftime("%d/%m/%Y")
+            return f"🚨 {d_str}" if row['is_urgent_active'] else d_str
+        except:
+            return str(row.get('ngay_tra', ''))
+    df_show['deadline'] = df_show.apply(format_deadline, axis=1)
+    df_show['display_ma_don'] = df_show.apply(
+        lambda x: f"🖨️ {x['ma_don']}" if x.get('da_in') == True else x['ma_don'], axis=1)
+
+    def get_display_tags(tags):
+        if not tags: return ""
+        if isinstance(tags, str): return tags
+        return ", ".join([str(t) for t in tags if t])
+    df_show['display_tags'] = df_show['tags'].apply(get_display_tags)
+
+    cols_to_show = ["display_ma_don", "display_tags", "ten_khach", "shop", "deadline", "thanh_tien", "trang_thai"]
+    df_display = df_show[cols_to_show].reset_index(drop=True)
+
+    def highlight(row):
+        if "🚨" in str(row.get('deadline', '')):
+            return ['background-color: #ffebee; color: #c62828; font-weight: bold'] * len(row)
+        return [''] * len(row)
+    df_display.style.apply(highlight, axis=1)._compute()
+    return df_display
+
+
+def new_prep(df_show):
+    tinh_kpi_don_hang(df_show, STATUS_DONE, STATUS_CANCEL)
+    df_display, urgent = prepare_dashboard_table(df_show, IGNORE_STATUSES)
+    df_display.style.apply(highlight_urgent, axis=None, urgent=urgent)._compute()
+    return df_display
+
+
+def build_frame(n, seed=0):
+    rng = np.random.default_rng(seed)
+    created = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, n), unit="s")
+    ngay_tra = (created + pd.to_timedelta(rng.integers(3, 30, n), unit="D")).strftime("%Y-%m-%d")
+    tag_pool = [None, [], ["Gấp"], ["Gấp", "Thêu tay"], ["Chờ vải"]]
+    return pd.DataFrame({
+        "ma_don": [f"DH{i:06d}" for i in range(n)],
+        "ten_khach": "Nguyễn Văn A",
+        "shop": rng.choice(["TGTĐ", "Inside", "Lanh Canh"], n),
+        "trang_thai": rng.choice(STATUSES, n),
+        "thanh_tien": rng.integers(100, 2000, n) * 1000.0,
+        "da_coc": rng.integers(0, 100, n) * 1000.0,
+        "co_hen_ngay": rng.random(n) < 0.1,
+        "da_in": rng.random(n) < 0.5,
+        "ngay_tra": ngay_tra,
+        "created_at": created.strftime("%Y-%m-%dT%H:%M:%S"),
+        "tags": [tag_pool[i % len(tag_pool)] for i in range(n)],
+    })
+
+
+def bench(fn, df, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(df)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    header = f"{'Số dòng':>10} {'legacy ms':>12} {'vectorized ms':>15} {'x nhanh hơn':>12}"
+    print(header)
+    print("-" * len(header))
+    for n in args.rows:
+        df = build_frame(n)
+        old_out, new_out = legacy_prep(df), new_prep(df)
+        assert old_out["deadline"].tolist() == new_out["deadline"].tolist(), "Kết quả khác bản cũ"
+        t_old, t_new = bench(legacy_prep, df, args.repeat), bench(new_prep, df, args.repeat)
+        print(f"{n:>10} {t_old * 1000:12.1f} {t_new * 1000:15.1f} {t_old / t_new:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Benchmark: prompt trích xuất đơn cũ (system_instruction đủ luật + ngày hôm nay, tạo model mới
+mỗi lần gọi) so với prompt rút gọn tĩnh + model dùng chung + bộ luật local (modules/ai_logic.py).
+
+- Luôn đo: thời gian dựng model/prompt mỗi lần gọi, prefix có giống nhau giữa 2 ngày không,
+  độ dài prompt, thời gian chạy bộ luật local (modules/chat_parser.py).
+- Có GOOGLE_API_KEY: đếm token (count_tokens) và gọi thật --calls lần để so latency,
+  số token prompt và số token Gemini tính là đã cache (cached_content_token_count).
+
+Chạy:
+    python benchmarks/bench_gemini_prompt.py [--calls 5] [--chat "..."]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import google.generativeai as genai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import ai_logic  # noqa: E402
+from modules.chat_parser import parse_chat  # noqa: E402
+
+SAMPLE_CHAT = """Chị Lan 0909123456, 12 Nguyễn Trãi Q1. Shop TGTD.
+2 áo hoodie đen size L thêu tên LAN, 1 túi tote trắng thêu logo. Tổng 850k, cọc 300k."""
+
+# Bộ mẫu kiểm tra luật shop: (đoạn chat, shop mong đợi)
+SHOP_SAMPLES = [
+    ("Shop TGTD, áo hoodie", "TGTĐ"),
+    ("tgtđ 2 áo polo", "TGTĐ"),
+    ("Lanh Canh chị A 0909123456", "Lanh Canh"),
+    ("lanh canh chị B", "Lanh Canh"),
+    ("LANH CANH áo thun", "Lanh Canh"),
+    ("LC - 1 túi tote", "Lanh Canh"),
+    ("Inside anh Nam", "Inside"),
+    ("IS 2 áo zip", "Inside"),
+    ("this is fine", "Inside"),
+    ("đơn lc không viết hoa", "Inside"),
+]
+
+# (chat, trường, giá trị mong đợi; None = luật không được tự điền, để Gemini đọc)
+# Tính với "hôm nay" cố định FIELD_TODAY để kết quả ngày không đổi theo ngày chạy
+FIELD_TODAY = date(2024, 10, 1)
+FIELD_SAMPLES = [
+    ("giá 2 cái 500k", "tong_tien", None),
+    ("tổng 850k, cọc 200k", "tong_tien", 850000),
+    ("tổng 850k, cọc 200k", "da_coc", 200000),
+    ("tt: 1.250.000đ", "tong_tien", 1250000),
+    ("tổng 2 áo", "tong_tien", None),
+    ("giao 1/2 cái áo", "ngay_tra", None),
+    ("giao ngày 1/2 nhé", "ngay_tra", "2025-02-01"),
+    ("trả 20/11/2024", "ngay_tra", "2024-11-20"),
+    ("giao 1/2 cái áo, nhận 15/11", "ngay_tra", "2024-11-15"),
+]
+
+
+
+# Bản cũ: toàn bộ luật (shop, ngày trả, vận chuyển...) do Gemini tự suy ra
+LEGACY_RULES = """
+Nhiệm vụ: Phân tích đoạn chat thành JSON và xác định mã SHOP.
+
+1. XÁC ĐỊNH SHOP (Quan trọng):
+   - "TGTD" hoặc "TGTĐ" -> shop: "TGTĐ"
+   - "Inside" hoặc "IS"   -> shop: "Inside"
+   - "Lanh Canh" hoặc "LC" -> shop: "Lanh Canh"
+   - Default: "Inside"
+
+2. QUY TẮC TÍNH NGÀY TRẢ HÀNG (ngay_tra):
+   - Bước 1: Kiểm tra xem trong tin nhắn có ghi rõ ngày trả/ngày nhận không?
+     -> Nếu CÓ: Sử dụng ngày đó (định dạng YYYY-MM-DD).
+     -> Nếu KHÔNG: Tính toán tự động dựa trên ngày hôm nay theo quy tắc sau:
+        + Phân loại sản phẩm trong đơn:
+          * Loại 1 (Áo): Sweater, Hoodie, Tshirt, Polo, Áo thun, Zip...
+          * Loại 2 (Quần): Quần short, Quần dài, Jogger...
+          * Loại 3 (Phụ kiện): Túi, Mũ, Khác...
+        + Logic cộng ngày:
+          * Trường hợp A: Nếu đơn hàng chỉ chứa 1 Loại sản phẩm duy nhất (Ví dụ: Chỉ toàn Áo, hoặc chỉ toàn Quần) -> Ngày trả = Ngày đặt hàng + 12 ngày.
+          * Trường hợp B: Nếu đơn hàng mix từ 2 Loại trở lên (Ví dụ: Áo + Quần, Áo + Túi, Quần + Túi...) -> Ngày trả = Ngày đặt hàng + 22 ngày.
+3. XÁC ĐỊNH NGÀY ĐẶT (ngay_dat):
+   - Kiểm tra xem khách có nhắc đến "ngày đặt", "đơn ngày...", "hôm qua", "hôm kia"... không?
+   - Nếu CÓ: Trích xuất và định dạng YYYY-MM-DD.
+   - Nếu KHÔNG: Mặc định là ngày hôm nay.
+4. XÁC ĐỊNH VẬN CHUYỂN & THANH TOÁN (Quan trọng):
+   A. Vận chuyển (van_chuyen):
+      - Nếu thấy "bay", "máy bay", "đường bay" -> "Bay ✈"
+      - Nếu thấy "xe ôm", "grap", "hỏa tốc", "gấp", "nhanh" -> "Xe Ôm 🏍"
+      - Mặc định còn lại -> "Thường"
+
+   B. Hình thức thanh toán (httt):
+      - Nếu thấy "0đ" -> "0đ 📷"
+      - Mặc định còn lại (hoặc ghi COD, thu hộ) -> "Ship COD 💵"
+5. XÁC ĐỊNH CO_HEN_NGAY (Quan trọng):
+   - Nếu khách dùng từ: "cần trước ngày", "lấy đúng ngày", "deadline", "gấp", "kịp ngày", "chốt ngày"...
+   -> co_hen_ngay: true
+   - Còn lại (để shop tự tính hoặc thoải mái thời gian) -> co_hen_ngay: false
+6. XÁC ĐỊNH GHI CHÚ ĐẶC BIỆT (ghi_chu):
+   - Trích xuất tất cả thông tin quan trọng mà không nằm trong các trường trên (Ví dụ: khách cho nhiều SĐT, yêu cầu đóng gói, lưu ý về khách hàng, hoặc bất kỳ thông tin bổ sung nào).
+7. OUTPUT JSON FORMAT:
+{
+    "customer_info": {
+        "ten_khach": "...", "sdt": "...", "dia_chi": "...",
+        "ngay_dat": "YYYY-MM-DD", "ngay_tra": "YYYY-MM-DD", "shop": "...",
+        "tong_tien": 0, "da_coc": 0, "httt": "...", "van_chuyen": "...",
+        "co_hen_ngay": false, "ghi_chu": "..."
+    },
+    "products": [ { "ten_sp": "...", "mau": "...", "size": "...", "kieu_theu": "..." } ]
+}
+"""
+
+
+def legacy_system_prompt(today):
+    """Bản cũ: ngày hôm nay nằm ở đầu system_instruction -> prefix đổi mỗi ngày."""
+    today_str = today.strftime("%d/%m/%Y")
+    return f"Hôm nay là: {today_str}.\n" + LEGACY_RULES
+
+
+def legacy_model(today):
+    return genai.GenerativeModel(model_name=ai_logic.EXTRACT_MODEL,
+                                 system_instruction=legacy_system_prompt(today),
+                                 generation_config={"response_mime_type": "application/json"})
+
+
+def timed(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=5)
+    ap.add_argument("--chat", default=SAMPLE_CHAT)
+    args = ap.parse_args()
+
+    today, tomorrow = date.today(), date.today() + timedelta(days=1)
+    has_key = ai_logic.configure_ai()
+
+    print("== Dựng model mỗi lần gọi ==")
+    print(f"{'bản':<8}{'ms/lần':>10}")
+    print(f"{'cũ':<8}{timed(lambda: legacy_model(today), 200):>10.3f}")
+    print(f"{'mới':<8}{timed(lambda: ai_logic.get_model(ai_logic.EXTRACT_MODEL, ai_logic.EXTRACT_SYSTEM_PROMPT, json_output=True), 200):>10.3f}")
+
+    print("\n== Prefix giữa 2 ngày ==")
+    print(f"cũ : system_instruction giống nhau = {legacy_system_prompt(today) == legacy_system_prompt(tomorrow)}")
+    print(f"mới: system_instruction giống nhau = True")
+    print(f"độ dài prompt: cũ {len(legacy_system_prompt(today))} ký tự, mới {len(ai_logic.EXTRACT_SYSTEM_PROMPT)} ký tự")
+
+    print("\n== Bộ luật local ==")
+    print(f"parse_chat: {timed(lambda: parse_chat(args.chat, today), 5000) * 1000:.1f} µs/lần")
+    print(parse_chat(args.chat, today))
+    sai = [(chat, want, parse_chat(chat, today)["shop"]) for chat, want in SHOP_SAMPLES
+           if parse_chat(chat, today)["shop"] != want]
+    print(f"luật shop: {len(SHOP_SAMPLES) - len(sai)}/{len(SHOP_SAMPLES)} mẫu đúng")
+    for chat, want, got in sai:
+        print(f"  SAI: {chat!r} -> {got} (mong đợi {want})")
+
+    sai = [(chat, key, want, parse_chat(chat, FIELD_TODAY).get(key)) for chat, key, want in FIELD_SAMPLES
+           if parse_chat(chat, FIELD_TODAY).get(key) != want]
+    print(f"luật tiền/ngày: {len(FIELD_SAMPLES) - len(sai)}/{len(FIELD_SAMPLES)} mẫu đúng")
+    for chat, key, want, got in sai:
+        print(f"  SAI: {chat!r} [{key}] -> {got} (mong đợi {want})")
+
+    if not has_key:
+        print("\n(Không có GOOGLE_API_KEY - bỏ qua phần đếm token và gọi thật)")
+        return
+
+    old_model = legacy_model(today)
+    new_model = ai_logic.get_model(ai_logic.EXTRACT_MODEL, ai_logic.EXTRACT_SYSTEM_PROMPT, json_output=True)
+    old_content = f"Phân tích đơn: {args.chat}"
+    new_content = ai_logic.build_extract_content(args.chat, today)
+    print("\n== Token prompt (count_tokens) ==")
+    print(f"cũ : {old_model.count_tokens(old_content).total_tokens}")
+    print(f"mới: {new_model.count_tokens(new_content).total_tokens}")
+
+    print(f"\n== Gọi thật {args.calls} lần ==")
+    print(f"{'bản':<8}{'ms TB':>10}{'prompt':>10}{'cached':>10}")
+    for name, make, content in (("cũ", lambda: legacy_model(today), old_content),
+                                ("mới", lambda: new_model, new_content)):
+        total_ms, prompt, cached = 0, 0, 0
+        for _ in range(args.calls):
+            t0 = time.perf_counter()
+            resp = make().generate_content(content)
+            total_ms += (time.perf_counter() - t0) * 1000
+            usage = resp.usage_metadata
+            prompt += usage.prompt_token_count or 0
+            cached += getattr(usage, "cached_content_token_count", 0) or 0
+        print(f"{name:<8}{total_ms / args.calls:>10.0f}{prompt / args.calls:>10.0f}{cached / args.calls:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
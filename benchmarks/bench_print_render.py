@@ -0,0 +1,151 @@
+"""
+Benchmark: renderer phiếu in mới (f-string từng khối + escape, join 1 lần mỗi file) so với
+bản cũ (f-string nối chuỗi `+=`, không escape), ở lô 10 / 100 / 1000 đơn.
+
+Chạy:
+    python benchmarks/bench_print_render.py [--sizes 10 100 1000] [--items 3] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.printer import (  # noqa: E402
+    _CSS, generate_combined_print_html, generate_print_documents,
+)
+from modules.data_handler import rendition_url  # noqa: E402
+
+SAMPLE_URL = "https://x.supabase.co/storage/v1/object/public/images/designs/" + "ab" * 32 + "/orig.jpg"
+
+
+def legacy_single_order_body(order_info, items):
+    """Bản _get_single_order_body trước khi tối ưu (nối chuỗi bằng f-string)."""
+    items_html = ""
+    for i, item in enumerate(items):
+        valid_images = []
+        if item.get('img_main'): valid_images.append({'url': rendition_url(item['img_main'], 'print'), 'label': 'Ảnh Gốc'})
+        if item.get('img_sub1'): valid_images.append({'url': rendition_url(item['img_sub1'], 'print'), 'label': 'Ảnh 1'})
+        if item.get('img_design'): valid_images.append({'url': rendition_url(item['img_design'], 'print'), 'label': 'Design'})
+        images_row_html = ""
+        if valid_images:
+            imgs_html = ""
+            width_pct = int(100 / len(valid_images)) - 1
+            for img in valid_images:
+                imgs_html += f"""
+                <div class="img-box" style="width: {width_pct}%;">
+                    <img src="{img['url']}" />
+                    <span class="label">{img['label']}</span>
+                </div>
+                """
+            images_row_html = f'<div class="item-images">{imgs_html}</div>'
+        items_html += f"""
+        <div class="item-row">
+            <div class="item-header">
+                <span class="stt">#{i+1}</span>
+                <span class="p-name">{item.get('ten_sp')}</span>
+                <span class="p-attr">Màu: <b>{item.get('mau')}</b></span>
+                <span class="p-attr">Size: <b>{item.get('size')}</b></span>
+                <span class="p-attr">SL: <b>{item.get('so_luong', 1)}</b></span>
+            </div>
+            <div class="item-note">Note: {item.get('kieu_theu')}</div>
+            {images_row_html}
+        </div>
+        """
+    return f"""
+    <div class="print-container">
+        <div class="header">
+            <div class="h-left">
+                <div class="brand">PHIẾU SẢN XUẤT ({order_info.get('shop', 'Inside')})</div>
+                <div class="cust-info">
+                    Khách: <b>{order_info.get('ten_khach')}</b> - {order_info.get('sdt')}<br>
+                    Đ/c: {order_info.get('dia_chi')}
+                </div>
+            </div>
+            <div class="h-right">
+                <div class="meta-row">Mã: <b>{order_info.get('ma_don')}</b></div>
+                <div class="meta-row">Ngày in: {order_info.get('ngay_dat')[:10]}</div>
+                <div class="meta-row">COD: <b>{float(order_info.get('con_lai', 0)):,.0f} đ</b></div>
+            </div>
+        </div>
+        <div class="items-list">
+            {items_html}
+        </div>
+    </div>
+    """
+
+
+def legacy_combined_print_html(orders_data_list):
+    all_bodies = ""
+    for idx, data in enumerate(orders_data_list):
+        if idx > 0:
+            all_bodies += '<div class="page-break"></div>'
+        all_bodies += legacy_single_order_body(data['order_info'], data['items'])
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>{_CSS}</head>
+    <body style="margin: 0; padding: 20px;">
+        {all_bodies}
+    </body>
+    </html>
+    """
+
+
+def build_orders(n, items_per_order):
+    orders = []
+    for i in range(n):
+        items = [{
+            "ten_sp": f"Áo thun cotton {j}", "mau": "Trắng", "size": "XL", "so_luong": 1,
+            "kieu_theu": "Thêu tên + logo ngực trái, chỉ vàng",
+            "img_main": SAMPLE_URL, "img_sub1": SAMPLE_URL if j % 2 == 0 else None, "img_design": SAMPLE_URL,
+        } for j in range(items_per_order)]
+        orders.append({"order_info": {
+            "ma_don": f"DH{i:05d}", "shop": "Inside", "ten_khach": "Nguyễn Văn A", "sdt": "0901234567",
+            "dia_chi": "12 Lê Lợi, Quận 1, TP.HCM", "ngay_dat": "2024-05-01T10:00:00", "con_lai": 250000,
+        }, "items": items})
+    return orders
+
+
+def bench(fn, orders, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(orders)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    tracemalloc.start()
+    fn(orders)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--items", type=int, default=3, help="Số sản phẩm mỗi đơn")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # offline=False: chỉ đo phần render, không tải ảnh qua mạng
+    variants = [
+        ("legacy", legacy_combined_print_html),
+        ("combined", lambda orders: generate_combined_print_html(orders, offline=False)),
+        ("paged", lambda orders: generate_print_documents(orders, offline=False)),
+    ]
+    header = f"{'Số đơn':>8} " + " ".join(f"{name + ' ms / peak MB':>24}" for name, _ in variants)
+    print(header)
+    print("-" * len(header))
+    for n in args.sizes:
+        orders = build_orders(n, args.items)
+        cells = []
+        for _, fn in variants:
+            t, peak = bench(fn, orders, args.repeat)
+            cells.append(f"{t * 1000:10.1f} / {peak / 1e6:8.2f}")
+        print(f"{n:>8} " + " ".join(f"{c:>24}" for c in cells))
+
+
+if __name__ == "__main__":
+    main()
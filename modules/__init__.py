@@ -5,6 +5,7 @@ from .data_handler import (
     supabase,
     fetch_all_orders,
     get_order_details,
+    get_orders_with_items,
     save_full_order,
     update_order_status,
     tai_danh_sach_trang_thai,
@@ -12,6 +13,7 @@ from .data_handler import (
     update_item_image,        # <--- Hàm mới
     update_item_field,
     mark_order_as_printed,
+    bulk_update_orders,
     kiem_tra_ket_noi
 )
 
@@ -3,13 +3,54 @@ import os
 import json
 from datetime import datetime
 from dotenv import load_dotenv
-from PIL import Image
+from PIL import Image, ImageOps
 import io
+import re
+import hashlib
+import unicodedata
+import threading
+import time
+from functools import lru_cache
+from modules.disk_cache import DiskCache, CACHE_DIR
+from modules.chat_parser import parse_chat, tinh_ngay_tra
 
 # Load biến môi trường
 load_dotenv()
 
+# --- CACHE KẾT QUẢ TRÍCH XUẤT ĐƠN ---
+# Đổi PROMPT_VERSION mỗi khi sửa prompt/logic map -> kết quả cũ tự mất hiệu lực
+PROMPT_VERSION = "extract-v5"
+EXTRACT_CACHE_TTL = 2 * 24 * 3600  # Key đã gồm ngày hôm nay, TTL chỉ để dọn dòng cũ
+
+_extract_cache = DiskCache(os.path.join(CACHE_DIR, "gemini_extract.sqlite"),
+                           ttl=EXTRACT_CACHE_TTL, max_entries=2000, max_bytes=20 * 1024 * 1024)
+
+def _chuan_hoa_chat(text):
+    """Chuẩn hoá đoạn chat để dán lại gần giống (thừa khoảng trắng, dòng trống) vẫn trúng cache."""
+    text = unicodedata.normalize("NFC", str(text or ""))
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def _extract_cache_key(text_input, today):
+    # ngay_tra/ngay_dat tính theo hôm nay -> ngày là 1 phần của key
+    raw = f"{PROMPT_VERSION}\n{today.isoformat()}\n{_chuan_hoa_chat(text_input)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def extract_cache_stats():
+    """Số liệu cache trích xuất (hits, misses, entries, bytes) cho panel Debug."""
+    return _extract_cache.stats()
+
+# --- MODEL DÙNG CHUNG TRONG PROCESS ---
+EXTRACT_MODEL = 'gemini-2.5-flash'
+IMAGE_MODEL = 'gemini-3-pro-image-preview'
+
+_ai_lock = threading.Lock()
+_configured_key = None
+_models = {}  # (model_name, system_instruction, json_output) -> GenerativeModel
+
 def configure_ai():
+    """Cấu hình genai 1 lần cho cả process (chỉ cấu hình lại khi API key đổi)."""
+    global _configured_key
     # Ưu tiên lấy từ .env, dự phòng lấy từ st.secrets (khi deploy)
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
@@ -19,82 +60,184 @@ def configure_ai():
         except:
             pass
 
-    if api_key:
-        genai.configure(api_key=api_key)
-        return True
-    return False
+    if not api_key:
+        return False
+    if api_key != _configured_key:
+        with _ai_lock:
+            if api_key != _configured_key:
+                genai.configure(api_key=api_key)
+                _models.clear()
+                _configured_key = api_key
+    return True
+
+def get_model(model_name, system_instruction=None, json_output=False):
+    """Lấy GenerativeModel đã tạo sẵn (tạo 1 lần / cấu hình), dùng lại cho mọi lần gọi."""
+    key = (model_name, system_instruction, json_output)
+    model = _models.get(key)
+    if model is None:
+        with _ai_lock:
+            model = _models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    system_instruction=system_instruction,
+                    generation_config={"response_mime_type": "application/json"} if json_output else None,
+                )
+                _models[key] = model
+    return model
+
+# --- ĐO THỜI GIAN / TOKEN MỖI LẦN GỌI ---
+_metrics_lock = threading.Lock()
+_ai_metrics = {}  # loại gọi -> {calls, total_ms, prompt_tokens, cached_tokens, output_tokens, payload_bytes, last}
 
-def xuly_ai_gemini(text_input):
+def _ghi_metrics(kind, started, response=None, payload_bytes=0):
+    usage = getattr(response, "usage_metadata", None)
+    last = {
+        "ms": round((time.perf_counter() - started) * 1000),
+        "prompt_tokens": getattr(usage, "prompt_token_count", 0) or 0,
+        # Phần prompt Gemini tính là đã cache (implicit/explicit caching)
+        "cached_tokens": getattr(usage, "cached_content_token_count", 0) or 0,
+        "output_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+        "payload_bytes": payload_bytes,  # Dung lượng ảnh gửi lên
+    }
+    with _metrics_lock:
+        m = _ai_metrics.setdefault(kind, {"calls": 0, "total_ms": 0, "prompt_tokens": 0,
+                                          "cached_tokens": 0, "output_tokens": 0, "payload_bytes": 0})
+        m["calls"] += 1
+        m["total_ms"] += last["ms"]
+        for k in ("prompt_tokens", "cached_tokens", "output_tokens", "payload_bytes"):
+            m[k] += last[k]
+        m["last"] = last
+
+def ai_metrics():
+    """Số liệu các lần gọi Gemini trong process: {loại: {calls, total_ms, ..., last}}."""
+    with _metrics_lock:
+        return {k: dict(v) for k, v in _ai_metrics.items()}
+
+# Prompt tĩnh (không chứa ngày) -> phần đầu request giống hệt nhau giữa các lần gọi,
+# Gemini cache được prefix này. Ngày hôm nay nằm trong nội dung từng lần gọi.
+# Shop, SĐT, vận chuyển, thanh toán, hẹn ngày, ngày dạng dd/mm đã có bộ luật local
+# (modules/chat_parser.py). Tiền vẫn do Gemini đọc (luật chỉ dự phòng khi Gemini trả 0);
+# Gemini cũng đọc ngày viết bằng chữ ("thứ 7", "tuần sau"...);
+# không có ngày nào thì ngày trả mới tính mặc định +12/+22 ngày.
+EXTRACT_SYSTEM_PROMPT = """
+Nhiệm vụ: Phân tích đoạn chat đặt hàng thêu thành JSON.
+"Hôm nay" là ngày ghi ở dòng đầu tiên của tin nhắn người dùng.
+
+1. Thông tin khách: tên (ten_khach), số điện thoại (sdt), địa chỉ (dia_chi).
+2. Tiền: tổng tiền (tong_tien) và tiền đã cọc (da_coc), đơn vị đồng ("850k" -> 850000). Không có -> 0.
+3. Ngày (định dạng YYYY-MM-DD, tính từ hôm nay):
+   - ngay_dat: chỉ điền nếu khách nhắc ngày đặt ("đơn ngày...", "hôm qua", "hôm kia"...).
+   - ngay_tra: chỉ điền nếu khách nhắc ngày cần nhận/trả hàng ("thứ 7", "tuần sau", "cuối tháng", "trước 20/11"...).
+   - Không nhắc -> để chuỗi rỗng "". KHÔNG tự tính ngày trả mặc định.
+4. Sản phẩm (products): mỗi dòng sản phẩm gồm tên (ten_sp), màu (mau), size, yêu cầu thêu (kieu_theu).
+5. Ghi chú (ghi_chu): mọi thông tin quan trọng không nằm trong các trường trên
+   (khách cho nhiều SĐT, yêu cầu đóng gói, lưu ý về khách...).
+6. OUTPUT JSON FORMAT:
+{
+    "customer_info": {"ten_khach": "...", "sdt": "...", "dia_chi": "...", "ngay_dat": "", "ngay_tra": "",
+                      "tong_tien": 0, "da_coc": 0, "ghi_chu": "..."},
+    "products": [ { "ten_sp": "...", "mau": "...", "size": "...", "kieu_theu": "..." } ]
+}
+"""
+
+_THU = ["Thứ Hai", "Thứ Ba", "Thứ Tư", "Thứ Năm", "Thứ Sáu", "Thứ Bảy", "Chủ Nhật"]
+
+def build_extract_content(text_input, today=None):
+    """Phần thay đổi theo từng lần gọi: ngày hôm nay (kèm thứ, để tính "thứ 7", "tuần sau") + đoạn chat."""
+    today = today or datetime.now().date()
+    return f"Hôm nay là: {_THU[today.weekday()]}, {today.strftime('%d/%m/%Y')}.\nPhân tích đơn: {text_input}"
+
+def _iso_date(value):
+    """Chuỗi ngày AI trả về -> date (rỗng / sai định dạng -> None)."""
+    try:
+        return datetime.strptime(str(value or "")[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def trich_xuat_nhanh(text_input, today=None):
+    """
+    Chỉ dùng bộ luật local (vài chục µs, không gọi AI): trả về dict cùng dạng kết quả
+    xuly_ai_gemini, các trường cần AI (tên, địa chỉ, sản phẩm) để trống.
+    Không thấy ngày đặt -> hôm nay; ngay_tra = None nếu chat không ghi dd/mm.
+    """
+    today = today or datetime.now().date()
+    rules = parse_chat(text_input, today)
+    return {
+        "ten_khach_hang": "", "so_dien_thoai": rules.get("sdt", ""), "dia_chi": "",
+        "ngay_dat": rules.get("ngay_dat", today.isoformat()), "ngay_tra": rules.get("ngay_tra"),
+        "shop": rules["shop"],
+        "tong_tien": rules.get("tong_tien", 0), "da_coc": rules.get("da_coc", 0),
+        "httt": rules["httt"], "van_chuyen": rules["van_chuyen"],
+        "co_hen_ngay": rules["co_hen_ngay"], "ghi_chu": "", "items": [],
+    }
+
+# --- CHUẨN BỊ ẢNH GỬI GEMINI ---
+AI_INPUT_MAX_SIDE = 1024  # Cạnh dài tối đa gửi lên model (ảnh lớn hơn model cũng tự thu nhỏ)
+AI_INPUT_QUALITY = 90
+STYLE_REF_PATH = "style_mau.jpg"
+
+def chuan_bi_anh_ai(image_bytes, max_side=AI_INPUT_MAX_SIDE):
+    """
+    Bytes ảnh bất kỳ -> blob {'mime_type', 'data'} JPEG cạnh dài <= max_side.
+    Gửi blob đã nén thay cho PIL.Image (SDK sẽ encode WebP lossless, nặng gấp nhiều lần).
+    JPEG đã đủ nhỏ và đúng chiều thì gửi nguyên bytes, không decode.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == "JPEG" and max(img.size) <= max_side and img.getexif().get(0x0112, 1) == 1:
+        return {"mime_type": "image/jpeg", "data": image_bytes}
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))  # libjpeg decode thẳng ở 1/2, 1/4, 1/8
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "LA", "P"):
+        # Ảnh trong suốt -> nền trắng
+        img = img.convert("RGBA")
+        bg = Image.new("RGB", img.size, "white")
+        bg.paste(img, mask=img.getchannel("A"))
+        img = bg
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=AI_INPUT_QUALITY)
+    return {"mime_type": "image/jpeg", "data": out.getvalue()}
+
+@lru_cache(maxsize=2)
+def _style_ref_blob(path, mtime):
+    # mtime nằm trong key -> thay file style là tự đọc lại
+    with open(path, "rb") as f:
+        return chuan_bi_anh_ai(f.read())
+
+def lay_style_ref():
+    """Ảnh style mẫu thêu đã nén, đọc 1 lần / process (None nếu không có file)."""
+    try:
+        return _style_ref_blob(STYLE_REF_PATH, os.path.getmtime(STYLE_REF_PATH))
+    except OSError:
+        return None
+
+def xuly_ai_gemini(text_input, use_cache=True):
     """
     Hàm trích xuất thông tin đơn hàng và xác định Shop.
+    Shop, vận chuyển, thanh toán, ngày... tính bằng bộ luật local; Gemini chỉ đọc tên, địa chỉ, sản phẩm.
+    Kết quả thành công được cache trên đĩa theo (đoạn chat đã chuẩn hoá, PROMPT_VERSION, ngày).
+    Dict trả về có thêm 'tu_cache' (True nếu lấy từ cache).
     """
+    cache_key = _extract_cache_key(text_input, datetime.now().date())
+    if use_cache:
+        cached = _extract_cache.get(cache_key)
+        if cached:
+            result, raw_text = cached
+            result["tu_cache"] = True
+            return result, raw_text
+
     if not configure_ai(): 
         return None, "Lỗi: Chưa cấu hình Google API Key"
     
     try:
-        today_str = datetime.now().strftime("%d/%m/%Y")
-        
-        system_instruction = f"""
-        Hôm nay là: {today_str}.
-        Nhiệm vụ: Phân tích đoạn chat thành JSON và xác định mã SHOP.
-        
-        1. XÁC ĐỊNH SHOP (Quan trọng):
-           - "TGTD" hoặc "TGTĐ" -> shop: "TGTĐ"
-           - "Inside" hoặc "IS"   -> shop: "Inside"
-           - "Lanh Canh" hoặc "LC" -> shop: "Lanh Canh"
-           - Default: "Inside"
-        
-        2. QUY TẮC TÍNH NGÀY TRẢ HÀNG (ngay_tra):
-           - Bước 1: Kiểm tra xem trong tin nhắn có ghi rõ ngày trả/ngày nhận không?
-             -> Nếu CÓ: Sử dụng ngày đó (định dạng YYYY-MM-DD).
-             -> Nếu KHÔNG: Tính toán tự động dựa trên ngày hôm nay ({today_str}) theo quy tắc sau:
-                + Phân loại sản phẩm trong đơn:
-                  * Loại 1 (Áo): Sweater, Hoodie, Tshirt, Polo, Áo thun, Zip...
-                  * Loại 2 (Quần): Quần short, Quần dài, Jogger...
-                  * Loại 3 (Phụ kiện): Túi, Mũ, Khác...
-                + Logic cộng ngày:
-                  * Trường hợp A: Nếu đơn hàng chỉ chứa 1 Loại sản phẩm duy nhất (Ví dụ: Chỉ toàn Áo, hoặc chỉ toàn Quần) -> Ngày trả = Ngày đặt hàng + 12 ngày.
-                  * Trường hợp B: Nếu đơn hàng mix từ 2 Loại trở lên (Ví dụ: Áo + Quần, Áo + Túi, Quần + Túi...) -> Ngày trả = Ngày đặt hàng + 22 ngày.
-        3. XÁC ĐỊNH NGÀY ĐẶT (ngay_dat):
-           - Kiểm tra xem khách có nhắc đến "ngày đặt", "đơn ngày...", "hôm qua", "hôm kia"... không?
-           - Nếu CÓ: Trích xuất và định dạng YYYY-MM-DD.
-           - Nếu KHÔNG: Mặc định là ngày hôm nay ({today_str}).
-        4. XÁC ĐỊNH VẬN CHUYỂN & THANH TOÁN (Quan trọng):
-           A. Vận chuyển (van_chuyen):
-              - Nếu thấy "bay", "máy bay", "đường bay" -> "Bay ✈"
-              - Nếu thấy "xe ôm", "grap", "hỏa tốc", "gấp", "nhanh" -> "Xe Ôm 🏍"
-              - Mặc định còn lại -> "Thường"
-           
-           B. Hình thức thanh toán (httt):
-              - Nếu thấy "0đ" -> "0đ 📷"
-              - Mặc định còn lại (hoặc ghi COD, thu hộ) -> "Ship COD 💵"
-        5. XÁC ĐỊNH CO_HEN_NGAY (Quan trọng):
-           - Nếu khách dùng từ: "cần trước ngày", "lấy đúng ngày", "deadline", "gấp", "kịp ngày", "chốt ngày"...
-           -> co_hen_ngay: true
-           - Còn lại (để shop tự tính hoặc thoải mái thời gian) -> co_hen_ngay: false
-        6. XÁC ĐỊNH GHI CHÚ ĐẶC BIỆT (ghi_chu):
-           - Trích xuất tất cả thông tin quan trọng mà không nằm trong các trường trên (Ví dụ: khách cho nhiều SĐT, yêu cầu đóng gói, lưu ý về khách hàng, hoặc bất kỳ thông tin bổ sung nào).
-        7. OUTPUT JSON FORMAT:
-        {{
-            "customer_info": {{
-                "ten_khach": "...", "sdt": "...", "dia_chi": "...",
-                "ngay_dat": "YYYY-MM-DD", "ngay_tra": "YYYY-MM-DD", "shop": "...",
-                "tong_tien": 0, "da_coc": 0, "httt": "...", "van_chuyen": "...", 
-                "co_hen_ngay": false, "ghi_chu": "..."
-            }},
-            "products": [ {{ "ten_sp": "...", "mau": "...", "size": "...", "kieu_theu": "..." }} ]
-        }}
-        """
-        
-        # Lưu ý: Model 2.5 flash cho text analysis (nếu key hỗ trợ)
-        # Nếu lỗi model not found, bro đổi về 'gemini-1.5-flash' nhé.
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash', 
-            system_instruction=system_instruction,
-            generation_config={"response_mime_type": "application/json"}
-        )
-        
-        response = model.generate_content(f"Phân tích đơn: {text_input}")
+        model = get_model(EXTRACT_MODEL, EXTRACT_SYSTEM_PROMPT, json_output=True)
+        started = time.perf_counter()
+        response = model.generate_content(build_extract_content(text_input))
+        _ghi_metrics("extract", started, response)
         
         if response.text:
             data = json.loads(response.text)
@@ -106,58 +249,53 @@ def xuly_ai_gemini(text_input):
                 "size": data.get("size", ""), "kieu_theu": data.get("yeu_cau_theu", "")
             }]
             
-            # Chuẩn hóa Shop
-            raw_shop = cust.get("shop", "Inside")
-            shop = "Inside"
-            if raw_shop in ["TGTĐ", "TGTD"]: shop = "TGTĐ"
-            elif raw_shop in ["Lanh Canh", "LC"]: shop = "Lanh Canh"
-
-            return {
+            # Trường theo luật lấy từ bộ luật local; AI bổ sung tên/địa chỉ/sản phẩm/ghi chú
+            # và ngày viết bằng chữ mà luật không đọc được
+            today = datetime.now().date()
+            rules = parse_chat(text_input, today)
+            result = trich_xuat_nhanh(text_input, today)
+            result.update({
                 "ten_khach_hang": cust.get("ten_khach", ""),
-                "so_dien_thoai": cust.get("sdt", ""),
+                "so_dien_thoai": result["so_dien_thoai"] or cust.get("sdt", ""),
                 "dia_chi": cust.get("dia_chi", ""),
-                "ngay_dat": cust.get("ngay_dat", None),
-                "ngay_tra": cust.get("ngay_tra", None),
-                "shop": shop,
-                "tong_tien": int(cust.get("tong_tien", 0)),
-                "da_coc": int(cust.get("da_coc", 0)),
-                "httt": cust.get("httt", "Ship COD"),
-                "van_chuyen": cust.get("van_chuyen", "Thường"),
-                "co_hen_ngay": cust.get("co_hen_ngay", False),
+                # Tiền: Gemini đọc cả ngữ cảnh ("giá 2 cái 500k") -> ưu tiên, luật chỉ là dự phòng
+                "tong_tien": int(cust.get("tong_tien", 0) or 0) or result["tong_tien"],
+                "da_coc": int(cust.get("da_coc", 0) or 0) or result["da_coc"],
                 "ghi_chu": cust.get("ghi_chu", ""),
-                "items": products 
-            }, response.text
+                "items": products,
+            })
+            # Ngày: luật (dd/mm, hôm qua/kia) -> Gemini -> mặc định (hôm nay / +12, +22 ngày)
+            ngay_dat = _iso_date(rules.get("ngay_dat")) or _iso_date(cust.get("ngay_dat")) or today
+            ngay_tra = _iso_date(rules.get("ngay_tra")) or _iso_date(cust.get("ngay_tra")) or tinh_ngay_tra(ngay_dat, products)
+            result["ngay_dat"], result["ngay_tra"] = ngay_dat.isoformat(), ngay_tra.isoformat()
+            _extract_cache.set(cache_key, [result, response.text])
+            result["tu_cache"] = False
+            return result, response.text
             
     except Exception as e:
         return None, f"Lỗi: {str(e)}"
     
     return None, "AI rỗng"
 
-def gen_anh_mau_theu(image_input_bytes, custom_prompt):
+def gen_anh_mau_theu(image_input_bytes, custom_prompt, raise_errors=False):
     """
     Hàm tạo ảnh mẫu thêu bằng Google Gemini 3 Image Preview.
     Gửi: [Prompt + Ảnh Upload + Ảnh Style Ref]
+    raise_errors=True: ném lỗi API ra ngoài (job nền cần biết lỗi quota để thử lại).
     """
     if not configure_ai(): 
         print("❌ Chưa cấu hình AI")
         return None
     
     try:
-        # 1. Cấu hình model Image Generation mới nhất
-        model = genai.GenerativeModel(model_name='gemini-3-pro-image-preview')
-        
-        # 2. Load ảnh input
-        img_input = Image.open(io.BytesIO(image_input_bytes))
+        # 1. Model Image Generation (dùng chung trong process)
+        model = get_model(IMAGE_MODEL)
         
-        # 3. Load ảnh style reference
-        style_img = None
-        style_path = "style_mau.jpg"
+        # 2. Ảnh input: thu nhỏ + nén JPEG trước khi gửi
+        img_input = chuan_bi_anh_ai(image_input_bytes)
         
-        if os.path.exists(style_path):
-            try:
-                style_img = Image.open(style_path)
-                print("✅ Đã load style_mau.jpg")
-            except: pass
+        # 3. Ảnh style reference (cache trong process)
+        style_img = lay_style_ref()
         
         # 4. Prompt Engineering cho Thêu
         full_prompt = f"""tạo file thêu cho phần đầu của con vật, giữ đúng góc mặt, màu lông, chi tiết. tương tự như mẫu file thêu ở hình mẫu
@@ -171,7 +309,10 @@ def gen_anh_mau_theu(image_input_bytes, custom_prompt):
         
         # 6. Generate
         print(f"🎨 Đang gen ảnh với {model.model_name}...")
+        started = time.perf_counter()
         response = model.generate_content(content_parts)
+        _ghi_metrics("gen_anh_mau", started, response,
+                     payload_bytes=len(img_input["data"]) + (len(style_img["data"]) if style_img else 0))
         
         # 7. Extract Image Data
         if response.candidates:
@@ -185,30 +326,34 @@ def gen_anh_mau_theu(image_input_bytes, custom_prompt):
         
     except Exception as e:
         print(f"❌ Lỗi gen ảnh AI: {e}")
+        if raise_errors: raise
         return None
 
-def generate_image_from_ref(image_bytes, prompt_text):
+def generate_image_from_ref(image_bytes, prompt_text, raise_errors=False):
     """
     Tạo ảnh mới dựa trên ảnh gốc và câu lệnh prompt.
     Sử dụng model gemini-3-pro-image-preview.
+    raise_errors=True: ném lỗi API ra ngoài thay vì trả None.
     """
     if not configure_ai():
         print("❌ Chưa cấu hình AI")
         return None
 
     try:
-        # 1. Cấu hình Model
-        model = genai.GenerativeModel('gemini-3-pro-image-preview')
+        # 1. Model (dùng chung trong process)
+        model = get_model(IMAGE_MODEL)
         
-        # 2. Xử lý ảnh Input
-        img_input = Image.open(io.BytesIO(image_bytes))
+        # 2. Ảnh input: thu nhỏ + nén JPEG trước khi gửi
+        img_input = chuan_bi_anh_ai(image_bytes)
         
         # 3. Tạo list content gửi đi
         content = [prompt_text, img_input]
         
         # 4. Generate
         print(f"🎨 Đang edit ảnh với prompt: {prompt_text}...")
+        started = time.perf_counter()
         response = model.generate_content(content)
+        _ghi_metrics("edit_anh", started, response, payload_bytes=len(img_input["data"]))
         
         # 5. Xử lý kết quả trả về
         if response.candidates:
@@ -222,4 +367,5 @@ def generate_image_from_ref(image_bytes, prompt_text):
         
     except Exception as e:
         print(f"❌ Lỗi generate_image_from_ref: {e}")
+        if raise_errors: raise
         return None
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+Bộ luật trích xuất nhanh từ đoạn chat (không gọi AI).
+Các trường có quy tắc cố định trong prompt cũ được tính tại chỗ bằng regex đã compile:
+shop, SĐT, vận chuyển, thanh toán, co_hen_ngay, ngày đặt/ngày trả, tiền.
+Gemini chỉ còn phải đọc tên, địa chỉ, sản phẩm, ghi chú (và tiền/SĐT/ngày viết bằng chữ
+nếu luật không bắt được). Tiền do Gemini đọc được ưu tiên hơn luật (luật chỉ là dự phòng).
+"""
+import re
+import unicodedata
+from datetime import date, timedelta
+
+from modules.search_index import fold_text, normalize_phone
+
+# --- SHOP ---
+# (regex trên chữ gốc, regex trên chữ không dấu): mã viết tắt LC/IS phải viết hoa
+# (tránh "is" tiếng Anh), tên shop viết hoa/thường/không dấu đều được
+_SHOP_RULES = [
+    (re.compile(r"\bTGT[DĐ]\b", re.I), None, "TGTĐ"),
+    (re.compile(r"\bLC\b"), re.compile(r"\blanh\s*canh\b"), "Lanh Canh"),
+    (re.compile(r"\bIS\b"), re.compile(r"\binside\b"), "Inside"),
+]
+DEFAULT_SHOP = "Inside"
+
+# --- VẬN CHUYỂN / THANH TOÁN / HẸN NGÀY ---
+# Từ dễ nhầm khi bỏ dấu ("bay"/"bảy", "gấp"/"gặp") -> so trên chữ có dấu; còn lại so trên chữ không dấu
+_BAY_RE = re.compile(r"\bmáy bay\b|\bđường bay\b|\bbay\b")
+_BAY_FOLD_RE = re.compile(r"\bmay bay\b|\bduong bay\b")
+_XE_OM_RE = re.compile(r"\bgấp\b|\bnhanh\b")
+_XE_OM_FOLD_RE = re.compile(r"\bxe om\b|\bgrap\b|\bgrab\b|\bhoa toc\b")
+_ZERO_D_RE = re.compile(r"(?<![\d.,])0\s*(?:đ|d|vnd)\b")
+_HEN_NGAY_RE = re.compile(r"\bgấp\b")
+_HEN_NGAY_FOLD_RE = re.compile(r"can truoc ngay|lay dung ngay|\bdeadline\b|kip ngay|chot ngay")
+
+# --- SĐT ---
+_PHONE_RE = re.compile(r"(?<!\d)(?:\+?84|0)(?:[\s.\-]?\d){8,10}(?!\d)")
+_VALID_PHONE_RE = re.compile(r"^0(?:[35789]\d{8}|2\d{9})$")
+
+# --- NGÀY ---
+_DMY = r"(\d{1,2})[/\-.](\d{1,2})(?:[/\-.](\d{2,4}))?"
+_NGAY_DAT_RE = re.compile(r"(?:ngay dat|don ngay|dat ngay)\s*(?:la\s*)?" + _DMY)
+_NGAY_TRA_RE = re.compile(r"\b(?:tra|nhan|lay|giao|truoc|deadline)\s*(?:hang\s*)?(?:dung\s*)?(?:vao\s*)?(ngay\s*)?" + _DMY)
+# "giao 1/2 cái áo": số theo sau là từ chỉ số lượng -> không phải ngày (trừ khi có "ngày" hoặc năm)
+_SO_LUONG_SAU_RE = re.compile(r"\s*(?:cai|chiec|bo|sp|san pham|mon|ao|quan|con|doi|set|phan)\b")
+_HOM_QUA_RE = re.compile(r"\bhom qua\b")
+_HOM_KIA_RE = re.compile(r"\bhom kia\b")
+
+# --- TIỀN ---
+# Chỉ nhận số có đơn vị tiền hoặc số tiền đầy đủ (>= 1.000); "giá 2 cái 500k" để Gemini đọc
+_AMOUNT = r"(\d+(?:[.,]\d+)*)\s*(k|nghin|ngan|tr|trieu|d|vnd)?\b"
+_MIN_AMOUNT = 1000
+_TONG_RE = re.compile(r"\b(?:tong(?: tien| cong)?|tt)\s*[:=]?\s*" + _AMOUNT)
+_COC_RE = re.compile(r"\b(?:da coc|coc|dat coc|ck truoc)\s*[:=]?\s*" + _AMOUNT)
+
+# --- PHÂN LOẠI SẢN PHẨM (tính ngày trả) ---
+NGAY_TRA_MOT_LOAI = 12   # Đơn chỉ 1 loại sản phẩm
+NGAY_TRA_NHIEU_LOAI = 22  # Đơn mix từ 2 loại trở lên
+_QUAN_RE = re.compile(r"\bquan\b|\bshort\b|\bjogger\b")
+_AO_RE = re.compile(r"\bao\b|sweater|hoodie|t-?shirt|\bpolo\b|\bthun\b|\bzip\b|\btee\b")
+
+def _lower(text):
+    return unicodedata.normalize("NFC", text).lower()
+
+def _parse_dmy(d, m, y, today):
+    """dd/mm[/yy] -> date; thiếu năm thì lấy năm nay (nếu lùi quá 2 tháng so với hôm nay thì sang năm sau)."""
+    try:
+        if y:
+            year = int(y) + (2000 if len(y) == 2 else 0)
+            return date(year, int(m), int(d))
+        val = date(today.year, int(m), int(d))
+        if val < today - timedelta(days=60):
+            val = date(today.year + 1, int(m), int(d))
+        return val
+    except ValueError:
+        return None
+
+def _parse_amount(num, unit):
+    """'850k' -> 850000, '1,5tr' -> 1500000, '850.000đ' -> 850000."""
+    unit = unit or ""
+    if unit in ("k", "nghin", "ngan", "tr", "trieu"):
+        value = float(num.replace(",", "."))
+        return int(round(value * (1_000_000 if unit in ("tr", "trieu") else 1000)))
+    return int(re.sub(r"[.,]", "", num))
+
+def phan_loai_san_pham(ten_sp):
+    """'ao' / 'quan' / 'phu_kien' theo tên sản phẩm."""
+    name = fold_text(ten_sp)
+    if _QUAN_RE.search(name): return "quan"
+    if _AO_RE.search(name): return "ao"
+    return "phu_kien"
+
+def tinh_ngay_tra(ngay_dat, items):
+    """Ngày đặt + 12 ngày nếu đơn chỉ 1 loại sản phẩm, + 22 ngày nếu mix nhiều loại."""
+    loai = {phan_loai_san_pham(it.get("ten_sp")) for it in items if it.get("ten_sp")}
+    return ngay_dat + timedelta(days=NGAY_TRA_NHIEU_LOAI if len(loai) > 1 else NGAY_TRA_MOT_LOAI)
+
+def parse_chat(text, today=None):
+    """
+    Trích các trường theo luật. Trả về dict các trường đã xác định được:
+    shop, van_chuyen, httt, co_hen_ngay (luôn có);
+    sdt, ngay_dat, ngay_tra, tong_tien, da_coc (chỉ có khi tìm thấy trong đoạn chat).
+    Ngày viết bằng chữ ("thứ 7", "tuần sau") không đọc ở đây -> để Gemini xử lý.
+    """
+    today = today or date.today()
+    raw = str(text or "")
+    low = _lower(raw)
+    fold = fold_text(low)
+    out = {}
+
+    out["shop"] = next((shop for rx, rx_fold, shop in _SHOP_RULES
+                        if rx.search(raw) or (rx_fold and rx_fold.search(fold))), DEFAULT_SHOP)
+
+    if _BAY_RE.search(low) or _BAY_FOLD_RE.search(fold): out["van_chuyen"] = "Bay ✈"
+    elif _XE_OM_RE.search(low) or _XE_OM_FOLD_RE.search(fold): out["van_chuyen"] = "Xe Ôm 🏍"
+    else: out["van_chuyen"] = "Thường"
+
+    out["httt"] = "0đ 📷" if _ZERO_D_RE.search(low) else "Ship COD 💵"
+    out["co_hen_ngay"] = bool(_HEN_NGAY_RE.search(low) or _HEN_NGAY_FOLD_RE.search(fold))
+
+    for m in _PHONE_RE.finditer(raw):
+        sdt = normalize_phone(m.group())
+        if _VALID_PHONE_RE.match(sdt):
+            out["sdt"] = sdt
+            break
+
+    ngay_dat = None
+    m = _NGAY_DAT_RE.search(fold)
+    if m:
+        ngay_dat = _parse_dmy(*m.groups(), today)
+    elif _HOM_KIA_RE.search(fold):
+        ngay_dat = today - timedelta(days=2)
+    elif _HOM_QUA_RE.search(fold):
+        ngay_dat = today - timedelta(days=1)
+    if ngay_dat:
+        out["ngay_dat"] = ngay_dat.isoformat()
+    ngay_dat = ngay_dat or today
+
+    for m in _NGAY_TRA_RE.finditer(fold):
+        co_ngay, d, mo, y = m.groups()
+        if not (co_ngay or y) and _SO_LUONG_SAU_RE.match(fold, m.end()):
+            continue
+        ngay_tra = _parse_dmy(d, mo, y, ngay_dat)
+        if ngay_tra:
+            out["ngay_tra"] = ngay_tra.isoformat()
+        break
+
+    for key, rx in (("tong_tien", _TONG_RE), ("da_coc", _COC_RE)):
+        m = rx.search(fold)
+        if m:
+            try: value = _parse_amount(*m.groups())
+            except ValueError: continue
+            if value >= _MIN_AMOUNT:
+                out[key] = value
+    return out
@@ -3,8 +3,19 @@ import os
 import pandas as pd
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from PIL import Image
+from PIL import Image, ImageOps
 import io
+import threading
+import time
+import hashlib
+import multiprocessing
+import re
+import unicodedata
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from modules.order_prep import tinh_kpi_don_hang
+from modules.deadline_index import DeadlineIndex
+from modules.search_index import OrderSearchIndex, SEARCH_TOP_N, CustomerIndex, CUSTOMER_SEARCH_LIMIT
 
 # 1. Setup Supabase
 load_dotenv()
@@ -45,14 +56,293 @@ def kiem_tra_ket_noi():
     except:
         return False
 
+# --- ORDER CACHE (DÙNG CHUNG CHO CẢ PROCESS) ---
+# Bảng orders chỉ nạp full 1 lần. Các lần rerun sau chỉ kéo những dòng có
+# updated_at >= watermark - ORDER_SYNC_OVERLAP (cần cột updated_at, xem sql/001_orders_updated_at.sql).
+# Delta theo updated_at không thấy đơn bị xoá và có thể sót giao dịch commit trễ hơn cửa sổ
+# overlap -> định kỳ đối chiếu (ma_don, updated_at) của cả bảng với cache.
+ORDER_SYNC_INTERVAL = 5          # Giây tối thiểu giữa 2 lần hỏi DB (trừ khi cache bị đánh dấu cũ)
+ORDER_SYNC_OVERLAP = 5           # Giây đọc lùi trước watermark (giao dịch commit sau khi watermark đã qua)
+ORDER_RECONCILE_INTERVAL = 300   # Giây giữa 2 lần đối chiếu toàn bảng (đơn bị xoá / sửa bị sót)
+FETCH_PAGE_SIZE = 1000    # PostgREST giới hạn số dòng mỗi request -> nạp theo trang
+
+_order_cache = {"df": None, "watermark": None, "synced_at": 0.0, "stale": False, "reconciled_at": 0.0}
+_order_cache_lock = threading.Lock()
+
+def _select_all_rows(build_query, page_size=FETCH_PAGE_SIZE):
+    """
+    Chạy query theo từng trang .range() để không bị cắt ở giới hạn max-rows.
+    Query có select(..., count="exact") -> đọc tới khi đủ số dòng server báo
+    (đúng cả khi max-rows của server nhỏ hơn page_size), thiếu dòng -> ValueError.
+    """
+    rows = []
+    start = 0
+    while True:
+        res = build_query().range(start, start + page_size - 1).execute()
+        batch = res.data or []
+        rows.extend(batch)
+        total = getattr(res, "count", None)
+        if total is None:
+            if len(batch) < page_size:
+                return rows
+        elif len(rows) >= total:
+            return rows
+        elif not batch:
+            raise ValueError(f"Chỉ đọc được {len(rows)}/{total} dòng")
+        start += len(batch) if total is not None else page_size
+
+def _order_watermark(df):
+    if df.empty or "updated_at" not in df.columns:
+        return None
+    return df["updated_at"].dropna().max() or None
+
+def _overlap_watermark(wm, seconds=ORDER_SYNC_OVERLAP):
+    """Watermark lùi lại `seconds` giây (không đọc được -> giữ nguyên)."""
+    try:
+        return (pd.Timestamp(wm) - pd.Timedelta(seconds=seconds)).isoformat()
+    except (ValueError, TypeError):
+        return wm
+
+def _max_watermark(*marks):
+    marks = [m for m in marks if m]
+    return max(marks, key=pd.Timestamp) if marks else None
+
+def _changed_rows(df, delta):
+    """Chỉ giữ các dòng delta mới / có updated_at khác cache (bỏ dòng đọc lại do overlap)."""
+    if delta.empty or df.empty or "updated_at" not in df.columns or "updated_at" not in delta.columns:
+        return delta
+    known = dict(zip(df["ma_don"], df["updated_at"]))
+    mask = [known.get(m) != u for m, u in zip(delta["ma_don"], delta["updated_at"])]
+    return delta[mask]
+
+def _merge_order_delta(df, delta):
+    """Thay các dòng cũ bằng dòng mới theo ma_don, giữ thứ tự created_at giảm dần."""
+    if delta.empty:
+        return df
+    if df.empty:
+        return delta.sort_values("created_at", ascending=False, ignore_index=True)
+    kept = df[~df["ma_don"].isin(delta["ma_don"])]
+    merged = pd.concat([kept, delta], ignore_index=True)
+    return merged.sort_values("created_at", ascending=False, ignore_index=True)
+
+_order_cache_listeners = []  # Hàm fn(df, full) gọi mỗi khi cache đơn hàng thay đổi
+
+def register_order_cache_listener(fn):
+    """
+    Đăng ký hàm nhận thay đổi của cache đơn hàng (dùng cho các chỉ mục trong RAM).
+    fn(df, full, removed): full=True -> df là toàn bộ bảng; full=False -> df chỉ gồm các dòng
+    mới/sửa, removed là các ma_don đã bị xoá trên DB.
+    Hàm được gọi trong lock của cache nên phải chạy nhanh.
+    """
+    if fn not in _order_cache_listeners:
+        _order_cache_listeners.append(fn)
+    # Cache đã có dữ liệu -> nạp ngay cho listener mới
+    with _order_cache_lock:
+        if _order_cache["df"] is not None:
+            _notify_order_listeners(_order_cache["df"], True, [fn])
+
+def _notify_order_listeners(df, full, listeners=None, removed=()):
+    for fn in listeners or _order_cache_listeners:
+        try:
+            fn(df, full, removed)
+        except Exception as e:
+            print(f"Lỗi cập nhật chỉ mục đơn hàng: {e}")
+
+def invalidate_orders_cache(full=False):
+    """
+    Gọi sau mỗi lần app tự ghi vào bảng orders.
+    - full=False: lần fetch kế tiếp sẽ kéo delta ngay, bỏ qua ORDER_SYNC_INTERVAL.
+    - full=True: bỏ cache, lần fetch kế tiếp nạp lại toàn bộ bảng.
+    """
+    with _order_cache_lock:
+        if full:
+            _order_cache.update(df=None, watermark=None, synced_at=0.0, stale=False, reconciled_at=0.0)
+        else:
+            _order_cache["stale"] = True
+
+def _reconcile_orders(cache):
+    """
+    Đối chiếu (ma_don, updated_at) của cả bảng với cache (gọi trong lock của cache):
+    gỡ đơn đã bị xoá trên DB, nạp lại đơn mới / có updated_at khác cache.
+    Chỉ tải 2 cột cho cả bảng, dòng đầy đủ chỉ cho các đơn bị lệch.
+    """
+    keys = _select_all_rows(lambda: supabase.table("orders").select("ma_don, updated_at").order("id"))
+    server = {r["ma_don"]: r.get("updated_at") for r in keys if r.get("ma_don")}
+    df = cache["df"]
+    known = dict(zip(df["ma_don"], df["updated_at"])) if not df.empty and "updated_at" in df.columns else {}
+    removed = [m for m in known if m not in server]
+    stale = [m for m, u in server.items() if m not in known or known[m] != u]
+
+    rows = []
+    for chunk in _chunks(stale):
+        rows.extend(_select_all_rows(lambda: supabase.table("orders").select("*").in_("ma_don", chunk).order("id")))
+    delta = pd.DataFrame(rows)
+    if removed:
+        df = df[~df["ma_don"].isin(removed)].reset_index(drop=True)
+    cache["df"] = _merge_order_delta(df, delta)
+    cache["watermark"] = _max_watermark(cache["watermark"], _order_watermark(delta))
+    if removed or not delta.empty:
+        print(f"Đối chiếu cache đơn hàng: gỡ {len(removed)} đơn đã xoá, nạp lại {len(delta)} đơn")
+        _notify_order_listeners(delta, False, removed=removed)
+
 def fetch_all_orders():
     try:
-        response = supabase.table("orders").select("*").order("created_at", desc=True).execute()
-        return pd.DataFrame(response.data)
+        with _order_cache_lock:
+            cache = _order_cache
+            now = time.time()
+            need_sync = cache["stale"] or (now - cache["synced_at"] >= ORDER_SYNC_INTERVAL)
+
+            if cache["df"] is None or (need_sync and cache["watermark"] is None):
+                # Lần đầu (hoặc DB chưa có updated_at) -> nạp full
+                rows = _select_all_rows(lambda: supabase.table("orders").select("*").order("created_at", desc=True).order("id", desc=True))
+                cache["df"] = pd.DataFrame(rows)
+                cache["watermark"] = _order_watermark(cache["df"])
+                cache["synced_at"], cache["stale"], cache["reconciled_at"] = now, False, now
+                _notify_order_listeners(cache["df"], True)
+            elif need_sync:
+                # Chỉ kéo các dòng thay đổi từ watermark, lùi lại ORDER_SYNC_OVERLAP giây
+                # (gte + overlap: không sót dòng cùng timestamp / giao dịch commit trễ)
+                wm = cache["watermark"]
+                since = _overlap_watermark(wm)
+                rows = _select_all_rows(lambda: supabase.table("orders").select("*").gte("updated_at", since).order("updated_at").order("id"))
+                delta = _changed_rows(cache["df"], pd.DataFrame(rows))
+                cache["df"] = _merge_order_delta(cache["df"], delta)
+                cache["watermark"] = _max_watermark(wm, _order_watermark(delta))
+                cache["synced_at"], cache["stale"] = now, False
+                if not delta.empty:
+                    _notify_order_listeners(delta, False)
+                if now - cache["reconciled_at"] >= ORDER_RECONCILE_INTERVAL:
+                    _reconcile_orders(cache)
+                    cache["reconciled_at"] = now
+
+            # Trả về bản copy vì UI sửa trực tiếp trên DataFrame
+            return cache["df"].copy()
     except Exception as e:
         print(f"Lỗi fetch data: {e}")
         return pd.DataFrame()
 
+# --- TÌM KIẾM ĐƠN (CHỈ MỤC TRONG RAM, CẬP NHẬT THEO CACHE ĐƠN HÀNG) ---
+order_search_index = OrderSearchIndex()
+
+def _sync_search_index(df, full, removed=()):
+    if full:
+        order_search_index.rebuild(df)
+    else:
+        for ma_don in removed:
+            order_search_index.remove(ma_don)
+        order_search_index.upsert_frame(df)
+
+register_order_cache_listener(_sync_search_index)
+
+def search_orders(term, limit=SEARCH_TOP_N):
+    """
+    Tìm đơn theo mã / tên khách (không dấu) / SĐT, trả về list [(ma_don, label)] tốt nhất.
+    Chỉ mục được cập nhật mỗi lần fetch_all_orders() đồng bộ cache.
+    """
+    return order_search_index.search(term, limit)
+
+# --- CHỈ MỤC HẠN TRẢ (NHẮC VIỆC + KHỐI LƯỢNG THEO NGÀY) ---
+deadline_index = DeadlineIndex(STATUS_DONE + STATUS_CANCEL)
+
+def _sync_deadline_index(df, full, removed=()):
+    if full:
+        deadline_index.rebuild(df)
+    else:
+        for ma_don in removed:
+            deadline_index.remove(ma_don)
+        deadline_index.upsert_frame(df)
+
+register_order_cache_listener(_sync_deadline_index)
+
+# --- DASHBOARD QUERY (LỌC & PHÂN TRANG NGAY TRÊN DB) ---
+DASHBOARD_PAGE_SIZE = 50
+
+def _apply_order_filters(query, filters):
+    """
+    Chuyển state của bộ lọc Dashboard thành điều kiện query phía server.
+    filters: dict {trang_thai, shop, tags, co_hen_ngay, chua_in, ngay_dat, ngay_tra}
+    (ngay_dat/ngay_tra là tuple (từ ngày, đến ngày) kiểu date).
+    """
+    f = filters or {}
+    if f.get("trang_thai"): query = query.in_("trang_thai", f["trang_thai"])
+    if f.get("shop"): query = query.in_("shop", f["shop"])
+    # Đơn có ít nhất 1 trong các tag được chọn (overlap mảng)
+    if f.get("tags"): query = query.ov("tags", f["tags"])
+    if f.get("co_hen_ngay"): query = query.eq("co_hen_ngay", True)
+    # Chưa in = da_in là false hoặc null
+    if f.get("chua_in"): query = query.not_.is_("da_in", "true")
+    for col in ("ngay_dat", "ngay_tra"):
+        rng = f.get(col)
+        if rng and len(rng) == 2:
+            tu, den = rng
+            # Cận trên dùng < ngày kế tiếp để không mất đơn có phần giờ
+            query = query.gte(col, tu.isoformat()).lt(col, (den + timedelta(days=1)).isoformat())
+    return query
+
+def fetch_orders_page(filters=None, cursor=None, page_size=DASHBOARD_PAGE_SIZE):
+    """
+    Lấy 1 trang đơn hàng đã lọc, phân trang keyset theo (created_at, id) giảm dần.
+    cursor: (created_at, id) của dòng cuối trang trước, None = trang đầu.
+    Trả về: (DataFrame, cursor trang sau hoặc None nếu hết)
+    """
+    try:
+        query = _apply_order_filters(supabase.table("orders").select("*"), filters)
+        if cursor:
+            c_time, c_id = cursor
+            query = query.or_(f'created_at.lt."{c_time}",and(created_at.eq."{c_time}",id.lt.{c_id})')
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        res = query.order("created_at", desc=True).order("id", desc=True).limit(page_size + 1).execute()
+        rows = res.data or []
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1]["created_at"], rows[-1]["id"])
+        return pd.DataFrame(rows), next_cursor
+    except Exception as e:
+        print(f"Lỗi fetch trang đơn hàng: {e}")
+        return pd.DataFrame(), None
+
+def fetch_order_kpis(filters=None):
+    """
+    Tính KPI Dashboard (số đơn, doanh thu...) bằng 1 query tổng hợp riêng.
+    Ưu tiên RPC dashboard_kpis (sql/002_dashboard_query.sql); nếu DB chưa có hàm
+    thì chỉ kéo 3 cột cần thiết rồi cộng ở Python.
+    """
+    f = filters or {}
+    kpi = {"tong_don": 0, "da_xong": 0, "da_huy": 0, "dang_xu_ly": 0,
+           "dt_ban_hang": 0, "dt_coc": 0, "dt_thuc_nhan": 0}
+    try:
+        ngay_dat = f.get("ngay_dat") if f.get("ngay_dat") and len(f["ngay_dat"]) == 2 else (None, None)
+        ngay_tra = f.get("ngay_tra") if f.get("ngay_tra") and len(f["ngay_tra"]) == 2 else (None, None)
+        params = {
+            "p_trang_thai": f.get("trang_thai") or None,
+            "p_shop": f.get("shop") or None,
+            "p_tags": f.get("tags") or None,
+            "p_co_hen_ngay": bool(f.get("co_hen_ngay")),
+            "p_chua_in": bool(f.get("chua_in")),
+            "p_ngay_dat_tu": ngay_dat[0].isoformat() if ngay_dat[0] else None,
+            "p_ngay_dat_den": ngay_dat[1].isoformat() if ngay_dat[1] else None,
+            "p_ngay_tra_tu": ngay_tra[0].isoformat() if ngay_tra[0] else None,
+            "p_ngay_tra_den": ngay_tra[1].isoformat() if ngay_tra[1] else None,
+            "p_status_done": STATUS_DONE,
+            "p_status_cancel": STATUS_CANCEL,
+        }
+        res = supabase.rpc("dashboard_kpis", params).execute()
+        row = res.data[0] if isinstance(res.data, list) and res.data else (res.data or {})
+        for k in kpi:
+            if k in row and row[k] is not None:
+                kpi[k] = float(row[k]) if k.startswith("dt_") else int(row[k])
+    except Exception as e:
+        print(f"⚠️ RPC dashboard_kpis lỗi, tính KPI phía client: {e}")
+        try:
+            rows = _select_all_rows(lambda: _apply_order_filters(
+                supabase.table("orders").select("trang_thai, thanh_tien, da_coc"), f).order("id"))
+            kpi.update(tinh_kpi_don_hang(pd.DataFrame(rows), STATUS_DONE, STATUS_CANCEL))
+        except Exception as e2:
+            print(f"Lỗi tính KPI: {e2}")
+    kpi["dang_xu_ly"] = kpi["tong_don"] - kpi["da_xong"] - kpi["da_huy"]
+    return kpi
+
 def get_order_details(ma_don):
     try:
         order = supabase.table("orders").select("*").eq("ma_don", ma_don).single().execute()
@@ -62,6 +352,42 @@ def get_order_details(ma_don):
     except:
         return None, []
 
+BULK_CHUNK_SIZE = 200  # Số mã đơn tối đa trong 1 điều kiện in_() để URL không quá dài
+
+def _chunks(values, size=BULK_CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def get_orders_with_items(ma_don_list, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Lấy header + items của nhiều đơn cùng lúc (thay cho vòng lặp get_order_details).
+    Mỗi chunk: 1 query in_("ma_don") cho orders + items in_("order_id") đọc theo trang
+    (1 chunk có thể vượt max-rows của PostgREST), kiểm tra đủ số dòng bằng count="exact".
+    Trả về: list [{'order_info': ..., 'items': [...]}, ...] theo đúng thứ tự đầu vào,
+    bỏ qua mã không tồn tại.
+    """
+    # Bỏ trùng nhưng giữ thứ tự
+    codes = list(dict.fromkeys(str(m) for m in ma_don_list if m))
+    orders_by_code = {}
+    items_by_code = {c: [] for c in codes}
+    try:
+        for chunk in _chunks(codes, chunk_size):
+            o_res = supabase.table("orders").select("*").in_("ma_don", chunk).execute()
+            for o in o_res.data or []:
+                orders_by_code[o["ma_don"]] = o
+            items = _select_all_rows(lambda: supabase.table("order_items").select("*", count="exact")
+                                     .in_("order_id", chunk).order("id"))
+            for it in items:
+                items_by_code.setdefault(it["order_id"], []).append(it)
+    except Exception as e:
+        print(f"❌ Lỗi get_orders_with_items: {e}")
+        return []
+
+    return [
+        {"order_info": orders_by_code[c], "items": items_by_code.get(c, [])}
+        for c in codes if c in orders_by_code
+    ]
+
 def lay_hoac_tao_khach_hang(ten_khach, sdt, dia_chi, shop, facebook_id=None):
     """
     Kiểm tra SĐT đã tồn tại chưa:
@@ -111,19 +437,99 @@ def lay_hoac_tao_khach_hang(ten_khach, sdt, dia_chi, shop, facebook_id=None):
         print(f"❌ Lỗi xử lý khách hàng: {e}")
         return None
 
-def lay_danh_sach_khach_hang(search_term=None):
-    """Lấy danh sách khách hàng, có hỗ trợ tìm kiếm"""
+# --- CHỈ MỤC KHÁCH HÀNG (CACHE TRONG RAM, ĐỒNG BỘ THEO updated_at) ---
+CUSTOMER_SYNC_INTERVAL = 30  # Giây giữa 2 lần kéo delta khach_hang
+
+customer_index = CustomerIndex()
+_customer_sync = {"loaded": False, "watermark": None, "synced_at": 0.0, "stale": False}
+_customer_sync_lock = threading.Lock()
+
+def invalidate_customer_cache():
+    """Gọi sau khi app ghi vào khach_hang -> lần tra kế tiếp kéo delta ngay."""
+    with _customer_sync_lock:
+        _customer_sync["stale"] = True
+
+def sync_customer_index(force=False):
+    """
+    Đồng bộ chỉ mục khách hàng: lần đầu nạp full, sau đó chỉ kéo các dòng có
+    updated_at >= watermark (sql/005_khach_hang_updated_at.sql).
+    DB chưa có updated_at -> nạp lại full mỗi CUSTOMER_SYNC_INTERVAL giây.
+    """
     try:
-        query = supabase.table("khach_hang").select("*").order("created_at", desc=True) # Sort by recently created
-        
-        if search_term:
-            # Tìm theo SĐT hoặc Tên (dùng ilike cho tên)
-            # Cú pháp OR trong Supabase: .or_("col1.op.val,col2.op.val")
-            query = query.or_(f"sdt.ilike.%{search_term}%,ho_ten.ilike.%{search_term}%")
-        
-        response = query.execute()
-        return pd.DataFrame(response.data)
+        with _customer_sync_lock:
+            state = _customer_sync
+            now = time.time()
+            if state["loaded"] and not (force or state["stale"] or now - state["synced_at"] >= CUSTOMER_SYNC_INTERVAL):
+                return
+            if not state["loaded"] or state["watermark"] is None:
+                rows = _select_all_rows(lambda: supabase.table("khach_hang").select("*").order("id"))
+                customer_index.rebuild(rows)
+                state["loaded"] = True
+            else:
+                rows = _select_all_rows(lambda: supabase.table("khach_hang").select("*").gte("updated_at", state["watermark"]).order("updated_at").order("id"))
+                customer_index.upsert(rows)
+            marks = [r["updated_at"] for r in rows if r.get("updated_at")]
+            if marks:
+                state["watermark"] = max(marks)
+            state["synced_at"], state["stale"] = now, False
     except Exception as e:
+        print(f"Lỗi đồng bộ chỉ mục khách hàng: {e}")
+
+def lay_khach_hang_theo_sdt(sdt):
+    """Lấy 1 khách theo SĐT (mọi định dạng) từ chỉ mục, None nếu không có (trùng SĐT -> khách mua nhiều nhất)."""
+    sync_customer_index()
+    return customer_index.get(sdt)
+
+def lay_danh_sach_khach_hang(search_term=None, limit=CUSTOMER_SEARCH_LIMIT):
+    """
+    Lấy danh sách khách hàng từ chỉ mục trong RAM (không quét bảng trên DB).
+    - Có search_term: tra tiền tố SĐT / tên không dấu, tối đa `limit` dòng.
+    - Không có: toàn bộ khách, mới tạo trước.
+    """
+    sync_customer_index()
+    if search_term:
+        return pd.DataFrame(customer_index.search(search_term, limit))
+    df = pd.DataFrame(customer_index.all())
+    if not df.empty and "created_at" in df.columns:
+        df = df.sort_values("created_at", ascending=False, ignore_index=True)
+    return df
+
+# Hạng khách (cột hang trong khach_hang_stats, sql/006_khach_hang_stats.sql)
+CUSTOMER_TIERS = ["Bạc", "Vàng", "Kim Cương"]
+
+CUSTOMER_PAGE_SIZE = 100  # Số khách mỗi trang của trang Khách hàng
+
+def lay_khach_hang_tong_hop(hang=None, min_tieu=0, ids=None, limit=CUSTOMER_PAGE_SIZE, after=None):
+    """
+    Khách hàng kèm số liệu tổng hợp (tong_tieu, so_don, don_cuoi, hang) từ view
+    khach_hang_tong_hop - bảng stats được trigger cập nhật, lọc bằng 1 query có index.
+    - hang: 1 giá trị trong CUSTOMER_TIERS; min_tieu: chi tiêu tối thiểu
+    - ids: chỉ lấy các khách này (kết quả tìm kiếm từ chỉ mục khách hàng)
+    - limit: số dòng tối đa (mặc định 1 trang; None = lấy hết)
+    - after: (stats_tong_tieu, id) của dòng cuối trang trước -> trang kế (phân trang keyset,
+      không dùng offset)
+    Sắp xếp chi tiêu giảm dần, cùng chi tiêu thì id tăng dần.
+    """
+    if ids is not None and len(ids) == 0:
+        return pd.DataFrame()
+    try:
+        def build():
+            q = supabase.table("khach_hang_tong_hop").select("*")
+            if hang: q = q.eq("hang", hang)
+            if min_tieu: q = q.gte("stats_tong_tieu", min_tieu)
+            if ids is not None: q = q.in_("id", list(ids))
+            return q.order("stats_tong_tieu", desc=True).order("id")
+        if limit:
+            q = build()
+            if after:
+                tieu, last_id = after
+                q = q.or_(f"stats_tong_tieu.lt.{tieu},and(stats_tong_tieu.eq.{tieu},id.gt.{last_id})")
+            rows = q.limit(limit).execute().data
+        else:
+            rows = _select_all_rows(build)
+        return pd.DataFrame(rows)
+    except Exception as e:
+        print(f"Lỗi lấy tổng hợp khách hàng: {e}")
         return pd.DataFrame()
 
 def lay_lich_su_khach(khach_hang_id):
@@ -135,92 +541,57 @@ def lay_lich_su_khach(khach_hang_id):
         return pd.DataFrame()
 
 def save_full_order(order_data, items_list):
+    """
+    Lưu đơn mới trong 1 round-trip qua RPC save_full_order (sql/003_save_full_order.sql):
+    upsert khách theo SĐT, tạo đơn + sản phẩm và cộng dồn số đơn / tổng tiêu
+    của khách trong cùng 1 transaction phía DB.
+    """
     try:
-        # BƯỚC 1: XỬ LÝ THÔNG TIN KHÁCH HÀNG (CRM)
-        # Trích xuất thông tin từ order_data
-        ten_khach = order_data.get('ten_khach', '')
-        sdt = order_data.get('sdt', '')
-        dia_chi = order_data.get('dia_chi', '')
-        shop = order_data.get('shop', '')
-        facebook_id = order_data.get('facebook_id', None) # Lấy facebook_id từ order_data
-        
-        khach_id = None
-        if sdt: # Chỉ xử lý nếu có SĐT
-            khach_id = lay_hoac_tao_khach_hang(ten_khach, sdt, dia_chi, shop, facebook_id)
-        
-        # Thêm khach_hang_id vào order_data trước khi lưu
-        if khach_id:
-            order_data['khach_hang_id'] = khach_id
-        
-        # BƯỚC 2: TẠO ĐƠN HÀNG
-        supabase.table("orders").insert(order_data).execute()
-        
-        # BƯỚC 3: LƯU SẢN PHẨM
-        for item in items_list:
-            item['order_id'] = order_data['ma_don']
-        
-        if items_list:
-            supabase.table("order_items").insert(items_list).execute()
-            
-        # BƯỚC 4: CẬP NHẬT TỔNG CHI TIÊU KHÁCH HÀNG
-        if khach_id:
-            try:
-                # Tính tổng tiền đơn vừa tạo
-                tong_tien_don = int(order_data.get('thanh_tien', 0))
-                
-                # Gọi RPC (Stored Procedure) hoặc query lấy tổng cũ
-                # Cách đơn giản: Lấy tổng hiện tại + đơn mới
-                k_res = supabase.table("khach_hang").select("tong_tieu").eq("id", khach_id).single().execute()
-                if k_res.data:
-                    tong_cu = k_res.data.get('tong_tieu', 0) or 0
-                    supabase.table("khach_hang").update({"tong_tieu": tong_cu + tong_tien_don}).eq("id", khach_id).execute()
-            except Exception as e:
-                print(f"⚠️ Lỗi update tổng tiêu: {e}")
-
+        # facebook_id thuộc bảng khach_hang, không phải cột của orders
+        facebook_id = order_data.get('facebook_id', None)
+        order_payload = {k: v for k, v in order_data.items() if k != 'facebook_id'}
+
+        res = supabase.rpc("save_full_order", {
+            "p_order": order_payload,
+            "p_items": items_list or [],
+            "p_facebook_id": facebook_id
+        }).execute()
+
+        # RPC trả về id khách hàng (None nếu đơn không có SĐT)
+        if res.data:
+            order_data['khach_hang_id'] = res.data
+
+        invalidate_orders_cache()
+        invalidate_customer_cache()
         return True
     except Exception as e:
         print(f"Lỗi save: {e}")
         return False
 
-def sync_all_customer_totals():
-    """Đồng bộ lại tổng tiêu, số đơn hàng và địa chỉ cho tất cả khách hàng từ bảng orders"""
+def sync_all_customer_totals(incremental=False):
+    """
+    Đồng bộ lại tổng tiêu, số đơn hàng và địa chỉ (đơn mới nhất) cho khách hàng
+    bằng RPC sync_customer_totals (sql/004_sync_customer_totals.sql) - 1 câu UPDATE set-based.
+    - incremental=True: chỉ tính lại khách có đơn thay đổi từ lần chạy trước.
+    Trả về: {"rows_changed": số khách thay đổi, "elapsed": giây} hoặc None nếu lỗi.
+    """
+    t0 = time.time()
     try:
-        # 1. Lấy tất cả orders
-        all_orders = fetch_all_orders()
-        if all_orders.empty: return False
-        
-        # 2. Group by khach_hang_id
-        # - Sum thanh_tien -> total spent
-        # - Count ma_don -> total orders
-        # - Last dia_chi -> latest address
-        grouped = all_orders.groupby("khach_hang_id").agg({
-            "thanh_tien": "sum",
-            "ma_don": "count",
-            "dia_chi": "last" # Lấy địa chỉ từ đơn mới nhất
-        }).reset_index()
-        
-        # 3. Update từng khách hàng
-        count = 0
-        for _, row in grouped.iterrows():
-            kid = row['khach_hang_id']
-            if pd.isna(kid): continue
-            
-            supabase.table("khach_hang").update({
-                "tong_tieu": int(row['thanh_tien']),
-                "so_don_hang": int(row['ma_don']),
-                "dia_chi": row['dia_chi']
-            }).eq("id", int(kid)).execute()
-            count += 1
-            
-        print(f"Đã đồng bộ {count} khách hàng.")
-        return True
+        res = supabase.rpc("sync_customer_totals", {"p_incremental": bool(incremental)}).execute()
+        rows_changed = int(res.data or 0)
     except Exception as e:
         print(f"Lỗi sync: {e}")
-        return False
+        return None
+
+    invalidate_customer_cache()
+    elapsed = time.time() - t0
+    print(f"Đã đồng bộ {rows_changed} khách hàng trong {elapsed:.2f}s.")
+    return {"rows_changed": rows_changed, "elapsed": elapsed}
 
 def update_order_status(ma_don, new_status):
     try:
         supabase.table("orders").update({"trang_thai": new_status}).eq("ma_don", ma_don).execute()
+        invalidate_orders_cache()
         return True
     except:
         return False
@@ -233,80 +604,221 @@ def tai_danh_sach_trang_thai():
 
 # --- CLOUD STORAGE FUNCTIONS (NEW) ---
 
-def compress_image(image_file, max_width=1024):
+# Ảnh > ngưỡng này bị từ chối trước khi decode (chống "decompression bomb").
+# Đủ rộng cho ảnh điện thoại 108MP.
+MAX_IMAGE_PIXELS = 110_000_000
+# Định dạng ảnh lưu lên Storage: "JPEG" hoặc "WEBP"
+IMAGE_QUALITY = {"JPEG": 85, "WEBP": 80}
+IMAGE_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+IMAGE_OUTPUT_FORMAT = os.environ.get("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+if IMAGE_OUTPUT_FORMAT not in IMAGE_QUALITY:
+    IMAGE_OUTPUT_FORMAT = "JPEG"
+
+def _open_scaled(image_file, max_width, fmt=IMAGE_OUTPUT_FORMAT):
+    """
+    Mở ảnh và thu nhỏ rẻ nhất có thể về khoảng max_width:
+    - Kiểm tra số pixel từ header trước khi decode.
+    - JPEG: Image.draft cho libjpeg decode thẳng ở 1/2, 1/4, 1/8 kích thước.
+    - Xoay đúng chiều theo EXIF (ảnh chụp điện thoại).
     """
-    Hàm nén ảnh: Resize lại và giảm chất lượng xuống mức hợp lý
+    img = Image.open(image_file)
+    w, h = img.size
+    if w * h > MAX_IMAGE_PIXELS:
+        raise ValueError(f"Ảnh quá lớn ({w}x{h}), vượt giới hạn {MAX_IMAGE_PIXELS:,} pixel")
+
+    if img.format == "JPEG":
+        # EXIF 5-8 = ảnh xoay 90°: chiều ngang sau khi xoay là chiều dọc lúc lưu
+        rotated = img.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        img.draft("RGB", (1, max_width) if rotated else (max_width, 1))
+
+    img = ImageOps.exif_transpose(img)
+    # Bỏ kênh alpha trước khi resize (resize 3 kênh nhanh hơn 4 kênh)
+    if fmt.upper() == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return img
+
+def _fit_width(img, max_width):
+    """Resize về max_width (giữ tỷ lệ). reducing_gap: giảm nhanh bằng reduce() rồi mới LANCZOS."""
+    if img.width <= max_width:
+        return img
+    new_height = max(1, round(img.height * max_width / img.width))
+    return img.resize((max_width, new_height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+def _encode_image(img, fmt=IMAGE_OUTPUT_FORMAT):
+    fmt = fmt.upper()
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif fmt == "WEBP" and img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    output_io = io.BytesIO()
+    # Không dùng optimize=True: tốn thêm 1 lượt encode mà chỉ bớt vài % dung lượng
+    img.save(output_io, format=fmt, quality=IMAGE_QUALITY.get(fmt, 85))
+    return output_io.getvalue()
+
+def compress_image(image_file, max_width=1024, fmt=IMAGE_OUTPUT_FORMAT):
+    """
+    Hàm nén ảnh: Resize lại và giảm chất lượng xuống mức hợp lý.
+    fmt: "JPEG" hoặc "WEBP". Trả về bytes, hoặc None nếu không phải ảnh / ảnh quá lớn.
     """
     try:
-        # Mở ảnh bằng PIL
-        img = Image.open(image_file)
-        
-        # Convert sang RGB nếu là ảnh PNG/RGBA để lưu được JPEG
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-            
-        # Resize nếu ảnh quá to (giữ nguyên tỷ lệ)
-        if img.width > max_width:
-            ratio = max_width / float(img.width)
-            new_height = int(float(img.height) * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            
-        # Lưu vào bộ nhớ đệm (RAM) dưới dạng JPEG
-        output_io = io.BytesIO()
-        # quality=85 là mức cân bằng hoàn hảo giữa dung lượng và độ nét
-        img.save(output_io, format='JPEG', quality=85, optimize=True) 
-        output_io.seek(0)
-        
-        return output_io.getvalue()
+        img = _open_scaled(image_file, max_width, fmt)
+        return _encode_image(_fit_width(img, max_width), fmt)
     except Exception as e:
         print(f"Lỗi nén ảnh: {e}")
         return None # Trả về None nếu lỗi, để code dùng ảnh gốc
 
-def upload_image_to_supabase(file_data, file_name, folder="items"):
+IMAGE_BUCKET = "images"
+# Đổi giá trị này khi đổi cách nén -> ảnh cũ sẽ được nén lại với key mới
+IMAGE_PIPELINE_VERSION = "v3"
+# Object theo content-hash không bao giờ đổi nội dung -> cho phép cache lâu dài
+IMMUTABLE_CACHE_SECONDS = "31536000"
+
+_known_objects = set()  # Các path đã biết là có trên Storage (tránh HEAD lặp lại)
+_known_objects_lock = threading.Lock()
+
+def _read_bytes(file_data):
+    """Lấy bytes từ file upload của Streamlit (UploadedFile/BytesIO) hoặc bytes thô."""
+    if hasattr(file_data, "getvalue"):
+        return file_data.getvalue()
+    if hasattr(file_data, "read"):
+        return file_data.read()
+    return file_data
+
+def _is_image(raw_bytes):
+    """Chỉ đọc header (không decode) để biết dữ liệu có phải ảnh PIL mở được không."""
     try:
-        bucket_name = "images"
-        file_path = f"{folder}/{file_name}"
-        
-        # --- BƯỚC 1: NÉN ẢNH ---
-        # Nếu file_data là file upload từ Streamlit
-        compressed_data = compress_image(file_data)
-        
-        # Nếu nén lỗi (hoặc file không phải ảnh), dùng dữ liệu gốc
-        if compressed_data is None:
-            if hasattr(file_data, "getvalue"):
-                final_data = file_data.getvalue()
-            else:
-                final_data = file_data
-            mime = "image/png" # Mặc định
-        else:
-            final_data = compressed_data
-            mime = "image/jpeg" # Sau khi nén luôn là JPEG
+        Image.open(io.BytesIO(raw_bytes))
+        return True
+    except Exception:
+        return False
 
-        # --- BƯỚC 2: UPLOAD ---
-        supabase.storage.from_(bucket_name).upload(
-            path=file_path,
-            file=final_data,
-            file_options={"content-type": mime, "upsert": "true"}
-        )
-        
-        # --- BƯỚC 3: TRẢ VỀ LINK ---
-        # Thêm timestamp ?t=... để tránh trình duyệt cache ảnh cũ khi update
-        import time
-        public_url = supabase.storage.from_(bucket_name).get_public_url(file_path)
-        return f"{public_url}?t={int(time.time())}"
+# Các bản ảnh sinh ra cùng lúc khi upload: tên -> chiều rộng tối đa (px)
+# - orig : bản xem full / tải về
+# - print: bản nhúng vào phiếu in (ô ảnh cao 140px)
+# - thumb: ô vuông trong giao diện
+IMAGE_RENDITIONS = {"orig": 1024, "print": 600, "thumb": 320}
 
+def _render_renditions(raw_bytes, fmt=IMAGE_OUTPUT_FORMAT):
+    """
+    Decode ảnh 1 lần và sinh tất cả bản trong IMAGE_RENDITIONS (bản nhỏ resize từ bản lớn hơn).
+    Hàm top-level để chạy được trong ProcessPoolExecutor.
+    Trả về dict {tên: bytes} hoặc None nếu không đọc được ảnh.
+    """
+    try:
+        img = _open_scaled(io.BytesIO(raw_bytes), max(IMAGE_RENDITIONS.values()), fmt)
+        out = {}
+        for name, max_width in sorted(IMAGE_RENDITIONS.items(), key=lambda kv: -kv[1]):
+            img = _fit_width(img, max_width)
+            out[name] = _encode_image(img, fmt)
+        return out
     except Exception as e:
-        st.error(f"❌ Lỗi Upload: {e}")
+        print(f"Lỗi nén ảnh: {e}")
         return None
 
+_ORIG_URL_RE = re.compile(r"/[0-9a-f]{64}/orig\.(jpg|webp)$")
+
+def rendition_url(url, kind="thumb"):
+    """
+    Đổi URL ảnh gốc (…/{hash}/orig.jpg|webp) sang bản 'thumb' hoặc 'print'.
+    URL cũ (upload trước khi có rendition) hoặc không phải ảnh -> trả nguyên URL.
+    """
+    if not url or not isinstance(url, str):
+        return url
+    m = _ORIG_URL_RE.search(url)
+    if not m:
+        return url
+    return f"{url[:m.start() + 65]}/{kind}.{m.group(1)}"  # giữ "/{hash}"
+
+def _content_path(raw_bytes, file_name, folder):
+    """
+    Key lưu trữ theo hash nội dung (content-addressed). Trả về (path, is_image):
+    - Ảnh: {folder}/{sha256}/orig.jpg (các bản khác nằm cạnh: thumb.jpg, print.jpg; .webp nếu dùng WEBP)
+    - File khác (file thêu...): {folder}/{sha256}/{tên file gốc} để tải về vẫn đúng tên
+    """
+    salt = f"{IMAGE_PIPELINE_VERSION}:{IMAGE_OUTPUT_FORMAT}".encode()
+    digest = hashlib.sha256(salt + raw_bytes).hexdigest()
+    if _is_image(raw_bytes):
+        return f"{folder}/{digest}/orig.{IMAGE_EXTENSIONS[IMAGE_OUTPUT_FORMAT]}", True
+    # Storage chỉ nhận key ASCII -> bỏ dấu tiếng Việt, thay ký tự lạ bằng "_"
+    base = unicodedata.normalize("NFKD", os.path.basename(str(file_name or "file")).replace("đ", "d").replace("Đ", "D"))
+    safe_name = re.sub(r"[^A-Za-z0-9._-]+", "_", base.encode("ascii", "ignore").decode()) or "file"
+    return f"{folder}/{digest}/{safe_name}", False
+
+def _object_exists(file_path):
+    with _known_objects_lock:
+        if file_path in _known_objects:
+            return True
+    try:
+        exists = supabase.storage.from_(IMAGE_BUCKET).exists(file_path)
+    except Exception as e:
+        print(f"⚠️ Không kiểm tra được {file_path}: {e}")
+        return False
+    if exists:
+        with _known_objects_lock:
+            _known_objects.add(file_path)
+    return exists
+
+def _upload_bytes(data, file_path, mime):
+    """Upload bytes lên Storage (không ghi đè) và trả về public URL (raise nếu lỗi)."""
+    try:
+        supabase.storage.from_(IMAGE_BUCKET).upload(
+            path=file_path,
+            file=data,
+            file_options={"content-type": mime, "cache-control": IMMUTABLE_CACHE_SECONDS, "upsert": "false"}
+        )
+    except Exception as e:
+        # Upload trùng key (đã có người upload cùng nội dung) -> coi như thành công
+        msg = str(e).lower()
+        if "409" not in str(getattr(e, "status", "")) and "duplicate" not in msg and "already exists" not in msg:
+            raise
+    with _known_objects_lock:
+        _known_objects.add(file_path)
+    # URL bất biến theo nội dung -> không cần ?t=... để phá cache
+    return supabase.storage.from_(IMAGE_BUCKET).get_public_url(file_path)
+
+def _store_content(raw_bytes, file_name, folder, render=None):
+    """
+    Lưu nội dung lên Storage theo content-hash. Nếu object đã tồn tại thì bỏ qua
+    cả bước nén lẫn upload, chỉ trả về URL.
+    Ảnh được lưu kèm các bản thumb/print (upload bản orig sau cùng, nên có orig là có đủ bản).
+    render: hàm sinh rendition (mặc định _render_renditions) - pipeline nhiều file truyền hàm chạy trên process pool.
+    """
+    file_path, is_image = _content_path(raw_bytes, file_name, folder)
+    if _object_exists(file_path):
+        return supabase.storage.from_(IMAGE_BUCKET).get_public_url(file_path)
+
+    if not is_image:
+        return _upload_bytes(raw_bytes, file_path, "application/octet-stream")
+
+    renditions = (render or _render_renditions)(raw_bytes)
+    if not renditions:
+        # Không lưu file gốc thành orig.* (thiếu thumb/print -> URL rendition 404),
+        # ảnh vượt MAX_IMAGE_PIXELS cũng bị từ chối ở đây
+        raise ValueError(f"Không xử lý được ảnh {file_name} (ảnh hỏng hoặc quá {MAX_IMAGE_PIXELS:,} pixel)")
+
+    base_dir = file_path.rsplit("/", 1)[0]
+    ext = IMAGE_EXTENSIONS[IMAGE_OUTPUT_FORMAT]
+    mime = f"image/{IMAGE_OUTPUT_FORMAT.lower()}"
+    for name, data in renditions.items():
+        if name != "orig":
+            _upload_bytes(data, f"{base_dir}/{name}.{ext}", mime)
+    return _upload_bytes(renditions["orig"], file_path, mime)
+
+def upload_image_to_supabase(file_data, file_name, folder="items"):
+    """
+    Nén và upload ảnh, trả về URL bất biến theo nội dung.
+    Cùng 1 ảnh gắn cho nhiều sản phẩm chỉ được lưu 1 lần (file_name chỉ dùng
+    để đặt tên cho file không phải ảnh).
+    """
+    try:
+        return _store_content(_read_bytes(file_data), file_name, folder)
     except Exception as e:
-        # --- DÒNG CODE DEBUG THẦN THÁNH ---
-        st.error(f"❌ BUG REPORT: {str(e)}") # In lỗi ra màn hình
-        print(f"❌ Lỗi chi tiết: {e}")       # In lỗi ra terminal
+        st.error(f"❌ Lỗi Upload: {e}")
+        print(f"❌ Lỗi chi tiết: {e}")
         return None
 
 def update_item_image(item_id, image_url, column_name="img_main"):
-    """Cập nhật link ảnh vào bảng order_items cho từng sản phẩm"""
+    """Trỏ cột ảnh của sản phẩm sang URL (ảnh đã lưu theo content-hash, không upload lại)"""
     try:
         supabase.table("order_items").update({column_name: image_url}).eq("id", item_id).execute()
         return True
@@ -327,46 +839,91 @@ def mark_order_as_printed(ma_don):
     """Đánh dấu đơn hàng đã được in phiếu"""
     try:
         supabase.table("orders").update({"da_in": True}).eq("ma_don", ma_don).execute()
+        invalidate_orders_cache()
         return True
     except Exception as e:
         print(f"❌ Lỗi mark_order_as_printed: {e}")
         return False
 
-def upload_multiple_files_to_supabase(files, item_id):
+# --- PIPELINE UPLOAD SONG SONG ---
+UPLOAD_MAX_WORKERS = 4    # Số file upload HTTP cùng lúc
+COMPRESS_MAX_WORKERS = 2  # Số process nén ảnh (PIL tốn CPU, không chạy trên thread của Streamlit)
+
+_compress_pool = None
+_compress_pool_lock = threading.Lock()
+
+def _get_compress_pool():
+    """Process pool dùng chung để nén ảnh; None nếu môi trường không tạo được process."""
+    global _compress_pool
+    with _compress_pool_lock:
+        if _compress_pool is None:
+            try:
+                # "spawn": fork khi server Streamlit đang chạy nhiều thread dễ bị treo process con
+                _compress_pool = ProcessPoolExecutor(max_workers=COMPRESS_MAX_WORKERS,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            except Exception as e:
+                print(f"⚠️ Không tạo được process pool, nén ảnh trên thread: {e}")
+                _compress_pool = False
+        return _compress_pool or None
+
+def _render_in_pool(raw_bytes):
+    global _compress_pool
+    pool = _get_compress_pool()
+    if pool:
+        try:
+            return pool.submit(_render_renditions, raw_bytes).result()
+        except Exception as e:
+            # Pool hỏng (BrokenProcessPool...) -> bỏ pool, nén tại chỗ
+            print(f"⚠️ Lỗi process pool nén ảnh: {e}")
+            with _compress_pool_lock:
+                _compress_pool = False
+    return _render_renditions(raw_bytes)
+
+
+def upload_multiple_files_to_supabase(files, item_id, on_progress=None):
     """
     Upload nhiều file thiết kế cùng lúc lên Supabase.
+    Nén ảnh chạy trên process pool, upload HTTP chạy song song trên thread pool.
     
     Args:
         files: List các file upload từ Streamlit
-        item_id: ID của item trong order_items
+        item_id: ID của item trong order_items (file lưu theo content-hash nên không dùng trong key)
+        on_progress: callback(so_file_xong, tong_so_file, ten_file, loi) gọi trên thread
+                     hiện tại mỗi khi 1 file xong (dùng để cập nhật progress bar)
     
     Returns:
-        String chứa các URL nối với nhau bằng dấu chấm phẩy " ; "
+        (urls, errors)
+        - urls: String chứa các URL (theo đúng thứ tự file) nối bằng " ; ", None nếu không file nào thành công
+        - errors: List (tên file, thông báo lỗi) của các file upload lỗi
     """
-    try:
-        uploaded_urls = []
-        
-        for idx, file_data in enumerate(files):
-            # Tạo tên file unique
-            file_name = f"item_{item_id}_design_{idx}_{file_data.name}"
-            
-            # Upload từng file
-            url = upload_image_to_supabase(file_data, file_name, folder="designs")
-            
-            if url:
-                uploaded_urls.append(url)
-            else:
-                print(f"⚠️ Không upload được file {file_data.name}")
-        
-        # Nối các URL bằng dấu " ; "
-        if uploaded_urls:
-            return " ; ".join(uploaded_urls)
-        else:
-            return None
-            
-    except Exception as e:
-        print(f"❌ Lỗi upload multiple files: {e}")
-        return None
+    # Đọc bytes trên thread hiện tại (UploadedFile không an toàn khi đọc từ thread khác)
+    jobs = []
+    for idx, file_data in enumerate(files):
+        name = getattr(file_data, "name", f"file_{idx}")
+        jobs.append((idx, name, _read_bytes(file_data)))
+
+    results = [None] * len(jobs)
+    errors = []
+    with ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(_store_content, raw, name, "designs", _render_in_pool): (idx, name)
+            for idx, name, raw in jobs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            idx, name = futures[future]
+            err = None
+            try:
+                results[idx] = future.result()
+            except Exception as e:
+                err = str(e)
+                errors.append((name, err))
+                print(f"⚠️ Không upload được file {name}: {e}")
+            if on_progress:
+                on_progress(done, len(jobs), name, err)
+
+    # Nối các URL bằng dấu " ; " (giữ thứ tự file gốc)
+    uploaded_urls = [u for u in results if u]
+    return (" ; ".join(uploaded_urls) if uploaded_urls else None), errors
 
 # ... (Các hàm cũ giữ nguyên) ...
 
@@ -376,10 +933,37 @@ def update_order_info(ma_don, update_data):
     """
     try:
         supabase.table("orders").update(update_data).eq("ma_don", ma_don).execute()
+        invalidate_orders_cache()
         return True
     except Exception as e:
         print(f"❌ Lỗi update đơn: {e}")
         return False
+
+def bulk_update_orders(ma_don_list, patch, only_if_status_in=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Cập nhật hàng loạt đơn bằng 1 câu UPDATE cho mỗi chunk mã đơn.
+    - patch: dict cột -> giá trị mới (vd {"da_in": True})
+    - only_if_status_in: chỉ đổi những đơn đang ở các trạng thái này
+      (điều kiện chạy trong câu UPDATE phía DB, không lọc bằng Python)
+    Trả về: list các dòng thực sự bị thay đổi (None nếu lỗi).
+    """
+    codes = list(dict.fromkeys(str(m) for m in ma_don_list if m))
+    changed = []
+    try:
+        for chunk in _chunks(codes, chunk_size):
+            query = supabase.table("orders").update(patch).in_("ma_don", chunk)
+            if only_if_status_in:
+                query = query.in_("trang_thai", list(only_if_status_in))
+            res = query.execute()
+            changed.extend(res.data or [])
+    except Exception as e:
+        print(f"❌ Lỗi bulk_update_orders: {e}")
+        changed = None
+    # Có thể đã cập nhật được một phần -> luôn làm mới cache
+    if codes:
+        invalidate_orders_cache()
+    return changed
+
 # ==============================================================================
 # AUTHENTICATION FUNCTIONS
 # ==============================================================================
@@ -419,6 +1003,7 @@ def mark_order_as_printed(ma_don):
     try:
         # Cập nhật cột da_in thành True
         supabase.table("orders").update({"da_in": True}).eq("ma_don", ma_don).execute()
+        invalidate_orders_cache()
         return True
     except Exception as e:
         print(f"Lỗi đánh dấu in: {e}")
@@ -0,0 +1,142 @@
+"""
+Chỉ mục hạn trả (ngay_tra) của các đơn CHƯA xong / hủy.
+- Giữ danh sách (ngày, mã đơn) đã sắp xếp -> tra "quá hạn", "trả hôm nay", "N ngày tới"
+  bằng bisect (O(log n) + số kết quả), không lọc lại cả bảng.
+- Đếm số đơn theo ngày (histogram khối lượng) dùng chung cho Dashboard và thông báo.
+- Cập nhật từng dòng khi đơn đổi trạng thái / ngày trả (qua listener của cache đơn hàng).
+"""
+import bisect
+import threading
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+def _to_date(value):
+    """'2024-05-01', '2024-05-01T10:00:00+07:00', date, Timestamp -> date (lỗi -> None)."""
+    if value is None or value != value:
+        return None
+    if isinstance(value, datetime):  # gồm cả pd.Timestamp
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+class DeadlineIndex:
+    """Đơn đang mở theo hạn trả. An toàn khi dùng từ nhiều thread."""
+
+    def __init__(self, closed_statuses):
+        self._closed = set(closed_statuses)
+        self._lock = threading.Lock()
+        self._orders = {}     # ma_don -> {"ma_don", "ten_khach", "ngay_tra", "co_hen_ngay", "trang_thai"}
+        self._keys = []       # [(ngay_tra, ma_don)] đã sắp xếp - mọi đơn mở
+        self._urgent = []     # [(ngay_tra, ma_don)] đã sắp xếp - đơn hẹn ngày
+        self._counts = {}     # ngay_tra -> [số đơn, số đơn hẹn]
+
+    def __len__(self):
+        return len(self._orders)
+
+    # --- CẬP NHẬT ---
+    def rebuild(self, df):
+        with self._lock:
+            self._orders, self._keys, self._urgent, self._counts = {}, [], [], {}
+        self.upsert_frame(df)
+
+    def upsert_frame(self, df):
+        """Thêm/cập nhật các đơn trong df; đơn đã xong/hủy hoặc không có ngày trả bị gỡ khỏi chỉ mục."""
+        if df is None or df.empty or 'ma_don' not in df.columns:
+            return
+        cols = ('ma_don', 'ten_khach', 'ngay_tra', 'co_hen_ngay', 'trang_thai')
+        columns = [df[c].tolist() if c in df.columns else [None] * len(df) for c in cols]
+        # Nhiều dòng -> chỉ cập nhật _orders/_counts, cuối lô dựng lại 2 danh sách đã sắp xếp
+        # 1 lần (không insort/bisect trên danh sách đang dở dang)
+        bulk = len(df) > 100
+        with self._lock:
+            for ma_don, ten_khach, ngay_tra, co_hen, trang_thai in zip(*columns):
+                self._upsert(str(ma_don), ten_khach, ngay_tra, co_hen, trang_thai, bulk)
+            if bulk:
+                self._keys = sorted((r["ngay_tra"], ma) for ma, r in self._orders.items())
+                self._urgent = [k for k in self._keys if self._orders[k[1]]["co_hen_ngay"]]
+
+    def remove(self, ma_don):
+        with self._lock:
+            self._remove(str(ma_don))
+
+    def _upsert(self, ma_don, ten_khach, ngay_tra, co_hen, trang_thai, bulk=False):
+        self._remove(ma_don, bulk)
+        d = _to_date(ngay_tra)
+        stt = str(trang_thai).strip() if trang_thai is not None else ""
+        if d is None or stt in self._closed:
+            return
+        urgent = co_hen is True
+        self._orders[ma_don] = {"ma_don": ma_don, "ten_khach": ten_khach, "ngay_tra": d,
+                                "co_hen_ngay": urgent, "trang_thai": stt}
+        if not bulk:
+            key = (d, ma_don)
+            for lst in ([self._keys, self._urgent] if urgent else [self._keys]):
+                bisect.insort(lst, key)
+        c = self._counts.setdefault(d, [0, 0])
+        c[0] += 1
+        c[1] += urgent
+
+    def _remove(self, ma_don, bulk=False):
+        rec = self._orders.pop(ma_don, None)
+        if not rec:
+            return
+        if not bulk:  # bulk: _keys/_urgent được dựng lại cuối lô
+            key = (rec["ngay_tra"], ma_don)
+            for lst in ([self._keys, self._urgent] if rec["co_hen_ngay"] else [self._keys]):
+                i = bisect.bisect_left(lst, key)
+                if i < len(lst) and lst[i] == key:
+                    lst.pop(i)
+        c = self._counts[rec["ngay_tra"]]
+        c[0] -= 1
+        c[1] -= rec["co_hen_ngay"]
+        if c[0] <= 0:
+            del self._counts[rec["ngay_tra"]]
+
+    # --- TRA CỨU ---
+    def _range(self, lst, start, end):
+        """Đơn có start <= ngay_tra < end (start/end None = không giới hạn)."""
+        lo = bisect.bisect_left(lst, (start,)) if start else 0
+        hi = bisect.bisect_left(lst, (end,)) if end else len(lst)
+        orders = self._orders
+        return [dict(orders[ma]) for _, ma in lst[lo:hi] if ma in orders]
+
+    def due_between(self, start, end, urgent_only=False):
+        """Đơn mở có start <= ngay_tra <= end (tính cả 2 đầu)."""
+        with self._lock:
+            return self._range(self._urgent if urgent_only else self._keys, start, end + timedelta(days=1))
+
+    def due_on(self, day, urgent_only=False):
+        return self.due_between(day, day, urgent_only)
+
+    def due_in_next(self, days, today=None):
+        """Đơn mở phải trả trong `days` ngày tới (từ hôm nay)."""
+        today = today or date.today()
+        return self.due_between(today, today + timedelta(days=days - 1))
+
+    def overdue(self, today=None):
+        """Đơn mở có ngày trả trước hôm nay."""
+        today = today or date.today()
+        with self._lock:
+            return self._range(self._keys, None, today)
+
+    def urgent_today(self, today=None):
+        return self.due_on(today or date.today(), urgent_only=True)
+
+    def workload(self, start=None, days=14):
+        """
+        Khối lượng theo ngày: DataFrame [ngay, so_don, so_don_hen] cho `days` ngày từ `start`,
+        ngày không có đơn = 0.
+        """
+        start = start or date.today()
+        with self._lock:
+            rows = []
+            for i in range(days):
+                d = start + timedelta(days=i)
+                c = self._counts.get(d, (0, 0))
+                rows.append({"ngay": d, "so_don": c[0], "so_don_hen": c[1]})
+        return pd.DataFrame(rows)
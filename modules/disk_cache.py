@@ -0,0 +1,109 @@
+"""
+Cache key -> JSON trên đĩa (SQLite), dùng chung giữa các session Streamlit và các process.
+- Hết hạn theo TTL, bỏ bớt theo LRU (lần dùng cuối) khi vượt số dòng / dung lượng.
+- Đếm hit/miss ngay trong file cache để mọi process thấy cùng số liệu.
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("APP_CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+
+# Cứ sau chừng này lần ghi thì dọn dòng hết hạn / vượt giới hạn 1 lần
+_PRUNE_EVERY = 20
+
+class DiskCache:
+    def __init__(self, path, ttl=24 * 3600, max_entries=2000, max_bytes=20 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._init_lock = threading.Lock()
+        self._ready = False
+        self._writes = 0
+
+    def _connect(self):
+        # Mỗi lần gọi 1 connection riêng: an toàn giữa các thread; WAL cho nhiều process cùng đọc/ghi
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    with closing(sqlite3.connect(self.path, timeout=10)) as conn, conn:
+                        conn.execute("pragma journal_mode=wal")
+                        conn.execute("""create table if not exists cache (
+                            key text primary key, value text not null,
+                            created_at real not null, last_used real not null)""")
+                        conn.execute("create index if not exists idx_cache_last_used on cache (last_used)")
+                        conn.execute("create table if not exists stats (name text primary key, value integer not null)")
+                    self._ready = True
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _count(self, conn, name):
+        conn.execute("insert into stats (name, value) values (?, 1) "
+                     "on conflict(name) do update set value = value + 1", (name,))
+
+    def get(self, key):
+        """Trả về giá trị đã lưu hoặc None (không có / hết hạn / lỗi)."""
+        try:
+            now = time.time()
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute("select value, created_at from cache where key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    conn.execute("update cache set last_used = ? where key = ?", (now, key))
+                    self._count(conn, "hits")
+                    return json.loads(row[0])
+                if row:
+                    conn.execute("delete from cache where key = ?", (key,))
+                self._count(conn, "misses")
+        except Exception as e:
+            print(f"Lỗi đọc cache {os.path.basename(self.path)}: {e}")
+        return None
+
+    def set(self, key, value):
+        try:
+            now = time.time()
+            with closing(self._connect()) as conn, conn:
+                conn.execute("insert or replace into cache (key, value, created_at, last_used) values (?, ?, ?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False), now, now))
+                self._writes += 1
+                if self._writes % _PRUNE_EVERY == 1:
+                    self._prune(conn, now)
+        except Exception as e:
+            print(f"Lỗi ghi cache {os.path.basename(self.path)}: {e}")
+
+    def _prune(self, conn, now):
+        conn.execute("delete from cache where created_at < ?", (now - self.ttl,))
+        conn.execute("delete from cache where key in (select key from cache order by last_used desc limit -1 offset ?)",
+                     (self.max_entries,))
+        total = conn.execute("select coalesce(sum(length(value)), 0) from cache").fetchone()[0]
+        if total > self.max_bytes:
+            # Bỏ dòng dùng lâu nhất cho đến khi dưới giới hạn dung lượng
+            for key, size in conn.execute("select key, length(value) from cache order by last_used").fetchall():
+                conn.execute("delete from cache where key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        """{'hits', 'misses', 'entries', 'bytes'} - số liệu chung của mọi process."""
+        out = {"hits": 0, "misses": 0, "entries": 0, "bytes": 0}
+        try:
+            with closing(self._connect()) as conn, conn:
+                out.update({name: value for name, value in conn.execute("select name, value from stats")})
+                out["entries"], out["bytes"] = conn.execute(
+                    "select count(*), coalesce(sum(length(value)), 0) from cache").fetchone()
+        except Exception as e:
+            print(f"Lỗi đọc thống kê cache: {e}")
+        return out
+
+    def clear(self):
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("delete from cache")
+                conn.execute("delete from stats")
+        except Exception as e:
+            print(f"Lỗi xoá cache: {e}")
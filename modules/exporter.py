@@ -2,84 +2,166 @@ import pandas as pd
 import io
 import os
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from functools import lru_cache
 from datetime import datetime
 
-def export_orders_to_excel(orders_data_list):
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_PATH = os.path.join(BASE_DIR, 'order-import-template.xlsx')
+COLS_PATH = os.path.join(BASE_DIR, 'cols.txt')
+TEMPLATE_SHEET = 'Dữ liệu'
+
+# Lô lớn hơn ngưỡng này -> ghi kiểu write-only (streaming), RAM gần như không đổi
+EXCEL_STREAMING_THRESHOLD = 2000
+
+def _ten_khach_hang(order, items):
+    # Khách hàng / Người nhận = Mã đơn + tên
+    return f"{order.get('ma_don', '')} {order.get('ten_khach', '')}".strip()
+
+def _ten_san_pham(order, items):
+    # Ghép chuỗi tên sản phẩm (sp1 + sp2 + ...)
+    return " + ".join(item.get('ten_sp', '').strip() for item in items if item.get('ten_sp'))
+
+# Map cột Excel (theo header trong cols.txt) -> hàm lấy giá trị từ (order, items).
+# Cột không có trong map để trống.
+EXPORT_COLUMNS = {
+    "Khách hàng": _ten_khach_hang,
+    "SĐT": lambda order, items: order.get('sdt', ''),
+    "Người nhận": _ten_khach_hang,
+    "Địa chỉ": lambda order, items: order.get('dia_chi', ''),
+    "Sản phẩm": _ten_san_pham,
+    "Số lượng": lambda order, items: 1,            # cố định 1
+    "Trọng lượng (g)": lambda order, items: 500,   # cố định 500
+    "Giá": lambda order, items: order.get('thanh_tien', 0),
+    "Nội dung để in": lambda order, items: order.get('ghi_chu', ''),
+    "Chuyển khoản": lambda order, items: order.get('da_coc', 0),
+    "Hình thức thanh toán phí vận chuyển": lambda order, items: "Người gửi",
+}
+
+DEFAULT_HEADERS = [
+    "Stt", "Khách hàng", "SĐT", "Người nhận", "Địa chỉ",
+    "Sản phẩm", "Mã sản phẩm", "Số lượng", "Trọng lượng (g)", "Giá",
+    "Giảm giá", "Loại Giảm Giá", "Nội dung để in", "Ghi chú nội bộ",
+    "Trả trước", "Chuyển khoản", "Tiền khách đưa", "Quẹt thẻ",
+    "Phí Vận Chuyển", "Hình thức thanh toán phí vận chuyển", "Nguồn đơn hàng"
+]
+
+@lru_cache(maxsize=1)
+def _load_headers():
+    """Thứ tự cột lấy từ cols.txt (đọc 1 lần). Thiếu file -> DEFAULT_HEADERS."""
+    try:
+        with open(COLS_PATH, encoding='utf-8') as f:
+            headers = [line.strip() for line in f if line.strip()]
+        return tuple(headers) or tuple(DEFAULT_HEADERS)
+    except Exception as e:
+        print(f"Lỗi đọc cols.txt: {e}")
+        return tuple(DEFAULT_HEADERS)
+
+@lru_cache(maxsize=1)
+def _load_template_bytes():
+    """Đọc file template Nobita 1 lần và giữ bytes trong RAM. Không có file -> None."""
+    if not os.path.exists(TEMPLATE_PATH):
+        return None
+    try:
+        with open(TEMPLATE_PATH, 'rb') as f:
+            return f.read()
+    except Exception as e:
+        print(f"Lỗi đọc template Excel: {e}")
+        return None
+
+@lru_cache(maxsize=1)
+def _template_layout():
     """
-    Xuất danh sách đơn hàng ra file Excel bằng cách load template Nobita 
-    để giữ nguyên format (styles, columns).
+    Độ rộng cột + các sheet phụ (Validate...) của template, dùng cho chế độ streaming.
+    Trả về (widths {chữ cột: width}, extra_sheets [(tên, rows)]).
     """
-    template_path = 'c:/app_theu/order-import-template.xlsx'
-    
-    # Load template
-    if os.path.exists(template_path):
-        wb = openpyxl.load_workbook(template_path)
+    widths, extra_sheets = {}, []
+    template = _load_template_bytes()
+    if template is None:
+        return widths, extra_sheets
+    try:
+        wb = openpyxl.load_workbook(io.BytesIO(template))
+        ws = wb[TEMPLATE_SHEET] if TEMPLATE_SHEET in wb.sheetnames else wb.active
+        widths = {k: d.width for k, d in ws.column_dimensions.items() if d.width}
+        for other in wb.worksheets:
+            if other is not ws:
+                extra_sheets.append((other.title, [list(r) for r in other.iter_rows(values_only=True)]))
+    except Exception as e:
+        print(f"Lỗi đọc template Excel: {e}")
+    return widths, extra_sheets
+
+def _iter_rows(orders_data_list, headers):
+    """Sinh từng dòng dữ liệu theo đúng thứ tự header."""
+    getters = [EXPORT_COLUMNS.get(h) for h in headers]
+    for idx, data in enumerate(orders_data_list):
+        order, items = data['order_info'], data['items']
+        row = [getter(order, items) if getter else None for getter in getters]
+        if headers and headers[0] == "Stt":
+            row[0] = idx + 1
+        yield row
+
+def _export_from_template(orders_data_list, headers):
+    """Lô nhỏ: load template (từ bytes cache) để giữ nguyên format, append dữ liệu."""
+    template = _load_template_bytes()
+    if template is not None:
+        wb = openpyxl.load_workbook(io.BytesIO(template))
+        ws = wb[TEMPLATE_SHEET] if TEMPLATE_SHEET in wb.sheetnames else wb.active
+        # Xóa dữ liệu mẫu từ hàng 2 trở đi (giữ lại header ở hàng 1)
+        if ws.max_row > 1:
+            ws.delete_rows(2, ws.max_row)
     else:
         # Fallback nếu không thấy file template (tạo mới với headers chuẩn)
         wb = openpyxl.Workbook()
         ws = wb.active
-        ws.append([
-            "Stt", "Khách hàng", "SĐT", "Người nhận", "Địa chỉ", 
-            "Sản phẩm", "Mã sản phẩm", "Số lượng", "Trọng lượng (g)", "Giá", 
-            "Giảm giá", "Loại Giảm Giá", "Nội dung để in", "Ghi chú nội bộ", 
-            "Trả trước", "Chuyển khoản", "Tiền khách đưa", "Quẹt thẻ", 
-            "Phí Vận Chuyển", "Hình thức thanh toán phí vận chuyển", "Nguồn đơn hàng"
-        ])
-
-    ws = wb.active
-    
-    # Xóa dữ liệu cũ từ hàng 2 trở đi (giữ lại header ở hàng 1)
-    if ws.max_row > 1:
-        ws.delete_rows(2, ws.max_row)
-
-    # Điền dữ liệu mới
-    for idx, data in enumerate(orders_data_list):
-        order = data['order_info']
-        items = data['items']
-        
-        # 1. Ghép chuỗi tên sản phẩm (sp1 + sp2 + ...)
-        product_names = [item.get('ten_sp', '').strip() for item in items if item.get('ten_sp')]
-        full_product_str = " + ".join(product_names)
-        
-        ma_don = order.get('ma_don', '')
-        ten_khach = order.get('ten_khach', '')
-        
-        # Map dữ liệu vào các cột (1-indexed)
-        # 1: Stt
-        ws.cell(row=idx+2, column=1, value=idx+1)
-        # 2: Khách hàng (Mã đơn + tên)
-        ws.cell(row=idx+2, column=2, value=f"{ma_don} {ten_khach}".strip())
-        # 3: SĐT
-        ws.cell(row=idx+2, column=3, value=order.get('sdt', ''))
-        # 4: Người nhận (giống khách hàng)
-        ws.cell(row=idx+2, column=4, value=f"{ma_don} {ten_khach}".strip())
-        # 5: Địa chỉ
-        ws.cell(row=idx+2, column=5, value=order.get('dia_chi', ''))
-        # 6: Sản phẩm
-        ws.cell(row=idx+2, column=6, value=full_product_str)
-        # 7: Mã sản phẩm (để trống)
-        # 8: Số lượng (cố định 1)
-        ws.cell(row=idx+2, column=8, value=1)
-        # 9: Trọng lượng (g) (cố định 500)
-        ws.cell(row=idx+2, column=9, value=500)
-        # 10: Giá (Thành tiền)
-        ws.cell(row=idx+2, column=10, value=order.get('thanh_tien', 0))
-        # 11: Giảm giá (trống)
-        # 12: Loại Giảm Giá (trống)
-        # 13: Nội dung để in (Ghi chú)
-        ws.cell(row=idx+2, column=13, value=order.get('ghi_chu', ''))
-        # 14: Ghi chú nội bộ (trống)
-        # 15: Trả trước (trống)
-        # 16: Chuyển khoản (Đã cọc)
-        ws.cell(row=idx+2, column=16, value=order.get('da_coc', 0))
-        # 17-19: Trống
-        # 20: Hình thức thanh toán phí vận chuyển (Người gửi)
-        ws.cell(row=idx+2, column=20, value="Người gửi")
-        # 21: Nguồn đơn hàng (trống)
-
-    # Xuất ra BytesIO
+        ws.append(list(headers))
+
+    for row in _iter_rows(orders_data_list, headers):
+        ws.append(row)
+
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+def _export_streaming(orders_data_list, headers):
+    """Lô lớn: workbook write-only, ghi từng dòng xuống file, không giữ cả sheet trong RAM."""
+    widths, extra_sheets = _template_layout()
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(TEMPLATE_SHEET)
+    for col, width in widths.items():
+        ws.column_dimensions[col].width = width
+
+    bold = Font(bold=True)
+    header_cells = []
+    for h in headers:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = bold
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in _iter_rows(orders_data_list, headers):
+        ws.append(row)
+
+    for title, rows in extra_sheets:
+        extra = wb.create_sheet(title)
+        for r in rows:
+            extra.append(r)
+
     output = io.BytesIO()
     wb.save(output)
     output.seek(0)
     return output
 
+def export_orders_to_excel(orders_data_list, streaming=None):
+    """
+    Xuất danh sách đơn hàng ra file Excel theo mẫu Nobita.
+    - Lô nhỏ: dựa trên template (cache bytes) để giữ nguyên format (styles, columns).
+    - Lô lớn (> EXCEL_STREAMING_THRESHOLD) hoặc streaming=True: ghi write-only, RAM ổn định.
+    """
+    headers = _load_headers()
+    if streaming is None:
+        streaming = not hasattr(orders_data_list, '__len__') or len(orders_data_list) > EXCEL_STREAMING_THRESHOLD
+    if streaming:
+        return _export_streaming(orders_data_list, headers)
+    return _export_from_template(orders_data_list, headers)
@@ -0,0 +1,303 @@
+"""
+Hàng đợi job chạy nền cho việc gen ảnh AI (vài chục giây / job) -> UI không bị treo.
+- Bảng job nằm trong SQLite (cùng thư mục .cache) -> F5 trình duyệt vẫn xem lại được kết quả.
+- Worker là ThreadPoolExecutor, số job chạy song song = AI_JOB_WORKERS.
+- Nhiều process (worker Streamlit) dùng chung 1 file DB: job được nhận bằng UPDATE có điều kiện
+  (chỉ 1 process thắng), job đang chạy giữ lease do process sở hữu gia hạn định kỳ;
+  chỉ job hết lease (process chủ đã chết) mới bị đánh dấu gián đoạn.
+- Job xong: ảnh lưu lên Storage; job gắn với sản phẩm thì ghi URL vào order_items.img_sub1.
+- Mọi lần gọi Gemini đi qua 1 token bucket (AI_RATE_PER_MINUTE) và tự thử lại khi hết quota.
+UI chỉ gọi submit_* rồi đọc trạng thái bằng get_job / latest_job_for_item.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from modules.disk_cache import CACHE_DIR
+from modules.ai_logic import gen_anh_mau_theu, generate_image_from_ref
+from modules.data_handler import _store_content, update_item_image
+
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "2"))
+JOB_DB_PATH = os.path.join(CACHE_DIR, "ai_jobs.sqlite")
+JOB_KEEP_SECONDS = 7 * 24 * 3600  # Job cũ hơn thì xoá khỏi bảng
+JOB_FETCH_TIMEOUT = 30
+JOB_INPUT_CACHE_BYTES = 64 * 1024 * 1024  # Ảnh gốc đã tải (theo URL) giữ lại cho lần gen sau
+JOB_LEASE_SECONDS = 90  # Job đang chạy mà process chủ không gia hạn quá mức này -> coi như chết
+JOB_HEARTBEAT_SECONDS = 20
+
+# Định danh process này (pid có thể bị dùng lại sau khi restart container -> thêm chuỗi ngẫu nhiên)
+_OWNER = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+
+# --- GIỚI HẠN TỐC ĐỘ GỌI GEMINI ---
+AI_RATE_PER_MINUTE = float(os.getenv("AI_RATE_PER_MINUTE", "10"))
+AI_RATE_BURST = int(os.getenv("AI_RATE_BURST", "3"))  # Số lần gọi được dồn ngay khi rảnh
+AI_MAX_RETRIES = 4
+AI_BACKOFF_SECONDS = 5  # Chờ 5s, 10s, 20s, 40s (+ ngẫu nhiên) khi hết quota
+
+class TokenBucket:
+    """Token bucket dùng chung cho mọi worker: acquire() chặn đến khi có lượt gọi."""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+_bucket = TokenBucket(AI_RATE_PER_MINUTE, AI_RATE_BURST)
+
+def _is_quota_error(e):
+    try:
+        from google.api_core import exceptions as gexc
+        if isinstance(e, (gexc.ResourceExhausted, gexc.TooManyRequests, gexc.ServiceUnavailable)):
+            return True
+    except ImportError:
+        pass
+    msg = str(e).lower()
+    return "429" in msg or "quota" in msg or "resource exhausted" in msg
+
+def _call_ai(job_id, fn, input_bytes, prompt):
+    """Gọi Gemini qua token bucket; lỗi quota -> chờ lũy thừa rồi thử lại."""
+    for attempt in range(AI_MAX_RETRIES + 1):
+        _bucket.acquire()
+        try:
+            return fn(input_bytes, prompt, raise_errors=True)
+        except Exception as e:
+            if attempt == AI_MAX_RETRIES or not _is_quota_error(e):
+                raise
+            wait = AI_BACKOFF_SECONDS * 2 ** attempt + random.uniform(0, AI_BACKOFF_SECONDS)
+            _update(job_id, error=f"Hết quota, thử lại lần {attempt + 1} sau {wait:.0f}s")
+            time.sleep(wait)
+
+_lock = threading.Lock()
+_executor = None
+
+_input_cache = OrderedDict()  # url -> bytes (URL theo content-hash không đổi nội dung)
+_input_cache_bytes = 0
+_input_cache_lock = threading.Lock()
+_http = requests.Session()
+
+def _tai_anh_input(url):
+    """Tải ảnh gốc theo URL, nhớ lại theo LRU (gen lại / gen hàng loạt không tải lại)."""
+    global _input_cache_bytes
+    with _input_cache_lock:
+        if url in _input_cache:
+            _input_cache.move_to_end(url)
+            return _input_cache[url]
+    resp = _http.get(url, timeout=JOB_FETCH_TIMEOUT)
+    resp.raise_for_status()
+    data = resp.content
+    with _input_cache_lock:
+        if url not in _input_cache:
+            _input_cache[url] = data
+            _input_cache_bytes += len(data)
+        while _input_cache_bytes > JOB_INPUT_CACHE_BYTES and len(_input_cache) > 1:
+            _, old = _input_cache.popitem(last=False)
+            _input_cache_bytes -= len(old)
+    return data
+
+def _connect():
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _recover_expired(conn):
+    """Job 'running' hết lease (process chủ đã tắt) -> không biết kết quả, đánh dấu lỗi."""
+    conn.execute("update jobs set status = ?, error = ?, finished_at = ? where status = ? and coalesce(lease_until, 0) < ?",
+                 (ERROR, "Bị gián đoạn (app khởi động lại)", time.time(), RUNNING, time.time()))
+
+def _heartbeat_loop():
+    """Gia hạn lease cho job của process này + dọn job hết lease của process khác."""
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            with closing(_connect()) as conn, conn:
+                conn.execute("update jobs set lease_until = ? where status = ? and owner = ?",
+                             (time.time() + JOB_LEASE_SECONDS, RUNNING, _OWNER))
+                _recover_expired(conn)
+        except Exception as e:
+            print(f"Lỗi gia hạn job AI: {e}")
+
+def _get_executor():
+    """
+    Tạo DB + pool 1 lần; job còn 'queued' được đưa vào pool (process nào nhận trước thì chạy,
+    xem _claim), job 'running' hết lease được đánh dấu lỗi.
+    """
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with closing(_connect()) as conn, conn:
+                    conn.execute("pragma journal_mode=wal")
+                    conn.execute("""create table if not exists jobs (
+                        id integer primary key autoincrement,
+                        kind text not null, status text not null,
+                        item_id integer, prompt text, input_url text, input_bytes blob,
+                        result_url text, error text,
+                        created_at real not null, started_at real, finished_at real)""")
+                    conn.execute("create index if not exists idx_jobs_item on jobs (item_id, id)")
+                    # DB tạo từ bản cũ chưa có cột owner / lease_until
+                    cols = {r["name"] for r in conn.execute("pragma table_info(jobs)")}
+                    if "owner" not in cols:
+                        conn.execute("alter table jobs add column owner text")
+                    if "lease_until" not in cols:
+                        conn.execute("alter table jobs add column lease_until real")
+                    conn.execute("delete from jobs where created_at < ?", (time.time() - JOB_KEEP_SECONDS,))
+                    _recover_expired(conn)
+                    pending = [r["id"] for r in conn.execute("select id from jobs where status = ? order by id", (QUEUED,))]
+                threading.Thread(target=_heartbeat_loop, name="ai-job-lease", daemon=True).start()
+                _executor = ThreadPoolExecutor(max_workers=AI_JOB_WORKERS, thread_name_prefix="ai-job")
+                for job_id in pending:
+                    _executor.submit(_run_job, job_id)
+    return _executor
+
+def _update(job_id, **fields):
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    with closing(_connect()) as conn, conn:
+        conn.execute(f"update jobs set {cols} where id = ?", (*fields.values(), job_id))
+
+def _claim(job_id):
+    """Nhận job: chuyển queued -> running chỉ khi job vẫn đang queued (1 process thắng)."""
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        claimed = conn.execute(
+            "update jobs set status = ?, started_at = ?, owner = ?, lease_until = ? where id = ? and status = ?",
+            (RUNNING, now, _OWNER, now + JOB_LEASE_SECONDS, job_id, QUEUED)).rowcount == 1
+        return conn.execute("select * from jobs where id = ?", (job_id,)).fetchone() if claimed else None
+
+def _run_job(job_id):
+    job = _claim(job_id)
+    if job is None:
+        return  # Job đã được process/thread khác nhận hoặc đã xong
+    try:
+        input_bytes = job["input_bytes"]
+        if input_bytes is None and job["input_url"]:
+            input_bytes = _tai_anh_input(job["input_url"])
+        if not input_bytes:
+            raise ValueError("Thiếu ảnh gốc")
+
+        if job["kind"] == "gen_mau":
+            ai_bytes = _call_ai(job_id, gen_anh_mau_theu, input_bytes, job["prompt"])
+            file_name, folder = f"item_{job['item_id']}_ai.png", "items"
+        else:
+            ai_bytes = _call_ai(job_id, generate_image_from_ref, input_bytes, job["prompt"])
+            file_name, folder = f"ai_res_{job_id}.png", "ai_temp"
+        if not ai_bytes:
+            raise ValueError("AI không trả về ảnh")
+
+        url = _store_content(ai_bytes, file_name, folder)
+        if not url:
+            raise ValueError("Lỗi lưu ảnh kết quả")
+        if job["item_id"] is not None and not update_item_image(job["item_id"], url, "img_sub1"):
+            raise ValueError("Lỗi cập nhật ảnh cho sản phẩm")
+        # Bỏ ảnh input khỏi bảng khi xong cho nhẹ file
+        _update(job_id, status=DONE, result_url=url, error=None, input_bytes=None, finished_at=time.time())
+    except Exception as e:
+        print(f"❌ Lỗi job AI #{job_id}: {e}")
+        _update(job_id, status=ERROR, error=str(e), input_bytes=None, finished_at=time.time())
+
+def _submit(kind, prompt, item_id=None, input_bytes=None, input_url=None):
+    executor = _get_executor()
+    with closing(_connect()) as conn, conn:
+        cur = conn.execute(
+            "insert into jobs (kind, status, item_id, prompt, input_url, input_bytes, created_at) values (?, ?, ?, ?, ?, ?, ?)",
+            (kind, QUEUED, item_id, prompt, input_url, input_bytes, time.time()))
+        job_id = cur.lastrowid
+    executor.submit(_run_job, job_id)
+    return job_id
+
+def submit_gen_mau(item_id, prompt, input_bytes=None, input_url=None):
+    """Gen mẫu thêu cho 1 sản phẩm (kết quả ghi vào img_sub1). Trả về job_id."""
+    active = latest_job_for_item(item_id)
+    if active and active["status"] in (QUEUED, RUNNING):
+        return active["id"]  # Đang có job cho sản phẩm này -> không gửi trùng
+    return _submit("gen_mau", prompt, item_id=item_id, input_bytes=input_bytes, input_url=input_url)
+
+def chon_item_can_gen(orders):
+    """
+    Từ list {'order_info', 'items'} (get_orders_with_items) -> các item cần gen mẫu:
+    đơn TGTĐ, có img_main, chưa có img_sub1.
+    """
+    out = []
+    for o in orders:
+        if (o["order_info"].get("shop") or "") != "TGTĐ":
+            continue
+        out.extend(it for it in o["items"] if it.get("img_main") and not it.get("img_sub1"))
+    return out
+
+def submit_gen_mau_batch(orders):
+    """Gửi job gen mẫu cho mọi item cần gen trong các đơn. Trả về list job_id."""
+    return [submit_gen_mau(it["id"], f"{it.get('ten_sp')} {it.get('kieu_theu')}", input_url=it["img_main"])
+            for it in chon_item_can_gen(orders)]
+
+def submit_edit_anh(input_bytes, prompt):
+    """Edit ảnh theo prompt (trang AI Edit). Trả về job_id."""
+    return _submit("edit_anh", prompt, input_bytes=input_bytes)
+
+def _as_dict(row):
+    if row is None:
+        return None
+    job = {k: row[k] for k in row.keys() if k != "input_bytes"}
+    end = job["finished_at"] or time.time()
+    job["elapsed"] = end - (job["started_at"] or job["created_at"])
+    return job
+
+_COLUMNS = "id, kind, status, item_id, prompt, input_url, result_url, error, created_at, started_at, finished_at"
+
+def get_job(job_id):
+    """Trạng thái 1 job: dict (status, result_url, error, elapsed...) hoặc None."""
+    _get_executor()
+    with closing(_connect()) as conn:
+        return _as_dict(conn.execute(f"select {_COLUMNS} from jobs where id = ?", (job_id,)).fetchone())
+
+def get_jobs(job_ids):
+    """Trạng thái nhiều job 1 lần (theo thứ tự job_ids)."""
+    if not job_ids:
+        return []
+    _get_executor()
+    marks = ",".join("?" * len(job_ids))
+    with closing(_connect()) as conn:
+        rows = {r["id"]: _as_dict(r) for r in conn.execute(f"select {_COLUMNS} from jobs where id in ({marks})", list(job_ids))}
+    return [rows[i] for i in job_ids if i in rows]
+
+def latest_job_for_item(item_id):
+    _get_executor()
+    with closing(_connect()) as conn:
+        return _as_dict(conn.execute(f"select {_COLUMNS} from jobs where item_id = ? order by id desc limit 1",
+                                     (item_id,)).fetchone())
+
+def recent_jobs(kind=None, limit=10):
+    _get_executor()
+    sql, args = f"select {_COLUMNS} from jobs", ()
+    if kind:
+        sql, args = sql + " where kind = ?", (kind,)
+    with closing(_connect()) as conn:
+        return [_as_dict(r) for r in conn.execute(sql + " order by id desc limit ?", (*args, limit))]
+
+def active_job_count():
+    _get_executor()
+    with closing(_connect()) as conn:
+        return conn.execute("select count(*) from jobs where status in (?, ?)", (QUEUED, RUNNING)).fetchone()[0]
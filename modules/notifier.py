@@ -1,45 +1,231 @@
+"""
+Gửi thông báo Telegram qua hàng đợi chạy nền.
+- send_telegram_notification chỉ ghi tin vào outbox (SQLite) rồi trả về ngay -> lưu đơn không chờ Telegram.
+- 1 thread dispatcher / process gửi bằng requests.Session dùng chung, lỗi thì thử lại theo lũy thừa.
+- Tin cùng chủ đề (VD nhiều đơn "Chờ phôi") trong TELEGRAM_DIGEST_SECONDS được gộp thành 1 tin.
+"""
 import requests
 import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from requests.adapters import HTTPAdapter
 import streamlit as st
 
-def send_telegram_notification(message):
+from modules.disk_cache import CACHE_DIR
+
+TELEGRAM_DB_PATH = os.path.join(CACHE_DIR, "telegram_outbox.sqlite")
+TELEGRAM_TIMEOUT = 10
+TELEGRAM_DIGEST_SECONDS = 60   # Cửa sổ gộp tin cùng chủ đề
+TELEGRAM_MAX_ATTEMPTS = 6      # Thử lại 5s, 10s, 20s... rồi bỏ (status failed)
+TELEGRAM_BACKOFF_SECONDS = 5
+TELEGRAM_KEEP_SECONDS = 7 * 24 * 3600
+TELEGRAM_MAX_MESSAGE = 4000    # Telegram giới hạn 4096 ký tự / tin
+
+# Chủ đề gộp tin: topic -> tiêu đề bản tin gộp ({n} = số tin)
+DIGEST_TOPICS = {
+    "cho_phoi": "⚠️ <b>Đã hết phôi áo của {n} đơn hàng, Xin hãy đặt thêm phôi!</b>",
+    "thieu_file": "📂 <b>{n} đơn hàng đang thiếu file thiết kế, hãy kiểm tra!</b>",
+}
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+def _telegram_config():
+    # Lấy thông tin cấu hình từ biến môi trường (File .env hoặc st.secrets)
+    return os.getenv("TELEGRAM_BOT_TOKEN"), os.getenv("TELEGRAM_CHAT_ID")
+
+def _connect():
+    conn = sqlite3.connect(TELEGRAM_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def _ensure_worker():
+    """Tạo outbox + thread dispatcher 1 lần / process."""
+    global _worker
+    if _worker is None:
+        with _lock:
+            if _worker is None:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                with closing(_connect()) as conn, conn:
+                    conn.execute("pragma journal_mode=wal")
+                    conn.execute("""create table if not exists outbox (
+                        id integer primary key autoincrement,
+                        topic text, message text not null, line text,
+                        status text not null default 'pending', attempts integer not null default 0,
+                        next_try real not null, created_at real not null, sent_at real, error text)""")
+                    conn.execute("create index if not exists idx_outbox_status on outbox (status, next_try)")
+                    conn.execute("delete from outbox where created_at < ? and status != 'pending'",
+                                 (time.time() - TELEGRAM_KEEP_SECONDS,))
+                    # Tin đang gửi dở khi process tắt -> gửi lại
+                    conn.execute("update outbox set status = 'pending' where status = 'sending'")
+                _worker = threading.Thread(target=_dispatch_loop, name="telegram-dispatcher", daemon=True)
+                _worker.start()
+
+def _post(token, chat_id, message):
+    """Gửi 1 tin. Trả về (ok, lỗi, số giây Telegram yêu cầu chờ hoặc None)."""
+    try:
+        resp = _http.post(f"https://api.telegram.org/bot{token}/sendMessage",
+                          data={"chat_id": chat_id, "text": message, "parse_mode": "HTML"},
+                          timeout=TELEGRAM_TIMEOUT)
+        if resp.status_code == 200:
+            return True, None, None
+        retry_after = None
+        if resp.status_code == 429:
+            try: retry_after = resp.json().get("parameters", {}).get("retry_after")
+            except ValueError: pass
+        return False, f"HTTP {resp.status_code}", retry_after
+    except Exception as e:
+        return False, str(e), None
+
+def _claim_batch(now):
     """
-    Hàm gửi thông báo qua Telegram Bot
-    Tham số: message - Nội dung thông báo (hỗ trợ HTML)
+    Lấy 1 lô tin đến hạn và đánh dấu 'sending':
+    - tin thường: từng tin; tin có topic: cả nhóm khi tin cũ nhất đã đợi đủ cửa sổ gộp
+      (bỏ qua các tin cùng topic còn đang chờ thử lại - next_try chưa tới).
     """
-    # Lấy thông tin cấu hình từ biến môi trường (File .env hoặc st.secrets)
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    chat_id = os.getenv("TELEGRAM_CHAT_ID")
+    with closing(_connect()) as conn, conn:
+        conn.execute("begin immediate")
+        row = conn.execute("""select id, topic from outbox where status = 'pending' and next_try <= ?
+                              and (topic is null or created_at <= ?) order by id limit 1""",
+                           (now, now - TELEGRAM_DIGEST_SECONDS)).fetchone()
+        if row is None:
+            return []
+        if row["topic"] is None:
+            rows = conn.execute("select * from outbox where id = ?", (row["id"],)).fetchall()
+        else:
+            rows = conn.execute("""select * from outbox where status = 'pending' and topic = ? and next_try <= ?
+                                   order by id""", (row["topic"], now)).fetchall()
+        conn.executemany("update outbox set status = 'sending' where id = ?", [(r["id"],) for r in rows])
+        return rows
+
+def _seconds_until_due(now, idle=5):
+    """Ngủ tới khi tin kế tiếp đến hạn (tối đa `idle` giây)."""
+    with closing(_connect()) as conn:
+        due = conn.execute("""select min(max(next_try, case when topic is null then 0 else created_at + ? end))
+                              from outbox where status = 'pending'""", (TELEGRAM_DIGEST_SECONDS,)).fetchone()[0]
+    return idle if due is None else min(idle, max(0.05, due - now))
+
+def _digest_messages(rows):
+    """
+    List (tin, các dòng outbox trong tin đó).
+    1 tin -> giữ nguyên; nhiều tin cùng topic -> tiêu đề + danh sách (chia nhỏ nếu quá dài).
+    """
+    if len(rows) == 1:
+        return [(rows[0]["message"], rows)]
+    header = DIGEST_TOPICS.get(rows[0]["topic"], "🔔 <b>{n} thông báo</b>").format(n=len(rows))
+    out, cur, part = [], header, []
+    for r in rows:
+        line = f"• {r['line'] or r['message']}"
+        if part and len(cur) + len(line) + 1 > TELEGRAM_MAX_MESSAGE:
+            out.append((cur, part))
+            cur, part = header, []
+        cur += "\n" + line
+        part.append(r)
+    out.append((cur, part))
+    return out
+
+def _finish(rows, ok, error, retry_after, now):
+    ids = [(r["id"],) for r in rows]
+    with closing(_connect()) as conn, conn:
+        if ok:
+            conn.executemany("update outbox set status = 'sent', sent_at = ?, error = null where id = ?",
+                             [(now, i) for (i,) in ids])
+            return
+        for r in rows:
+            attempts = r["attempts"] + 1
+            if attempts >= TELEGRAM_MAX_ATTEMPTS:
+                conn.execute("update outbox set status = 'failed', attempts = ?, error = ? where id = ?",
+                             (attempts, error, r["id"]))
+            else:
+                wait = retry_after or TELEGRAM_BACKOFF_SECONDS * 2 ** (attempts - 1)
+                conn.execute("update outbox set status = 'pending', attempts = ?, error = ?, next_try = ? where id = ?",
+                             (attempts, error, now + wait, r["id"]))
+
+def _dispatch_loop():
+    while True:
+        try:
+            token, chat_id = _telegram_config()
+            rows = _claim_batch(time.time()) if token and chat_id else []
+            if not rows:
+                _wakeup.wait(timeout=_seconds_until_due(time.time()))
+                _wakeup.clear()
+                continue
+            # Đánh dấu 'sent' theo từng phần của bản gộp: phần lỗi và các phần sau
+            # được xếp lại, phần đã gửi không bị gửi lại
+            chunks = _digest_messages(rows)
+            for i, (msg, part) in enumerate(chunks):
+                ok, error, retry_after = _post(token, chat_id, msg)
+                if ok:
+                    _finish(part, True, None, None, time.time())
+                    continue
+                print(f"❌ Lỗi gửi Telegram: {error}")
+                _finish([r for _, p in chunks[i:] for r in p], False, error, retry_after, time.time())
+                break
+        except Exception as e:
+            print(f"❌ Lỗi dispatcher Telegram: {e}")
+            time.sleep(5)
+
+def send_telegram_notification(message, topic=None, line=None):
+    """
+    Xếp 1 tin Telegram vào hàng đợi (hỗ trợ HTML), trả về ngay.
+    topic: tin cùng topic trong TELEGRAM_DIGEST_SECONDS được gộp 1 tin; line: dòng hiển thị trong bản gộp.
+    Trả về False nếu chưa cấu hình Telegram hoặc không ghi được hàng đợi.
+    """
+    token, chat_id = _telegram_config()
 
     # Kiểm tra nếu chưa cấu hình thì thông báo nhẹ, không làm crash app
     if not token or not chat_id:
         # st.toast("⚠️ Chưa cấu hình Telegram Bot. Vui lòng kiểm tra .env", icon="🤖")
         return False
 
-    api_url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "HTML"
-    }
-
     try:
-        # Gửi yêu cầu POST tới Telegram API với timeout 5 giây
-        response = requests.post(api_url, data=payload, timeout=5)
-        
-        # Kiểm tra kết quả trả về
-        if response.status_code == 200:
-            st.toast("🔔 Đã gửi thông báo Telegram thành công!", icon="🚀")
-            return True
-        else:
-            st.toast(f"❌ Lỗi gửi Telegram: {response.status_code}", icon="⚠️")
-            return False
-            
+        _ensure_worker()
+        now = time.time()
+        with closing(_connect()) as conn, conn:
+            conn.execute("insert into outbox (topic, message, line, next_try, created_at) values (?, ?, ?, ?, ?)",
+                         (topic, message, line, now, now))
+        _wakeup.set()
+        st.toast("📨 Đã xếp hàng gửi Telegram", icon="🚀")
+        return True
     except Exception as e:
-        # Xử lý lỗi mạng hoặc lỗi API mà không làm dừng ứng dụng
-        st.toast(f"📡 Lỗi kết nối Telegram: {str(e)}", icon="🌐")
+        st.toast(f"📡 Lỗi hàng đợi Telegram: {str(e)}", icon="🌐")
         return False
 
+def telegram_queue_stats():
+    """{'pending', 'failed', 'sent_24h', 'last_error'} để hiện trên sidebar."""
+    out = {"pending": 0, "failed": 0, "sent_24h": 0, "last_error": None}
+    try:
+        _ensure_worker()
+        with closing(_connect()) as conn:
+            for status, n in conn.execute("select status, count(*) from outbox where status != 'sent' group by status"):
+                key = "failed" if status == "failed" else "pending"
+                out[key] += n
+            out["sent_24h"] = conn.execute("select count(*) from outbox where status = 'sent' and sent_at >= ?",
+                                           (time.time() - 86400,)).fetchone()[0]
+            row = conn.execute("select error from outbox where error is not null order by id desc limit 1").fetchone()
+            out["last_error"] = row[0] if row else None
+    except Exception as e:
+        print(f"Lỗi đọc hàng đợi Telegram: {e}")
+    return out
+
+def retry_failed_telegram():
+    """Đưa các tin đã bỏ (failed) về hàng đợi để gửi lại."""
+    try:
+        _ensure_worker()
+        with closing(_connect()) as conn, conn:
+            n = conn.execute("update outbox set status = 'pending', attempts = 0, next_try = ? where status = 'failed'",
+                             (time.time(),)).rowcount
+        _wakeup.set()
+        return n
+    except Exception as e:
+        print(f"Lỗi gửi lại Telegram: {e}")
+        return 0
+
 def check_order_notifications(ma_don, old_tags, new_tags):
     """
     Kiểm tra các rule gửi thông báo dựa trên tag
@@ -50,11 +236,32 @@ def check_order_notifications(ma_don, old_tags, new_tags):
     if not isinstance(new_tags, list): new_tags = []
 
     # Rule 1: "Chờ phôi" (Gửi nếu mới được thêm vào)
+    # Nhiều đơn trong 1 phút -> gộp thành 1 tin (topic)
     if "Chờ phôi" in new_tags and "Chờ phôi" not in old_tags:
         msg = f"⚠️ <b>Đã hết phôi áo của đơn hàng {ma_don}, Xin hãy đặt thêm phôi!</b>"
-        send_telegram_notification(msg)
+        send_telegram_notification(msg, topic="cho_phoi", line=f"Đơn {ma_don}")
 
     # Rule 2: "Thiếu file tk" (Gửi nếu mới được thêm vào)
     if "Thiếu file tk" in new_tags and "Thiếu file tk" not in old_tags:
         msg = f"📂 <b>Đơn hàng {ma_don} đang thiếu file thiết kế, hãy kiểm tra!</b>"
-        send_telegram_notification(msg)
+        send_telegram_notification(msg, topic="thieu_file", line=f"Đơn {ma_don}")
+
+# Số ngày trong báo cáo khối lượng (Dashboard + Telegram dùng chung)
+WORKLOAD_DAYS = 7
+
+def format_workload_message(df_workload, overdue_count=0):
+    """
+    Tạo nội dung báo cáo khối lượng theo ngày từ DeadlineIndex.workload()
+    (DataFrame [ngay, so_don, so_don_hen]).
+    """
+    lines = ["📅 <b>Khối lượng trả hàng các ngày tới</b>"]
+    for row in df_workload.itertuples(index=False):
+        hen = f" (🚨 {row.so_don_hen} hẹn)" if row.so_don_hen else ""
+        lines.append(f"• {row.ngay:%d/%m}: <b>{row.so_don}</b> đơn{hen}")
+    if overdue_count:
+        lines.append(f"⌛ Quá hạn: <b>{overdue_count}</b> đơn chưa xong")
+    return "\n".join(lines)
+
+def send_workload_report(df_workload, overdue_count=0):
+    """Gửi báo cáo khối lượng (cùng số liệu với box Nhắc việc) qua Telegram."""
+    return send_telegram_notification(format_workload_message(df_workload, overdue_count))
@@ -0,0 +1,100 @@
+"""
+Chuẩn bị dữ liệu cho Dashboard đơn hàng.
+Module thuần pandas (không gọi Streamlit/Supabase) -> test được riêng.
+Mọi bước tính theo cột (vectorized), không dùng DataFrame.apply(axis=1).
+"""
+import numpy as np
+import pandas as pd
+
+URGENT_STYLE = 'background-color: #ffebee; color: #c62828; font-weight: bold'
+DASHBOARD_COLUMNS = ["display_ma_don", "display_tags", "ten_khach", "shop", "deadline", "thanh_tien", "trang_thai"]
+
+def chuan_hoa_don_hang(df):
+    """Chuẩn hoá kiểu dữ liệu các cột hay dùng (sửa trực tiếp trên df và trả lại df)."""
+    if df.empty:
+        return df
+    df['trang_thai'] = df['trang_thai'].astype(str).str.strip()
+    if 'shop' not in df.columns: df['shop'] = "Inside"
+    if 'tags' not in df.columns: df['tags'] = None
+    for col in ('thanh_tien', 'da_coc'):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    return df
+
+def parse_ngay(values):
+    """
+    Chuỗi ngày ('YYYY-MM-DD' hoặc ISO có giờ/múi giờ) -> datetime64 (không múi giờ).
+    Chỉ lấy 10 ký tự đầu nên parse 1 lần cho cả cột với format cố định.
+    """
+    s = pd.Series(values)
+    return pd.to_datetime(s.astype(str).str[:10], format="%Y-%m-%d", errors='coerce')
+
+def _format_tags(tags):
+    # Cột tags là list (không vector hoá được) -> list comprehension thay cho apply
+    out = []
+    for t in tags:
+        if isinstance(t, str): out.append(t)
+        elif isinstance(t, (list, tuple, np.ndarray)): out.append(", ".join(str(x) for x in t if x))
+        else: out.append("")
+    return out
+
+def prepare_dashboard_table(df, ignore_statuses):
+    """
+    Từ 1 trang đơn hàng -> (df_display, urgent).
+    - urgent: Series bool (đơn hẹn ngày và chưa xong/hủy), cùng index với df_display.
+    - df_display: các cột DASHBOARD_COLUMNS, đơn gấp lên đầu, rồi mới nhất trước.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=DASHBOARD_COLUMNS), pd.Series(dtype=bool)
+    df = df.copy()
+
+    if 'co_hen_ngay' in df.columns:
+        urgent = df['co_hen_ngay'].eq(True) & ~df['trang_thai'].astype(str).str.strip().isin(ignore_statuses)
+    else:
+        urgent = pd.Series(False, index=df.index)
+    df['is_urgent_active'] = urgent
+    sort_cols = ['is_urgent_active'] + (['created_at'] if 'created_at' in df.columns else [])
+    df = df.sort_values(by=sort_cols, ascending=[False] * len(sort_cols), kind='stable')
+
+    # Hạn chót: dd/mm/yyyy, thêm 🚨 nếu gấp; không parse được -> giữ chuỗi gốc
+    raw = df['ngay_tra'] if 'ngay_tra' in df.columns else pd.Series("", index=df.index)
+    d_str = parse_ngay(raw.values).dt.strftime("%d/%m/%Y")
+    d_str.index = df.index
+    deadline = d_str.fillna(raw.where(raw.notna(), "").astype(str))
+    df['deadline'] = deadline.where(~df['is_urgent_active'], "🚨 " + deadline)
+
+    ma_don = df['ma_don'].astype(str)
+    if 'da_in' in df.columns:
+        df['display_ma_don'] = ma_don.where(~df['da_in'].eq(True), "🖨️ " + ma_don)
+    else:
+        df['display_ma_don'] = ma_don
+
+    df['display_tags'] = _format_tags(df['tags'].values) if 'tags' in df.columns else ""
+
+    valid_cols = [c for c in DASHBOARD_COLUMNS if c in df.columns]
+    urgent = df['is_urgent_active'].reset_index(drop=True)
+    return df[valid_cols].reset_index(drop=True), urgent
+
+def highlight_urgent(df_display, urgent):
+    """Style cho Styler.apply(..., axis=None): tô đỏ cả dòng đơn gấp, tính 1 lần cho cả bảng."""
+    mask = np.asarray(urgent, dtype=bool)[:, None]
+    styles = np.where(mask, URGENT_STYLE, '')
+    return pd.DataFrame(np.broadcast_to(styles, df_display.shape), index=df_display.index, columns=df_display.columns)
+
+def tinh_kpi_don_hang(df, status_done, status_cancel):
+    """KPI từ DataFrame có cột trang_thai, thanh_tien, da_coc (dùng khi RPC dashboard_kpis lỗi)."""
+    kpi = {"tong_don": 0, "da_xong": 0, "da_huy": 0,
+           "dt_ban_hang": 0.0, "dt_coc": 0.0, "dt_thuc_nhan": 0.0}
+    if df.empty:
+        return kpi
+    stt = df["trang_thai"].astype(str).str.strip()
+    tien = pd.to_numeric(df["thanh_tien"], errors="coerce").fillna(0)
+    coc = pd.to_numeric(df["da_coc"], errors="coerce").fillna(0)
+    is_done, is_cancel = stt.isin(status_done), stt.isin(status_cancel)
+    kpi.update(
+        tong_don=len(df), da_xong=int(is_done.sum()), da_huy=int(is_cancel.sum()),
+        dt_ban_hang=float(tien[~is_cancel].sum()), dt_coc=float(coc[~is_cancel].sum()),
+        # Thực nhận: đơn xong tính đủ tiền, đơn đang làm tính tiền cọc
+        dt_thuc_nhan=float(tien.where(is_done, coc)[~is_cancel].sum()),
+    )
+    return kpi
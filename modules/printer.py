@@ -1,83 +1,84 @@
 import streamlit as st
+import html
+import io
+import base64
+import threading
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from modules.data_handler import rendition_url, compress_image
 
-def _get_single_order_body(order_info, items):
-    """
-    Hàm helper: Tạo nội dung HTML body cho 1 đơn hàng (Layout Dọc - Compact).
-    """
-    shop_type = order_info.get('shop', 'Inside')
-    
-    # --- LOGIC TẠO LIST ITEM ---
-    items_html = ""
-    for i, item in enumerate(items):
-        # 1. Thu thập tất cả ảnh CÓ DỮ LIỆU
-        valid_images = []
-        # Kiểm tra từng loại ảnh, nếu có URL thì thêm vào list
-        if item.get('img_main'): valid_images.append({'url': item['img_main'], 'label': 'Ảnh Gốc'})
-        if item.get('img_sub1'): valid_images.append({'url': item['img_sub1'], 'label': 'Ảnh 1'})
-        if item.get('img_design'): valid_images.append({'url': item['img_design'], 'label': 'Design'})
-
-        # 2. Tạo HTML cho phần ảnh (Nếu có)
-        images_row_html = ""
-        if valid_images:
-            imgs_html = ""
-            # Logic chia cột ảnh: Tự động chia đều chiều rộng
-            width_pct = int(100 / len(valid_images)) - 1 
-            for img in valid_images:
-                imgs_html += f"""
-                <div class="img-box" style="width: {width_pct}%;">
-                    <img src="{img['url']}" />
-                    <span class="label">{img['label']}</span>
-                </div>
-                """
-            images_row_html = f'<div class="item-images">{imgs_html}</div>'
-        
-        # 3. Tổng hợp HTML cho 1 sản phẩm
-        items_html += f"""
+# Số đơn tối đa trong 1 file in. Lô lớn hơn được chia thành nhiều file
+# để iframe in không phải render 1 chuỗi HTML vài MB.
+PRINT_ORDERS_PER_DOC = 50
+
+# --- ẢNH NHÚNG SẴN (IN OFFLINE) ---
+# Ô ảnh trên phiếu chỉ cao 140px -> 400px ngang là đủ nét khi in
+PRINT_IMAGE_WIDTH = 400
+PRINT_FETCH_WORKERS = 8
+PRINT_FETCH_TIMEOUT = 10
+PRINT_INLINE_CACHE_SIZE = 512
+
+_inline_cache = OrderedDict()  # url -> data URI (URL theo content-hash không đổi nội dung)
+_inline_cache_lock = threading.Lock()
+_http = requests.Session()
+
+# --- TEMPLATE ---
+# Mỗi khối HTML là 1 f-string (nhanh hơn str.format(**kwargs) / string.Template);
+# giá trị truyền vào đã được escape sẵn.
+def _img_html(width, src, label):
+    return f"""
+                <div class="img-box" style="width: {width}%;">
+                    <img src="{src}" />
+                    <span class="label">{label}</span>
+                </div>"""
+
+def _item_html(stt, ten_sp, mau, size, so_luong, kieu_theu, images_html):
+    return f"""
         <div class="item-row">
             <div class="item-header">
-                <span class="stt">#{i+1}</span>
-                <span class="p-name">{item.get('ten_sp')}</span>
-                <span class="p-attr">Màu: <b>{item.get('mau')}</b></span>
-                <span class="p-attr">Size: <b>{item.get('size')}</b></span>
-                <span class="p-attr">SL: <b>{item.get('so_luong', 1)}</b></span>
+                <span class="stt">#{stt}</span>
+                <span class="p-name">{ten_sp}</span>
+                <span class="p-attr">Màu: <b>{mau}</b></span>
+                <span class="p-attr">Size: <b>{size}</b></span>
+                <span class="p-attr">SL: <b>{so_luong}</b></span>
             </div>
-            <div class="item-note">Note: {item.get('kieu_theu')}</div>
-            {images_row_html}
-        </div>
-        """
+            <div class="item-note">Note: {kieu_theu}</div>{images_html}
+        </div>"""
 
-    # --- KHUNG NỘI DUNG ĐƠN HÀNG ---
-    single_order_html = f"""
+def _order_html(shop, ten_khach, sdt, dia_chi, ma_don, ngay_dat, con_lai, items_html):
+    return f"""
     <div class="print-container">
         <!-- HEADER COMPACT -->
         <div class="header">
             <div class="h-left">
-                <div class="brand">PHIẾU SẢN XUẤT ({shop_type})</div>
+                <div class="brand">PHIẾU SẢN XUẤT ({shop})</div>
                 <div class="cust-info">
-                    Khách: <b>{order_info.get('ten_khach')}</b> - {order_info.get('sdt')}<br>
-                    Đ/c: {order_info.get('dia_chi')}
+                    Khách: <b>{ten_khach}</b> - {sdt}<br>
+                    Đ/c: {dia_chi}
                 </div>
             </div>
             <div class="h-right">
-                <div class="meta-row">Mã: <b>{order_info.get('ma_don')}</b></div>
-                <div class="meta-row">Ngày in: {order_info.get('ngay_dat')[:10]}</div>
-                <div class="meta-row">COD: <b>{float(order_info.get('con_lai', 0)):,.0f} đ</b></div>
+                <div class="meta-row">Mã: <b>{ma_don}</b></div>
+                <div class="meta-row">Ngày in: {ngay_dat}</div>
+                <div class="meta-row">COD: <b>{con_lai} đ</b></div>
             </div>
         </div>
 
         <!-- LIST SẢN PHẨM -->
-        <div class="items-list">
-            {items_html}
+        <div class="items-list">{items_html}
         </div>
     </div>
     """
-    return single_order_html
 
-def _get_css():
-    return """
+# (cột ảnh, nhãn) theo thứ tự hiển thị trên phiếu
+_IMAGE_FIELDS = (('img_main', 'Ảnh Gốc'), ('img_sub1', 'Ảnh 1'), ('img_design', 'Design'))
+
+_CSS = """
     <style>
-        @import url('https://fonts.googleapis.com/css2?family=Roboto:wght@400;700&display=swap');
-        body { font-family: 'Roboto', sans-serif; font-size: 13px; color: #000; margin: 0; padding: 0; }
+        /* Font hệ thống (không tải/nhúng font web -> in được khi mất mạng) */
+        body { font-family: 'Roboto', 'Segoe UI', Arial, sans-serif; font-size: 13px; color: #000; margin: 0; padding: 0; }
         
         .print-container { 
             width: 100%; max-width: 800px; margin: 0 auto; padding: 10px; 
@@ -111,56 +112,167 @@ def _get_css():
         .img-box img { width: 100%; height: 140px; object-fit: contain; display: block; }
         .label { display: block; font-size: 10px; color: #555; background: #f5f5f5; border-top: 1px solid #ddd; }
 
+        /* NÚT IN (chỉ hiện trên màn hình, dùng khi lô in bị chia nhiều phần) */
+        .print-btn { display: block; margin: 0 auto 15px auto; padding: 8px 20px; font-size: 14px; cursor: pointer; }
+
         @media print {
             .print-container { border-bottom: none; page-break-inside: avoid; margin-bottom: 20px; }
             .page-break { page-break-before: always; height: 0; display: block; }
+            .no-print { display: none !important; }
         }
     </style>
     """
 
-def generate_print_html(order_info, items):
-    """
-    Hàm tạo mã HTML để in phiếu sản xuất (Work Order) cho 1 đơn hàng.
-    """
-    body_content = _get_single_order_body(order_info, items)
-    
-    full_html = f"""
+_DOC_HEAD = """
     <!DOCTYPE html>
     <html>
-    <head>{_get_css()}</head>
+    <head><meta charset="utf-8">{css}</head>
     <body style="margin: 0; padding: 20px;">
-        {body_content}
-        <script>
-            window.onload = function() {{
-                // Auto print dialog
-                // window.print();
-            }}
-        </script>
+""".format
+
+_DOC_TAIL = """
     </body>
     </html>
     """
-    return full_html
 
-def generate_combined_print_html(orders_data_list):
+_PRINT_BUTTON = '<button class="print-btn no-print" onclick="window.print()">🖨️ In phần này</button>'
+
+def _fetch_inline_image(url):
+    """Tải 1 ảnh, thu nhỏ về cỡ in và trả về data URI. Lỗi -> None (phiếu dùng lại URL)."""
+    with _inline_cache_lock:
+        if url in _inline_cache:
+            _inline_cache.move_to_end(url)
+            return _inline_cache[url]
+    try:
+        resp = _http.get(rendition_url(url, 'print'), timeout=PRINT_FETCH_TIMEOUT)
+        resp.raise_for_status()
+        small = compress_image(io.BytesIO(resp.content), max_width=PRINT_IMAGE_WIDTH, fmt="JPEG")
+        if not small:
+            return None
+        data_uri = "data:image/jpeg;base64," + base64.b64encode(small).decode("ascii")
+    except Exception as e:
+        print(f"Lỗi tải ảnh in {url}: {e}")
+        return None
+    with _inline_cache_lock:
+        _inline_cache[url] = data_uri
+        while len(_inline_cache) > PRINT_INLINE_CACHE_SIZE:
+            _inline_cache.popitem(last=False)
+    return data_uri
+
+def prefetch_print_images(orders_data_list):
+    """
+    Tải song song toàn bộ ảnh của lô in và trả về dict {url: data URI}.
+    Ảnh tải lỗi không có trong dict -> phiếu vẫn dùng URL gốc.
+    """
+    urls = []
+    seen = set()
+    for data in orders_data_list:
+        for item in data.get('items') or []:
+            for key in ('img_main', 'img_sub1', 'img_design'):
+                url = item.get(key)
+                if url and url not in seen:
+                    seen.add(url)
+                    urls.append(url)
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PRINT_FETCH_WORKERS, len(urls))) as pool:
+        results = pool.map(_fetch_inline_image, urls)
+    return {url: uri for url, uri in zip(urls, results) if uri}
+
+def _esc(value, _escape=html.escape):
+    """Escape text của khách/nhân viên trước khi chèn vào HTML."""
+    if value is None:
+        return ""
+    return _escape(value if value.__class__ is str else str(value))
+
+@lru_cache(maxsize=4096)
+def _print_src(url):
+    """URL ảnh bản 'print' đã escape. Cùng 1 ảnh lặp lại nhiều lần trong lô in -> cache."""
+    return _esc(rendition_url(url, 'print'))
+
+def _fmt_money(value):
+    try: return f"{float(value or 0):,.0f}"
+    except (TypeError, ValueError): return "0"
+
+def _single_order_body(order_info, items, inline_images=None):
+    """
+    HTML body của 1 đơn (Layout Dọc - Compact).
+    inline_images: dict {url: data URI} từ prefetch_print_images (None -> dùng URL).
+    """
+    inline_get = (inline_images or {}).get
+    items_html = []
+    for i, item in enumerate(items):
+        # Thu thập tất cả ảnh CÓ DỮ LIỆU (dùng bản 'print' cho nhẹ)
+        valid_images = [(item[key], label) for key, label in _IMAGE_FIELDS if item.get(key)]
+        images_html = ""
+        if valid_images:
+            # Logic chia cột ảnh: Tự động chia đều chiều rộng
+            width_pct = int(100 / len(valid_images)) - 1
+            images_html = '\n            <div class="item-images">' + "".join(
+                _img_html(width_pct, inline_get(url) or _print_src(url), label) for url, label in valid_images
+            ) + '</div>'
+        items_html.append(_item_html(
+            i + 1, _esc(item.get('ten_sp')), _esc(item.get('mau')), _esc(item.get('size')),
+            _esc(item.get('so_luong', 1)), _esc(item.get('kieu_theu')), images_html,
+        ))
+
+    return _order_html(
+        _esc(order_info.get('shop', 'Inside')),
+        _esc(order_info.get('ten_khach')),
+        _esc(order_info.get('sdt')),
+        _esc(order_info.get('dia_chi')),
+        _esc(order_info.get('ma_don')),
+        _esc((order_info.get('ngay_dat') or '')[:10]),
+        _fmt_money(order_info.get('con_lai', 0)),
+        "".join(items_html),
+    )
+
+def _get_single_order_body(order_info, items):
+    """
+    Hàm helper: Tạo nội dung HTML body cho 1 đơn hàng (Layout Dọc - Compact).
+    """
+    return _single_order_body(order_info, items)
+
+def _get_css():
+    return _CSS
+
+def _render_document(orders_data_list, print_button=False, inline_images=None):
+    """
+    Ghép 1 file HTML in hoàn chỉnh (1 lần join cho cả file).
+    orders_data_list: list các dict [{'order_info': ..., 'items': ...}, ...]
+    print_button: thêm nút "In phần này" (ẩn khi in).
+    inline_images: dict {url: data URI} -> phiếu không cần tải ảnh khi mở.
+    """
+    # Thêm page-break giữa các đơn
+    bodies = '<div class="page-break"></div>'.join(
+        _single_order_body(data['order_info'], data['items'], inline_images) for data in orders_data_list
+    )
+    return "".join((_DOC_HEAD(css=_CSS), _PRINT_BUTTON if print_button else "", bodies, _DOC_TAIL))
+
+def generate_print_html(order_info, items, offline=True):
+    """
+    Hàm tạo mã HTML để in phiếu sản xuất (Work Order) cho 1 đơn hàng.
+    offline=True: ảnh được tải trước và nhúng thẳng vào HTML.
+    """
+    orders = [{"order_info": order_info, "items": items}]
+    inline_images = prefetch_print_images(orders) if offline else None
+    return _render_document(orders, inline_images=inline_images)
+
+def generate_combined_print_html(orders_data_list, offline=True):
     """
     Hàm tạo mã HTML để in GỘP nhiều đơn hàng.
     orders_data_list: list các dict [{'order_info': ..., 'items': ...}, ...]
     """
-    all_bodies = ""
-    for idx, data in enumerate(orders_data_list):
-        # Thêm page-break trước mỗi đơn (trừ đơn đầu tiên)
-        if idx > 0:
-            all_bodies += '<div class="page-break"></div>'
-            
-        all_bodies += _get_single_order_body(data['order_info'], data['items'])
-        
-    full_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>{_get_css()}</head>
-    <body style="margin: 0; padding: 20px;">
-        {all_bodies}
-    </body>
-    </html>
+    inline_images = prefetch_print_images(orders_data_list) if offline else None
+    return _render_document(orders_data_list, inline_images=inline_images)
+
+def generate_print_documents(orders_data_list, orders_per_doc=PRINT_ORDERS_PER_DOC, offline=True):
+    """
+    Chia lô in lớn thành nhiều file HTML, mỗi file tối đa `orders_per_doc` đơn.
+    Lô chỉ có 1 file -> giống generate_combined_print_html; nhiều file -> mỗi file có nút in riêng.
+    offline=True: tải song song ảnh của cả lô 1 lần rồi nhúng vào từng file.
     """
-    return full_html
\ No newline at end of file
+    inline_images = prefetch_print_images(orders_data_list) if offline else None
+    parts = [orders_data_list[i:i + orders_per_doc] for i in range(0, len(orders_data_list), orders_per_doc)]
+    multi = len(parts) > 1
+    return [_render_document(part, print_button=multi, inline_images=inline_images) for part in parts]
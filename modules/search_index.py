@@ -0,0 +1,355 @@
+"""
+Chỉ mục tìm kiếm đơn hàng trong RAM (mã đơn, tên khách, SĐT).
+- Không phân biệt dấu/hoa thường ("nguyen" khớp "Nguyễn").
+- Khớp tiền tố theo từ (bisect trên danh sách từ đã sắp xếp) + khớp giữa chuỗi bằng trigram.
+- Cập nhật từng dòng (upsert) khi cache đơn hàng có thay đổi, không dựng lại cả bảng.
+"""
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+SEARCH_TOP_N = 50
+
+_WORD_RE = re.compile(r"[0-9a-z]+")
+
+@lru_cache(maxsize=65536)
+def fold_text(text):
+    """Bỏ dấu tiếng Việt + chữ thường: 'Nguyễn Đức' -> 'nguyen duc'."""
+    if text is None:
+        return ""
+    s = str(text)
+    if s.isascii():
+        return s.lower()
+    s = unicodedata.normalize("NFKD", s.replace("đ", "d").replace("Đ", "D"))
+    return s.encode("ascii", "ignore").decode("ascii").lower()
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _clean(value):
+    # NaN/None từ DataFrame -> chuỗi rỗng
+    return "" if value is None or value != value else str(value)
+
+class OrderSearchIndex:
+    """Chỉ mục ma_don -> nhãn hiển thị, tra theo từ khoá. An toàn khi dùng từ nhiều thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}       # ma_don -> {"label", "text", "digits", "terms", "grams", "created_at"}
+        self._postings = {}   # từ -> set(ma_don)
+        self._words = []      # các từ đã sắp xếp (tra tiền tố bằng bisect)
+        self._grams = {}      # trigram -> set(ma_don)
+
+    def __len__(self):
+        return len(self._docs)
+
+    # --- CẬP NHẬT ---
+    def rebuild(self, df):
+        """Dựng lại toàn bộ từ DataFrame đơn hàng."""
+        with self._lock:
+            self._docs, self._postings, self._words, self._grams = {}, {}, [], {}
+        self.upsert_frame(df)
+
+    def upsert_frame(self, df):
+        """Thêm/cập nhật các đơn trong df (cột ma_don, ten_khach, sdt, created_at)."""
+        if df is None or df.empty or 'ma_don' not in df.columns:
+            return
+        cols = [c if c in df.columns else None for c in ('ma_don', 'ten_khach', 'sdt', 'created_at')]
+        columns = [df[c].tolist() if c else [None] * len(df) for c in cols]
+        # Nạp nhiều dòng -> chỉ cập nhật postings, cuối lô dựng lại danh sách từ đã sắp xếp
+        # 1 lần (không insort/bisect từng từ trên danh sách đang dở dang)
+        bulk = len(df) > 100
+        with self._lock:
+            for ma_don, ten_khach, sdt, created_at in zip(*columns):
+                self._upsert(_clean(ma_don), _clean(ten_khach), _clean(sdt), _clean(created_at), bulk)
+            if bulk:
+                self._words = sorted(self._postings)
+
+    def remove(self, ma_don):
+        with self._lock:
+            self._remove(str(ma_don))
+
+    def _upsert(self, ma_don, ten_khach, sdt, created_at, bulk=False):
+        if not ma_don:
+            return
+        self._remove(ma_don, bulk)
+        name = fold_text(ten_khach)
+        text = f"{fold_text(ma_don)} {name} {fold_text(sdt)}"
+        terms = set(_WORD_RE.findall(text))
+        digits = re.sub(r"\D", "", sdt)
+        if digits:
+            terms.add(digits)
+        # Trigram chỉ cho tên và SĐT (gõ vài số cuối); mã đơn đã đủ với khớp tiền tố
+        grams = _trigrams(digits)
+        for t in _WORD_RE.findall(name):
+            if len(t) > 3:
+                grams |= _trigrams(t)
+        self._docs[ma_don] = {
+            "label": f"{ma_don} | {ten_khach or 'No Name'} | {sdt}",
+            "text": text, "digits": digits, "terms": terms, "grams": grams, "created_at": created_at,
+        }
+        postings, all_grams = self._postings, self._grams
+        for t in terms:
+            ids = postings.get(t)
+            if ids is None:
+                postings[t] = {ma_don}
+                if not bulk: bisect.insort(self._words, t)
+            else:
+                ids.add(ma_don)
+        for g in grams:
+            ids = all_grams.get(g)
+            if ids is None: all_grams[g] = {ma_don}
+            else: ids.add(ma_don)
+
+    def _remove(self, ma_don, bulk=False):
+        doc = self._docs.pop(ma_don, None)
+        if not doc:
+            return
+        for t in doc["terms"]:
+            ids = self._postings.get(t)
+            if ids is None:
+                continue
+            ids.discard(ma_don)
+            if not ids:
+                del self._postings[t]
+                if bulk:
+                    continue  # _words được dựng lại từ _postings cuối lô
+                i = bisect.bisect_left(self._words, t)
+                if i < len(self._words) and self._words[i] == t:
+                    self._words.pop(i)
+        for g in doc["grams"]:
+            ids = self._grams.get(g)
+            if ids is not None:
+                ids.discard(ma_don)
+                if not ids:
+                    del self._grams[g]
+
+    # --- TRA CỨU ---
+    def _match_prefix(self, term):
+        """Điểm từng đơn khớp tiền tố 1 từ khoá: 3 = trùng từ, 2 = tiền tố."""
+        scores = {}
+        words, postings = self._words, self._postings
+        i = bisect.bisect_left(words, term)
+        while i < len(words) and words[i].startswith(term):
+            pts = 3 if words[i] == term else 2
+            for ma in postings[words[i]]:
+                if scores.get(ma, 0) < pts:
+                    scores[ma] = pts
+            i += 1
+        return scores
+
+    def _match_infix(self, term, scores):
+        """Bổ sung đơn chứa từ khoá ở giữa chuỗi (điểm 1), lọc ứng viên bằng trigram."""
+        if len(term) < 3:
+            return scores
+        candidates = None
+        for g in sorted(_trigrams(term), key=lambda g: len(self._grams.get(g, ()))):
+            ids = self._grams.get(g)
+            if not ids:
+                return scores
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                return scores
+        scores = dict(scores)
+        for ma in candidates:
+            if ma not in scores:
+                doc = self._docs[ma]
+                if term in doc["text"] or term in doc["digits"]:
+                    scores[ma] = 1
+        return scores
+
+    @staticmethod
+    def _intersect(per_term):
+        total = per_term[0]
+        for scores in per_term[1:]:
+            total = {ma: s + scores[ma] for ma, s in total.items() if ma in scores}
+            if not total:
+                break
+        return total
+
+    def search(self, query, limit=SEARCH_TOP_N):
+        """
+        Trả về list [(ma_don, label)] tốt nhất, tối đa `limit` dòng.
+        Nhiều từ khoá -> đơn phải khớp tất cả. Không có từ khoá -> các đơn mới nhất.
+        """
+        terms = _WORD_RE.findall(fold_text(query))
+        with self._lock:
+            if not terms:
+                ranked = heapq.nlargest(limit, self._docs.items(), key=lambda kv: kv[1]["created_at"])
+                return [(ma, doc["label"]) for ma, doc in ranked]
+
+            # Ưu tiên khớp tiền tố; chỉ tra giữa chuỗi (trigram) khi chưa đủ `limit` kết quả
+            prefix = [self._match_prefix(t) for t in terms]
+            total = self._intersect(prefix)
+            if len(total) < limit:
+                total = self._intersect([self._match_infix(t, sc) for t, sc in zip(terms, prefix)])
+            if not total:
+                return []
+
+            # Điểm cao trước, cùng điểm thì đơn mới trước; gõ đúng mã đơn -> lên đầu
+            docs = self._docs
+            best = heapq.nlargest(limit, total, key=lambda ma: (total[ma], docs[ma]["created_at"]))
+            exact = query.strip()
+            if exact in total:
+                best = [exact] + [ma for ma in best if ma != exact][:limit - 1]
+            return [(ma, docs[ma]["label"]) for ma in best]
+
+# ==============================================================================
+# CHỈ MỤC KHÁCH HÀNG (THEO ID, TRA THEO SĐT CHUẨN HOÁ / TÊN)
+# ==============================================================================
+CUSTOMER_SEARCH_LIMIT = 20
+
+def normalize_phone(sdt):
+    """'+84 909.123.456' / '84909123456' / '0909 123 456' -> '0909123456'."""
+    raw = _clean(sdt).strip()
+    digits = re.sub(r"\D", "", raw)
+    if digits.startswith("84") and (raw.startswith("+") or len(digits) >= 11):
+        digits = "0" + digits[2:]
+    return digits
+
+class CustomerIndex:
+    """
+    Khách hàng theo id (khoá chính khach_hang): tra tiền tố SĐT chuẩn hoá (bisect)
+    hoặc tiền tố từng từ trong tên (không dấu). Khách không có SĐT vẫn nằm trong chỉ mục;
+    nhiều khách trùng SĐT chuẩn hoá được giữ riêng từng dòng.
+    Cập nhật từng dòng khi bảng khach_hang có thay đổi.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}        # id -> dict dòng khach_hang
+        self._phone_of = {}    # id -> sdt chuẩn hoá ("" nếu không có)
+        self._phone_ids = {}   # sdt chuẩn hoá -> set(id)
+        self._phones = []      # các sdt chuẩn hoá (không trùng) đã sắp xếp
+        self._postings = {}    # từ trong tên -> set(id)
+        self._words = []       # các từ đã sắp xếp
+        self._tokens = {}      # id -> các từ của tên (để gỡ khi cập nhật)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def rebuild(self, rows):
+        with self._lock:
+            self._rows, self._phone_of, self._phone_ids, self._phones = {}, {}, {}, []
+            self._postings, self._words, self._tokens = {}, [], {}
+            for row in rows:
+                self._upsert(row, bulk=True)
+            # Nạp full -> dựng 2 danh sách đã sắp xếp 1 lần cuối lô
+            self._phones = sorted(self._phone_ids)
+            self._words = sorted(self._postings)
+
+    def upsert(self, rows):
+        with self._lock:
+            for row in rows:
+                self._upsert(row)
+
+    def _rank(self, cid):
+        # Ưu tiên khách mua nhiều (tong_tieu), cùng mức thì khách tạo sau (created_at)
+        row = self._rows[cid]
+        try: tieu = float(row.get("tong_tieu") or 0)
+        except (TypeError, ValueError): tieu = 0.0
+        return (tieu, str(row.get("created_at") or ""), str(cid))
+
+    def get(self, sdt):
+        """Lấy dòng khách theo SĐT (định dạng bất kỳ). Trùng SĐT -> khách mua nhiều nhất."""
+        key = normalize_phone(sdt)
+        with self._lock:
+            ids = self._phone_ids.get(key) if key else None
+            return self._rows[max(ids, key=self._rank)] if ids else None
+
+    def all(self):
+        with self._lock:
+            return list(self._rows.values())
+
+    def _upsert(self, row, bulk=False):
+        cid = row.get("id")
+        if cid is None:
+            return
+        if cid in self._rows:
+            self._remove(cid, bulk)
+        self._rows[cid] = row
+
+        key = normalize_phone(row.get("sdt"))
+        self._phone_of[cid] = key
+        if key:
+            ids = self._phone_ids.get(key)
+            if ids is None:
+                self._phone_ids[key] = {cid}
+                if not bulk: bisect.insort(self._phones, key)
+            else:
+                ids.add(cid)
+
+        words = set(_WORD_RE.findall(fold_text(row.get("ho_ten"))))
+        self._tokens[cid] = words
+        for w in words:
+            ids = self._postings.get(w)
+            if ids is None:
+                self._postings[w] = {cid}
+                if not bulk: bisect.insort(self._words, w)
+            else:
+                ids.add(cid)
+
+    @staticmethod
+    def _discard(mapping, sorted_keys, key, cid):
+        """Gỡ cid khỏi mapping[key]; key hết id -> gỡ luôn khỏi danh sách đã sắp xếp (None = bỏ qua)."""
+        ids = mapping.get(key)
+        if ids is None:
+            return
+        ids.discard(cid)
+        if not ids:
+            del mapping[key]
+            if sorted_keys is None:
+                return
+            i = bisect.bisect_left(sorted_keys, key)
+            if i < len(sorted_keys) and sorted_keys[i] == key:
+                sorted_keys.pop(i)
+
+    def _remove(self, cid, bulk=False):
+        # bulk: _phones/_words được dựng lại cuối lô, không bisect trên danh sách dở dang
+        phones, words = (None, None) if bulk else (self._phones, self._words)
+        self._rows.pop(cid, None)
+        key = self._phone_of.pop(cid, "")
+        if key:
+            self._discard(self._phone_ids, phones, key, cid)
+        for w in self._tokens.pop(cid, ()):
+            self._discard(self._postings, words, w, cid)
+
+    def _phone_prefix(self, prefix, limit):
+        i = bisect.bisect_left(self._phones, prefix)
+        out = []
+        while i < len(self._phones) and self._phones[i].startswith(prefix) and len(out) < limit:
+            out.extend(sorted(self._phone_ids[self._phones[i]], key=self._rank, reverse=True))
+            i += 1
+        return out[:limit]
+
+    def _word_prefix(self, term):
+        ids = set()
+        i = bisect.bisect_left(self._words, term)
+        while i < len(self._words) and self._words[i].startswith(term):
+            ids |= self._postings[self._words[i]]
+            i += 1
+        return ids
+
+    def search(self, query, limit=CUSTOMER_SEARCH_LIMIT):
+        """
+        Tìm khách: chuỗi toàn số -> theo tiền tố SĐT; còn lại -> mọi từ khoá phải là
+        tiền tố của 1 từ trong tên. Trả về list dòng khách, tối đa `limit`.
+        """
+        q = _clean(query).strip()
+        if not q:
+            return []
+        with self._lock:
+            if re.fullmatch(r"[\d\s.+\-]+", q):
+                prefix = normalize_phone(q)
+                return [self._rows[cid] for cid in self._phone_prefix(prefix, limit)] if prefix else []
+            ids = None
+            for term in _WORD_RE.findall(fold_text(q)):
+                found = self._word_prefix(term)
+                ids = found if ids is None else ids & found
+                if not ids:
+                    return []
+            best = heapq.nlargest(limit, ids or (), key=self._rank)
+            return [self._rows[cid] for cid in best]
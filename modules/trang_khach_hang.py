@@ -1,8 +1,18 @@
 import streamlit as st
 import pandas as pd
-from modules.data_handler import lay_danh_sach_khach_hang, lay_lich_su_khach, sync_all_customer_totals, fetch_all_orders
+from modules.data_handler import lay_danh_sach_khach_hang, lay_lich_su_khach, sync_all_customer_totals, lay_khach_hang_tong_hop, CUSTOMER_TIERS, CUSTOMER_PAGE_SIZE
 from modules.ui_components import render_order_detail_view
 
+CUSTOMER_PAGE_LIMIT = 200  # Số khách tối đa hiện khi tìm kiếm
+VN_TZ = "Asia/Ho_Chi_Minh"  # Giờ hiển thị (DB lưu timestamptz)
+
+# Hạng (cột hang trong khach_hang_stats) -> (nhãn, màu badge)
+RANK_STYLES = {
+    "Bạc": ("Bạc", "#C0C0C0"),
+    "Vàng": ("🥇 Vàng", "#FFF9C4"),
+    "Kim Cương": ("💎 Kim Cương", "#E0F7FA"),
+}
+
 def render_customer_page():
     st.title("👥 Quản lý Khách hàng")
     
@@ -15,42 +25,38 @@ def render_customer_page():
         filter_rank = f_c1.selectbox("Hạng khách hàng", ["Tất cả", "Bạc (< 500k)", "🥇 Vàng (500k-5tr)", "💎 Kim Cương (> 5tr)"])
         filter_min_spend = f_c2.number_input("Chi tiêu tối thiểu", min_value=0, step=500000)
 
-    # 2. LOGIC DATA
-    df_customers = lay_danh_sach_khach_hang(search_term if search_term else None)
-    df_orders = fetch_all_orders()
-
-    if not df_orders.empty and not df_customers.empty:
-        # Tính toán tổng hợp từ bảng Orders (Real-time)
-        stats = df_orders.groupby("khach_hang_id").agg({
-            "thanh_tien": "sum",
-            "ma_don": "count"
-        }).reset_index()
-        
-        # Merge
-        stats.rename(columns={"thanh_tien": "real_tong_tieu", "ma_don": "real_so_don", "khach_hang_id": "id"}, inplace=True)
-        df_customers = pd.merge(df_customers, stats, on="id", how="left")
-        
-        # FillNa
-        df_customers["tong_tieu"] = df_customers["real_tong_tieu"].fillna(0)
-        df_customers["so_don_hang"] = df_customers["real_so_don"].fillna(0)
+    # 2-3. LOGIC DATA + LỌC: hạng / chi tiêu lọc bằng 1 query trên view khach_hang_tong_hop
+    # (bảng stats được trigger cập nhật, không tải toàn bộ đơn về để groupby)
+    hang = next((t for t in CUSTOMER_TIERS if t in filter_rank), None) if filter_rank != "Tất cả" else None
+    ids = None
+    if search_term:
+        # Tìm khách trong chỉ mục RAM (tiền tố SĐT / tên không dấu)
+        df_found = lay_danh_sach_khach_hang(search_term, limit=CUSTOMER_PAGE_LIMIT)
+        ids = df_found["id"].tolist() if not df_found.empty else []
 
-    # 3. APPLY FILTERS
-    if not df_customers.empty:
-        if filter_min_spend > 0:
-            df_customers = df_customers[df_customers['tong_tieu'] >= filter_min_spend]
-        
-        if filter_rank != "Tất cả":
-            if "Bạc" in filter_rank:
-                df_customers = df_customers[df_customers['tong_tieu'] < 500000]
-            elif "Vàng" in filter_rank:
-                df_customers = df_customers[(df_customers['tong_tieu'] >= 500000) & (df_customers['tong_tieu'] < 5000000)]
-            elif "Kim Cương" in filter_rank:
-                df_customers = df_customers[df_customers['tong_tieu'] >= 5000000]
+    # Phân trang keyset: lưu con trỏ (stats_tong_tieu, id) đầu mỗi trang, đổi bộ lọc -> về trang 1
+    filter_key = (search_term, hang, filter_min_spend)
+    if st.session_state.get("kh_filter") != filter_key:
+        st.session_state.kh_filter = filter_key
+        st.session_state.kh_cursors = [None]
+    cursors = st.session_state.kh_cursors
+    # Lấy dư 1 dòng để biết còn trang sau không
+    df_customers = lay_khach_hang_tong_hop(hang=hang, min_tieu=filter_min_spend, ids=ids,
+                                           limit=CUSTOMER_PAGE_SIZE + 1, after=cursors[-1])
+    if df_customers.empty and len(cursors) > 1:
+        # Dữ liệu đổi làm trang hiện tại trống -> quay về trang 1
+        st.session_state.kh_cursors = [None]
+        st.rerun()
+    has_next = len(df_customers) > CUSTOMER_PAGE_SIZE
+    df_customers = df_customers.head(CUSTOMER_PAGE_SIZE)
+    if "don_cuoi" in df_customers.columns:
+        # API trả timestamptz dạng chuỗi -> DatetimeColumn cần kiểu datetime (giờ VN)
+        df_customers["don_cuoi"] = pd.to_datetime(df_customers["don_cuoi"], errors="coerce", utc=True).dt.tz_convert(VN_TZ)
 
     # 4. HIỂN THỊ LIST KHÁCH HÀNG (INTERACTIVE)
     if not df_customers.empty:
-        display_df = df_customers[["id", "ho_ten", "sdt", "dia_chi", "tong_tieu", "so_don_hang", "nguon_shop"]]
-        display_df.columns = ["ID", "Họ Tên", "SĐT", "Địa chỉ", "Tổng chi tiêu", "Số đơn", "Nguồn"]
+        display_df = df_customers[["id", "ho_ten", "sdt", "dia_chi", "stats_tong_tieu", "stats_so_don", "don_cuoi", "hang", "nguon_shop"]]
+        display_df.columns = ["ID", "Họ Tên", "SĐT", "Địa chỉ", "Tổng chi tiêu", "Số đơn", "Đơn gần nhất", "Hạng", "Nguồn"]
         
         st.info("👆 Click vào một dòng để xem chi tiết khách hàng")
         
@@ -63,9 +69,20 @@ def render_customer_page():
             column_config={
                 "Tổng chi tiêu": st.column_config.NumberColumn(format="%d đ"),
                 "ID": st.column_config.TextColumn(width="small"),
+                "Đơn gần nhất": st.column_config.DatetimeColumn(format="D/M/Y"),
             },
             use_container_width=True
         )
+
+        p_prev, p_info, p_next = st.columns([1, 2, 1])
+        if p_prev.button("⬅️ Trang trước", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun()
+        p_info.caption(f"Trang {len(cursors)} · {len(df_customers)} khách")
+        if p_next.button("Trang sau ➡️", disabled=not has_next, use_container_width=True):
+            last = df_customers.iloc[-1]
+            cursors.append((last["stats_tong_tieu"], int(last["id"])))
+            st.rerun()
         
         # 5. XỬ LÝ KHI CHỌN KHÁCH HÀNG
         selected_rows = event.selection.rows
@@ -77,19 +94,14 @@ def render_customer_page():
             khach = df_customers[df_customers["sdt"] == selected_sdt].iloc[0]
             khach_id = int(khach["id"])
             
-            # GET HISTORY
+            # GET HISTORY (chỉ để hiện danh sách đơn; số liệu lấy từ bảng stats)
             df_history = lay_lich_su_khach(khach_id)
-            real_total = df_history["thanh_tien"].sum() if (not df_history.empty and "thanh_tien" in df_history.columns) else 0
+            if "created_at" in df_history.columns:
+                df_history["created_at"] = pd.to_datetime(df_history["created_at"], errors="coerce", utc=True).dt.tz_convert(VN_TZ)
+            real_total = float(khach["stats_tong_tieu"] or 0)
 
             # RANKING UI
-            rank_name = "Bạc"
-            rank_color = "#C0C0C0"
-            if real_total >= 5000000:
-                rank_name = "💎 Kim Cương"
-                rank_color = "#E0F7FA"
-            elif real_total >= 500000:
-                rank_name = "🥇 Vàng"
-                rank_color = "#FFF9C4"
+            rank_name, rank_color = RANK_STYLES.get(khach["hang"], RANK_STYLES["Bạc"])
 
             st.markdown("---")
             st.markdown("### 📜 Hồ sơ khách hàng")
@@ -105,8 +117,8 @@ def render_customer_page():
                         </span>
                     </div>
                 """, unsafe_allow_html=True)
-                c2.metric("Tổng chi tiêu", f"{real_total:,.0f} đ", delta="Real-time check", delta_color="off")
-                c3.metric("Số đơn hàng", len(df_history) if not df_history.empty else 0)
+                c2.metric("Tổng chi tiêu", f"{real_total:,.0f} đ", delta="Không tính đơn hủy", delta_color="off")
+                c3.metric("Số đơn hàng", int(khach["stats_so_don"] or 0))
                 st.write(f"🏠 Địa chỉ: {khach['dia_chi']}")
 
             # 6. HIỂN THỊ LIST ĐƠN HÀNG (INTERACTIVE)
@@ -11,6 +11,8 @@ import streamlit.components.v1 as components # Thư viện để hiện khung in
 from modules.data_handler import (
     fetch_all_orders,
     get_order_details,
+    get_orders_with_items,
+    bulk_update_orders,
     save_full_order,
     update_order_status,
     tai_danh_sach_trang_thai,
@@ -20,19 +22,64 @@ from modules.data_handler import (
     upload_multiple_files_to_supabase,
     update_order_info,
     lay_danh_sach_khach_hang,
+    lay_khach_hang_theo_sdt,
     update_item_field,
     mark_order_as_printed,
+    fetch_orders_page,
+    fetch_order_kpis,
+    rendition_url,
+    search_orders,
+    deadline_index,
     STATUS_DONE,
     STATUS_CANCEL,
     supabase
 )
-from modules.ai_logic import xuly_ai_gemini, gen_anh_mau_theu, generate_image_from_ref
-from modules.notifier import send_telegram_notification, check_order_notifications
-from modules.printer import generate_print_html, generate_combined_print_html # Hàm tạo HTML in ấn
+from modules.ai_logic import xuly_ai_gemini, trich_xuat_nhanh, extract_cache_stats, ai_metrics
+from modules.job_queue import submit_gen_mau, submit_gen_mau_batch, submit_edit_anh, get_job, get_jobs, latest_job_for_item, recent_jobs, QUEUED, RUNNING, DONE, ERROR
+from modules.notifier import send_telegram_notification, check_order_notifications, send_workload_report, WORKLOAD_DAYS
+from modules.printer import generate_print_html, generate_print_documents # Hàm tạo HTML in ấn
+from modules.search_index import SEARCH_TOP_N
+from modules.order_prep import chuan_hoa_don_hang, prepare_dashboard_table, highlight_urgent
 from modules.exporter import export_orders_to_excel
 import base64
 
 # --- HELPER UI COMPONENTS ---
+AI_JOB_POLL_SECONDS = 2  # Chu kỳ hỏi trạng thái job AI chạy nền
+
+@st.fragment(run_every=AI_JOB_POLL_SECONDS)
+def theo_doi_job_ai(job_id):
+    """Chỉ vẽ lại phần trạng thái job; job xong/lỗi -> rerun cả trang để hiện kết quả."""
+    job = get_job(job_id)
+    if not job or job["status"] in (DONE, ERROR):
+        st.rerun()
+    label = "⏳ Đang chờ..." if job["status"] == QUEUED else "🎨 AI đang vẽ..."
+    st.caption(f"{label} ({job['elapsed']:.0f}s)")
+
+def ve_batch_ai(jobs):
+    """Tiến độ gen AI hàng loạt: progress + ảnh đã xong + lỗi. Trả về True nếu mọi job đã kết thúc."""
+    xong = [j for j in jobs if j["status"] in (DONE, ERROR)]
+    loi = [j for j in xong if j["status"] == ERROR]
+    st.progress(len(xong) / max(len(jobs), 1),
+                text=f"✨ Gen AI: {len(xong)}/{len(jobs)} xong" + (f" · ❌ {len(loi)} lỗi" if loi else ""))
+    anh = [j for j in xong if j["status"] == DONE]
+    if anh:
+        cols = st.columns(6)
+        for i, j in enumerate(anh):
+            with cols[i % 6]:
+                st.image(rendition_url(j["result_url"]), caption=f"Item {j['item_id']}", use_container_width=True)
+    for j in loi:
+        st.caption(f"❌ Item {j['item_id']}: {j['error']}")
+    dang_cho = [j for j in jobs if j["status"] == QUEUED and j["error"]]
+    if dang_cho:
+        st.caption(f"⏳ {dang_cho[0]['error']}")
+    return len(xong) == len(jobs)
+
+@st.fragment(run_every=AI_JOB_POLL_SECONDS)
+def theo_doi_batch_ai(job_ids):
+    """Ảnh hiện dần khi từng job xong; hết job -> rerun cả trang để ngừng hỏi."""
+    if ve_batch_ai(get_jobs(job_ids)):
+        st.rerun(scope="app")
+
 def hien_thi_anh_vuong(data, label="Ảnh"):
     if not data:
         return
@@ -47,12 +94,15 @@ def hien_thi_anh_vuong(data, label="Ảnh"):
     else:
         url = data
 
+    # Ô vuông chỉ cần bản thumbnail, link "Xem Full" mở bản gốc
+    thumb_url = rendition_url(url, "thumb")
+
     st.markdown(
         f"""
         <div style="
             width: 100%;
             aspect-ratio: 1 / 1;
-            background-image: url('{url}');
+            background-image: url('{thumb_url}');
             background-size: cover;
             background-position: center;
             border-radius: 8px;
@@ -93,12 +143,31 @@ def hien_thi_form_tao_don():
             btn_extract = st.button("🪄 Trích xuất", type="primary", use_container_width=True)
 
         if btn_extract and chat_content:
+            # Bộ luật local chạy tức thì: hiện ngay shop/SĐT/vận chuyển... trong lúc chờ Gemini
+            rule_data = trich_xuat_nhanh(chat_content)
+            st.caption(f"⚡ {rule_data['shop']} · {rule_data['so_dien_thoai'] or 'chưa thấy SĐT'} · "
+                       f"{rule_data['van_chuyen']} · {rule_data['httt']}" + (" · 🚨 Hẹn ngày" if rule_data['co_hen_ngay'] else ""))
             with st.spinner("AI đang xử lý..."):
                 extracted_data, raw_text = xuly_ai_gemini(chat_content)
+                if not extracted_data:
+                    # Gemini lỗi -> vẫn điền các trường theo luật, phần còn lại nhập tay
+                    st.warning(f"AI lỗi ({raw_text}) - đã điền các trường theo luật, vui lòng nhập tên/địa chỉ/sản phẩm.")
+                    extracted_data = rule_data
                 
                 # HIỂN THỊ DEBUG
                 if is_debug:
                     st.divider()
+                    cs = extract_cache_stats()
+                    if extracted_data is rule_data: nguon = "📏 Chỉ bộ luật (AI lỗi)"
+                    elif extracted_data.get("tu_cache"): nguon = "⚡ Lấy từ cache"
+                    else: nguon = "🌐 Gọi Gemini"
+                    st.caption(f"{nguon} · Cache: {cs['hits']} hit / {cs['misses']} miss · {cs['entries']} mục ({cs['bytes'] / 1024:.0f} KB)")
+                    m = ai_metrics().get("extract")
+                    if m:
+                        last = m["last"]
+                        st.caption(f"⏱️ Lần gọi cuối: {last['ms']} ms · prompt {last['prompt_tokens']} token "
+                                   f"(cache {last['cached_tokens']}) · output {last['output_tokens']} · "
+                                   f"TB {m['total_ms'] / m['calls']:.0f} ms / {m['calls']} lần")
                     d1, d2 = st.columns(2)
                     with d1:
                         st.markdown("**🔍 AI Raw Output:**")
@@ -133,7 +202,7 @@ def hien_thi_form_tao_don():
                     else:
                         st.session_state.temp_items = [{"ten_sp": "", "mau": "", "size": "", "kieu_theu": "", "thong_tin_phu": ""}]
                     
-                    if not is_debug:
+                    if not is_debug and extracted_data is not rule_data:
                         st.success(f"✅ Đã tách {len(st.session_state.temp_items)} sản phẩm!")
                         time.sleep(0.5)
                         st.rerun()
@@ -144,35 +213,36 @@ def hien_thi_form_tao_don():
     # --- AUTOCOMPLETE LOGIC (Simple Selectbox) ---
     st.markdown("##### 🕵️ Thông tin khách hàng")
     
-    # Lấy danh sách khách hàng
-    df_customers = lay_danh_sach_khach_hang()
-    
+    # Tra chỉ mục khách hàng (tiền tố SĐT hoặc tên không dấu), chỉ hiện vài kết quả đầu
+    c_q, c_pick = st.columns([1, 2])
+    with c_q:
+        quick_term = st.text_input("🔍 Tìm khách cũ", placeholder="Gõ SĐT hoặc tên...", key="quick_search_khach")
+    df_customers = lay_danh_sach_khach_hang(quick_term) if quick_term else pd.DataFrame()
+
     customer_options = []
     if not df_customers.empty:
         # Format: "SĐT | Tên (Địa chỉ)" -> Ưu tiên SĐT ở đầu để search số chính xác hơn
-        customer_options = df_customers.apply(lambda x: f"{x['sdt']} | {x['ho_ten']} ({x['dia_chi']})", axis=1).tolist()
-    
+        customer_options = [f"{sdt} | {ten} ({dc})" for sdt, ten, dc in zip(df_customers['sdt'], df_customers['ho_ten'], df_customers['dia_chi'])]
+
     def on_quick_select():
         selected_val = st.session_state.get("quick_select_box")
         if selected_val:
             # Parse: "0909xxx | Name (Addr)"
-            parts = selected_val.split(" | ")
-            if len(parts) >= 1:
-                s_sdt = parts[0]
-                found = df_customers[df_customers['sdt'] == s_sdt]
-                if not found.empty:
-                    st.session_state.form_ten_khach = found.iloc[0]['ho_ten']
-                    st.session_state.form_sdt = found.iloc[0]['sdt']
-                    st.session_state.form_dia_chi = found.iloc[0]['dia_chi']
-
-    st.selectbox(
-        "🔍 Chọn khách cũ (Gõ tên hoặc SĐT để tìm)",
-        options=customer_options,
-        index=None,
-        placeholder="Nhập tên/SĐT...",
-        key="quick_select_box",
-        on_change=on_quick_select
-    )
+            found = lay_khach_hang_theo_sdt(selected_val.split(" | ")[0])
+            if found:
+                st.session_state.form_ten_khach = found.get('ho_ten')
+                st.session_state.form_sdt = found.get('sdt')
+                st.session_state.form_dia_chi = found.get('dia_chi')
+
+    with c_pick:
+        st.selectbox(
+            f"Chọn khách cũ ({len(customer_options)} kết quả)" if quick_term else "Chọn khách cũ",
+            options=customer_options,
+            index=None,
+            placeholder="Nhập SĐT/tên ở ô bên trái...",
+            key="quick_select_box",
+            on_change=on_quick_select
+        )
 
 # --- FORM NHẬP LIỆU CHÍNH ---
     defaults = st.session_state.ai_order_data
@@ -310,6 +380,22 @@ def hien_thi_form_tao_don():
                 else:
                     st.error("Lỗi lưu Database!")
 
+def hien_thi_ban_in(docs, auto_print=False):
+    """
+    Hiển thị bản in gộp. Lô nhỏ (1 phần) -> 1 iframe, có thể tự bật hộp thoại in.
+    Lô lớn -> mỗi phần 1 tab, in từng phần bằng nút "In phần này".
+    """
+    if len(docs) == 1:
+        html_c = docs[0]
+        if auto_print:
+            html_c += "<script>window.addEventListener('load', function() { setTimeout(function() { window.print(); }, 500); });</script>"
+        components.html(html_c, height=800, scrolling=True)
+        return
+    st.info(f"📄 Lô in lớn được chia thành {len(docs)} phần, bấm 'In phần này' trong từng tab.")
+    tabs = st.tabs([f"Phần {i + 1}" for i in range(len(docs))])
+    for tab, doc in zip(tabs, docs):
+        with tab: components.html(doc, height=800, scrolling=True)
+
 # ==============================================================================
 # 2. DASHBOARD QUẢN LÝ (CRM SEARCH + DYNAMIC UI)
 # ==============================================================================
@@ -318,26 +404,16 @@ def render_order_management(df):
 
     # --- LOGIC AUTO PRINT (GỘP) ---
     if "print_bulk_html" in st.session_state:
-        b_html = st.session_state.pop("print_bulk_html")
+        b_docs = st.session_state.pop("print_bulk_html")
         @st.dialog("🖨️ Đang in gộp...", width="large")
-        def show_bulk_auto_print(html_c):
+        def show_bulk_auto_print(docs):
             st.success("✅ Đã cập nhật trạng thái: ĐÃ IN cho các đơn hàng được chọn.")
-            final_html = html_c + "<script>window.addEventListener('load', function() { setTimeout(function() { window.print(); }, 500); });</script>"
-            components.html(final_html, height=800, scrolling=True)
-        show_bulk_auto_print(b_html)
+            hien_thi_ban_in(docs, auto_print=True)
+        show_bulk_auto_print(b_docs)
     IGNORE_STATUSES = STATUS_DONE + STATUS_CANCEL 
 
     if not df.empty:
-        df['trang_thai'] = df['trang_thai'].astype(str).str.strip()
-        if 'shop' not in df.columns: df['shop'] = "Inside"
-        if 'thanh_tien' in df.columns: df['thanh_tien'] = pd.to_numeric(df['thanh_tien'], errors='coerce').fillna(0)
-        if 'da_coc' in df.columns: df['da_coc'] = pd.to_numeric(df['da_coc'], errors='coerce').fillna(0)
-        
-        # Convert Date
-        if 'ngay_dat' in df.columns:
-            df['ngay_dat_filter'] = pd.to_datetime(df['ngay_dat'], errors='coerce').dt.date
-        if 'ngay_tra' in df.columns:
-            df['ngay_tra_filter'] = pd.to_datetime(df['ngay_tra'], errors='coerce').dt.date
+        chuan_hoa_don_hang(df)
 
     # =================================================================================
     # 1. METRICS (BOX KPI) - GIỮ NGUYÊN
@@ -357,38 +433,20 @@ def render_order_management(df):
         with st.container(border=True):
             st.markdown("##### 🔔 Nhắc việc quan trọng")
             
-            # Tính toán dữ liệu nhắc việc
-            count_urgent_today = 0
-            count_due_tomorrow = 0
-            df_urgent_today = pd.DataFrame()
-            df_due_tomorrow = pd.DataFrame()
-
-            if not df.empty:
-                today = datetime.now().date()
-                tomorrow = today + pd.Timedelta(days=1)
-                
-                # Lấy data chưa xong từ DF GỐC (Không bị ảnh hưởng bởi bộ lọc bên phải)
-                df_pending = df[~df['trang_thai'].isin(IGNORE_STATUSES)]
-                
-                if not df_pending.empty and 'ngay_tra_filter' in df_pending.columns:
-                    # 1. Đơn Hẹn Trả Hôm Nay
-                    df_urgent_today = df_pending[
-                        (df_pending['co_hen_ngay'] == True) & 
-                        (df_pending['ngay_tra_filter'] == today)
-                    ]
-                    count_urgent_today = len(df_urgent_today)
-                    
-                    # 2. Đơn Trả Ngày Mai
-                    df_due_tomorrow = df_pending[
-                        (df_pending['ngay_tra_filter'] == tomorrow)
-                    ]
-                    count_due_tomorrow = len(df_due_tomorrow)
-            
+            # Tra chỉ mục hạn trả (đơn chưa xong/hủy, sắp theo ngay_tra) - không lọc lại cả bảng
+            today = datetime.now().date()
+            tomorrow = today + pd.Timedelta(days=1)
+            df_urgent_today = deadline_index.urgent_today(today)
+            df_due_tomorrow = deadline_index.due_on(tomorrow)
+            overdue = deadline_index.overdue(today)
+            count_urgent_today = len(df_urgent_today)
+            count_due_tomorrow = len(df_due_tomorrow)
+
             # Hiển thị UI trong box nhỏ
             if count_urgent_today > 0:
                 st.error(f"🔥 **HÔM NAY: {count_urgent_today} đơn hẹn gấp!**")
                 with st.expander("Xem chi tiết", expanded=False):
-                    for _, row in df_urgent_today.iterrows():
+                    for row in df_urgent_today:
                         st.caption(f"• {row['ma_don']} | {row['ten_khach']}")
             else:
                 st.success("✅ Hôm nay: Không có đơn hẹn gấp.", icon="👍")
@@ -398,12 +456,26 @@ def render_order_management(df):
             if count_due_tomorrow > 0:
                 st.warning(f"⏳ **NGÀY MAI: {count_due_tomorrow} đơn cần trả.**")
                 with st.expander("Xem chi tiết", expanded=False):
-                     for _, row in df_due_tomorrow.iterrows():
+                     for row in df_due_tomorrow:
                         icon_hen = "🚨" if row.get('co_hen_ngay') else ""
                         st.caption(f"• {icon_hen} {row['ma_don']} | {row['ten_khach']}")
             else:
                 st.info("☕ Ngày mai: Chưa có lịch trả hàng.", icon="✨")
 
+            if overdue:
+                st.markdown("---")
+                st.error(f"⌛ **QUÁ HẠN: {len(overdue)} đơn chưa xong.**")
+                with st.expander("Xem chi tiết", expanded=False):
+                    for row in overdue[:50]:  # cũ nhất trước, chỉ hiện 50 đơn
+                        st.caption(f"• {row['ngay_tra']:%d/%m} | {row['ma_don']} | {row['ten_khach']}")
+
+            # Khối lượng 7 ngày tới (dùng chung với báo cáo Telegram)
+            df_workload = deadline_index.workload(today, days=WORKLOAD_DAYS)
+            with st.expander(f"📅 Khối lượng {WORKLOAD_DAYS} ngày tới", expanded=False):
+                st.bar_chart(df_workload.assign(ngay=df_workload['ngay'].map(lambda d: d.strftime('%d/%m'))), x="ngay", y="so_don", height=180)
+                if st.button("📨 Gửi báo cáo Telegram", key="btn_send_workload", use_container_width=True):
+                    send_workload_report(df_workload, len(overdue))
+
     # --- BOX PHẢI: BỘ LỌC ---
     with c_control_right:
         with st.container(border=True):
@@ -439,63 +511,35 @@ def render_order_management(df):
                 st.write("")
                 loc_chua_in = st.checkbox("🖨️ Chưa in", value=False)
     # =================================================================================
-    # 3. XỬ LÝ DATA (APPLY FILTER)
+    # 3. XỬ LÝ DATA (LỌC + PHÂN TRANG NGAY TRÊN DB)
     # =================================================================================
-    if not df.empty:
-        df_show = df.copy()
-        
-        if status_filter: df_show = df_show[df_show['trang_thai'].isin(status_filter)]
-        if tag_filter:
-            # Lọc các đơn có chứa ít nhất 1 trong các tag được chọn
-            def check_tag_match(order_tags):
-                if not order_tags: return False
-                # Nếu order_tags là string (phòng lỗi), convert về list
-                if isinstance(order_tags, str): return any(x in order_tags for x in tag_filter)
-                return any(x in order_tags for x in tag_filter)
-            
-            df_show = df_show[df_show['tags'].apply(check_tag_match)]
-            
-        if shop_filter: df_show = df_show[df_show['shop'].isin(shop_filter)]
-        if loc_hen_ngay and 'co_hen_ngay' in df_show.columns:
-            df_show = df_show[df_show['co_hen_ngay'] == True]
-        if loc_chua_in:
-            if 'da_in' in df_show.columns:
-                # Lấy những đơn da_in là False hoặc NaN (chưa có dữ liệu)
-                df_show = df_show[df_show['da_in'] != True]            
-        if len(range_ngay_dat) == 2:
-            s_d, e_d = range_ngay_dat
-            if 'ngay_dat_filter' in df_show.columns:
-                df_show = df_show[(df_show['ngay_dat_filter'] >= s_d) & (df_show['ngay_dat_filter'] <= e_d)]
-
-        if len(range_ngay_tra) == 2:
-            s_t, e_t = range_ngay_tra
-            if 'ngay_tra_filter' in df_show.columns:
-                df_show = df_show[(df_show['ngay_tra_filter'] >= s_t) & (df_show['ngay_tra_filter'] <= e_t)]
-    else:
-        df_show = pd.DataFrame()
+    filters = {
+        "trang_thai": status_filter,
+        "shop": shop_filter,
+        "tags": tag_filter,
+        "co_hen_ngay": loc_hen_ngay,
+        "chua_in": loc_chua_in,
+        "ngay_dat": tuple(range_ngay_dat) if len(range_ngay_dat) == 2 else None,
+        "ngay_tra": tuple(range_ngay_tra) if len(range_ngay_tra) == 2 else None,
+    }
+
+    # Đổi bộ lọc -> quay về trang đầu
+    filter_sig = repr(sorted(filters.items()))
+    if st.session_state.get("dash_filter_sig") != filter_sig:
+        st.session_state.dash_filter_sig = filter_sig
+        st.session_state.dash_cursors = [None]
+    cursors = st.session_state.dash_cursors
+
+    df_show, next_cursor = fetch_orders_page(filters, cursor=cursors[-1])
+    chuan_hoa_don_hang(df_show)
 
     # =================================================================================
-    # 4. ĐIỀN METRICS (LOGIC CŨ - LAYOUT 2 BOX NGANG)
+    # 4. ĐIỀN METRICS (KPI TÍNH BẰNG QUERY TỔNG HỢP RIÊNG)
     # =================================================================================
     with metrics_container:
-        if not df_show.empty:
-            tong_don = len(df_show)
-            da_xong = len(df_show[df_show['trang_thai'].isin(STATUS_DONE)])
-            da_huy = len(df_show[df_show['trang_thai'].isin(STATUS_CANCEL)])
-            dang_xu_ly = tong_don - da_xong - da_huy
-            
-            df_rev = df_show[~df_show['trang_thai'].isin(STATUS_CANCEL)]
-            dt_ban_hang = df_rev['thanh_tien'].sum()
-            dt_coc = df_rev['da_coc'].sum()
-            
-            def tinh_thuc_nhan(row):
-                if row['trang_thai'] in STATUS_DONE: return row['thanh_tien']
-                else: return row['da_coc']
-            
-            dt_thuc_nhan = df_rev.apply(tinh_thuc_nhan, axis=1).sum()
-        else:
-            tong_don, da_xong, da_huy, dang_xu_ly = 0, 0, 0, 0
-            dt_ban_hang, dt_coc, dt_thuc_nhan = 0, 0, 0
+        kpi = fetch_order_kpis(filters)
+        tong_don, da_xong, da_huy, dang_xu_ly = kpi["tong_don"], kpi["da_xong"], kpi["da_huy"], kpi["dang_xu_ly"]
+        dt_ban_hang, dt_coc, dt_thuc_nhan = kpi["dt_ban_hang"], kpi["dt_coc"], kpi["dt_thuc_nhan"]
 
         # Layout Metrics (2 box ngang như yêu cầu trước)
         col_left, col_right = st.columns(2, gap="medium")
@@ -521,58 +565,11 @@ def render_order_management(df):
     st.divider()
 
     if not df_show.empty:
-        # Sort & Deadline logic
-        if 'co_hen_ngay' in df_show.columns:
-            df_show['is_urgent_active'] = df_show.apply(
-                lambda x: True if (x.get('co_hen_ngay') == True and str(x.get('trang_thai')).strip() not in IGNORE_STATUSES) else False,
-                axis=1
-            )
-            df_show = df_show.sort_values(by=['is_urgent_active', 'created_at'], ascending=[False, False])
-            
-            def format_deadline(row):
-                try:
-                    d_obj = pd.to_datetime(row['ngay_tra'])
-                    d_str = d_obj.strftime("%d/%m/%Y")
-                    return f"🚨 {d_str}" if row['is_urgent_active'] else d_str
-                except:
-                    return str(row.get('ngay_tra', ''))
-
-            df_show['deadline'] = df_show.apply(format_deadline, axis=1)
-        else:
-            def format_simple(row):
-                try: return pd.to_datetime(row['ngay_tra']).strftime("%d/%m/%Y")
-                except: return str(row.get('ngay_tra', ''))
-            df_show['deadline'] = df_show.apply(format_simple, axis=1)
-
-        # Display Icon
-        if 'da_in' in df_show.columns:
-            df_show['display_ma_don'] = df_show.apply(
-                lambda x: f"🖨️ {x['ma_don']}" if x.get('da_in') == True else x['ma_don'], 
-                axis=1
-            )
-        else:
-            df_show['display_ma_don'] = df_show['ma_don']
-
-        # Render
-        def get_display_tags(tags):
-            if not tags: return ""
-            if isinstance(tags, str): return tags
-            return ", ".join([str(t) for t in tags if t])
-
-        df_show['display_tags'] = df_show['tags'].apply(get_display_tags)
-        
-        cols_to_show = ["display_ma_don", "display_tags", "ten_khach", "shop", "deadline", "thanh_tien", "trang_thai"]
-        valid_cols = [c for c in cols_to_show if c in df_show.columns]
-        df_display = df_show[valid_cols].reset_index(drop=True)
-
-        # --- STYLE: Highlight Urgent ---
-        def highlight_urgent(row):
-            if "🚨" in str(row.get('deadline', '')):
-                return ['background-color: #ffebee; color: #c62828; font-weight: bold'] * len(row)
-            else:
-                return [''] * len(row)
+        # Sort, hạn chót, icon, tags: tính theo cột (modules/order_prep.py)
+        df_display, urgent = prepare_dashboard_table(df_show, IGNORE_STATUSES)
 
-        styled_df = df_display.style.apply(highlight_urgent, axis=1)
+        # --- STYLE: Highlight Urgent (1 lần cho cả bảng) ---
+        styled_df = df_display.style.apply(highlight_urgent, axis=None, urgent=urgent)
 
         # --- RENDER TABLE & SELECTION ---
         # Sử dụng st.dataframe với on_select (Streamlit mới) để vừa có Style vừa có Chọn
@@ -590,7 +587,7 @@ def render_order_management(df):
             },
             on_select="rerun", # Fix: interactive -> rerun
             selection_mode="multi-row",
-            key="order_table_selection"
+            key=f"order_table_selection_{len(cursors)}"
         )
         
         # --- ACTION BUTTONS (IN / EXPORT) ---
@@ -600,11 +597,26 @@ def render_order_management(df):
         # Layout: 6 phần trống bên trái, 2 phần bên phải cho 2 nút
         # Điều chỉnh tỷ lệ tùy theo độ rộng màn hình, ví dụ [5, 1, 1] hoặc [6, 1.5, 1.5]
         # Ở đây dùng [6, 1.2, 1.3] để nút không bị quá bé
-        c_spacer, c_btn_print, c_btn_excel = st.columns([5, 1.5, 1.5])
+        c_spacer, c_btn_ai, c_btn_print, c_btn_excel = st.columns([3.5, 1.5, 1.5, 1.5])
 
         with c_spacer:
             st.empty() # Spacer
 
+        with c_btn_ai:
+            if st.button("✨ Gen AI", key="btn_ai_batch", use_container_width=True,
+                         help="Gen mẫu thêu cho mọi sản phẩm TGTĐ đã có ảnh gốc nhưng chưa có kết quả AI"):
+                if not selected_indices:
+                    st.warning("Chưa chọn!")
+                else:
+                    selected_ma_ai = [str(m).replace("🖨️", "").strip() for m in df_display.iloc[selected_indices]['display_ma_don']]
+                    with st.spinner("Đang gửi job..."):
+                        job_ids = submit_gen_mau_batch(get_orders_with_items(selected_ma_ai))
+                    if job_ids:
+                        st.session_state["ai_batch_jobs"] = job_ids
+                        st.toast(f"Đã gửi {len(job_ids)} job AI")
+                    else:
+                        st.info("Không có sản phẩm TGTĐ nào cần gen (cần có ảnh gốc, chưa có kết quả AI).")
+
         with c_btn_print:
             if st.button("🖨️ In đơn", type="primary", use_container_width=True, help="In các đơn đã chọn"):
                 if not selected_indices:
@@ -637,27 +649,22 @@ def render_order_management(df):
                                 selected_ma_don.append(raw_ma)
                             
                             if selected_ma_don:
-                                orders_data_list = []
-                                from modules.data_handler import get_order_details
                                 with st.spinner(f"Xử lý {len(selected_ma_don)} đơn..."):
-                                    for ma in selected_ma_don:
-                                        o_info, o_items = get_order_details(ma)
-                                        if o_info: orders_data_list.append({"order_info": o_info, "items": o_items})
+                                    orders_data_list = get_orders_with_items(selected_ma_don)
                                 
                                 if orders_data_list:
-                                    combined_html = generate_combined_print_html(orders_data_list)
+                                    with st.spinner("Đang tải ảnh để in offline..."):
+                                        print_docs = generate_print_documents(orders_data_list)
                                     @st.dialog("🖨️ Xem trước bản in (Gộp)", width="large")
-                                    def show_combined_print_preview(html_content, ma_list):
+                                    def show_combined_print_preview(docs, ma_list):
                                         st.caption("Kiểm tra kỹ các đơn trước khi bấm xác nhận.")
                                         if st.button("🚀 XÁC NHẬN & IN TẤT CẢ", type="primary", use_container_width=True):
-                                            from modules.data_handler import mark_order_as_printed
                                             with st.spinner("Đang cập nhật trạng thái..."):
-                                                for m in ma_list:
-                                                    mark_order_as_printed(m)
-                                            st.session_state["print_bulk_html"] = html_content
+                                                bulk_update_orders(ma_list, {"da_in": True})
+                                            st.session_state["print_bulk_html"] = docs
                                             st.rerun()
-                                        components.html(html_content, height=800, scrolling=True)
-                                    show_combined_print_preview(combined_html, selected_ma_don)
+                                        hien_thi_ban_in(docs)
+                                    show_combined_print_preview(print_docs, selected_ma_don)
                     except Exception as e: st.error(f"Lỗi: {e}")
 
         with c_btn_excel:
@@ -675,20 +682,17 @@ def render_order_management(df):
                             selected_ma_don_ex.append(raw_ma)
                             
                         if selected_ma_don_ex:
-                            orders_data_ex = []
-                            from modules.data_handler import get_order_details
                             with st.spinner("Đang tạo..."):
-                                for ma in selected_ma_don_ex:
-                                    o_info, o_items = get_order_details(ma)
-                                    if o_info: orders_data_ex.append({"order_info": o_info, "items": o_items})
-                                    
-                                    # --- LOGIC AUTOMATION: Xuất Excel -> Chờ sản xuất ---
-                                    # Chỉ update nếu đơn đang ở trạng thái trước đó (Mới, Đã xác nhận) để tránh revert đơn đã làm
-                                    current_st_ex = o_info.get('trang_thai', '')
-                                    allow_auto_update_ex = ["Mới", "Đã xác nhận", "New"]
-                                    if current_st_ex in allow_auto_update_ex:
-                                        from modules.data_handler import update_order_info
-                                        update_order_info(ma, {"trang_thai": "Chờ sản xuất"})
+                                orders_data_ex = get_orders_with_items(selected_ma_don_ex)
+                                
+                                # --- LOGIC AUTOMATION: Xuất Excel -> Chờ sản xuất ---
+                                # Chỉ update nếu đơn đang ở trạng thái trước đó (Mới, Đã xác nhận) để tránh revert đơn đã làm
+                                allow_auto_update_ex = ["Mới", "Đã xác nhận", "New"]
+                                bulk_update_orders(
+                                    [d['order_info']['ma_don'] for d in orders_data_ex],
+                                    {"trang_thai": "Chờ sản xuất"},
+                                    only_if_status_in=allow_auto_update_ex
+                                )
 
                             if orders_data_ex:
                                 excel_buffer = export_orders_to_excel(orders_data_ex)
@@ -708,6 +712,32 @@ def render_order_management(df):
     else:
         st.warning("Không tìm thấy đơn hàng phù hợp với bộ lọc.")
 
+    # Kết quả gen AI hàng loạt hiện dần khi từng job xong
+    batch_ids = st.session_state.get("ai_batch_jobs")
+    if batch_ids:
+        batch_jobs = get_jobs(batch_ids)
+        if any(j["status"] in (QUEUED, RUNNING) for j in batch_jobs):
+            theo_doi_batch_ai(batch_ids)
+        else:
+            ve_batch_ai(batch_jobs)
+            if st.button("Đóng kết quả Gen AI", key="btn_close_ai_batch"):
+                st.session_state.pop("ai_batch_jobs", None)
+                st.rerun()
+
+    # --- PHÂN TRANG (KEYSET) ---
+    if len(cursors) > 1 or next_cursor:
+        c_prev, c_page, c_next = st.columns([1, 2, 1])
+        with c_prev:
+            if st.button("◀ Trang trước", disabled=len(cursors) <= 1, use_container_width=True):
+                cursors.pop()
+                st.rerun()
+        with c_page:
+            st.markdown(f"<div style='text-align: center; padding-top: 6px;'>Trang {len(cursors)}</div>", unsafe_allow_html=True)
+        with c_next:
+            if st.button("Trang sau ▶", disabled=not next_cursor, use_container_width=True):
+                cursors.append(next_cursor)
+                st.rerun()
+
     # --- 3. DETAIL VIEW (CRM SEARCH ENGINE) ---
     st.markdown("---")
     st.subheader("🔍 Chi tiết & Chỉnh sửa")
@@ -719,35 +749,23 @@ def render_order_management(df):
         with c_search:
             search_term = st.text_input("🔎 Tìm kiếm (Tên, SĐT, Mã):", placeholder="Gõ tên khách hoặc SĐT...")
         
-        # Logic lọc dữ liệu
-        df_filtered = df.copy()
-        if search_term:
-            term = search_term.lower()
-            # Lọc trên 3 trường chính
-            m1 = df_filtered['ma_don'].astype(str).str.lower().str.contains(term)
-            m2 = df_filtered['ten_khach'].astype(str).str.lower().str.contains(term)
-            m3 = df_filtered['sdt'].astype(str).str.lower().str.contains(term)
-            df_filtered = df_filtered[m1 | m2 | m3]
-        
-        if df_filtered.empty:
+        # Tra chỉ mục (không dấu, tiền tố + giữa chuỗi), chỉ lấy top kết quả
+        matches = search_orders(search_term, limit=SEARCH_TOP_N)
+        if not matches:
             st.warning("⚠️ Không tìm thấy đơn hàng nào phù hợp.")
             return # Dừng render nếu không có data
 
-        # Tạo Label thông minh cho Selectbox: "ORD-XXX | Tên Khách | SĐT"
-        df_filtered['display_label'] = df_filtered.apply(
-            lambda x: f"{x['ma_don']} | {x.get('ten_khach', 'No Name')} | {x.get('sdt', '')}", axis=1
-        )
-        
+        labels = {label: ma for ma, label in matches}
         with c_select:
-            # Selectbox hiển thị danh sách đã lọc
+            # Label thông minh cho Selectbox: "ORD-XXX | Tên Khách | SĐT"
             selected_label = st.selectbox(
-                f"Chọn đơn hàng ({len(df_filtered)} kết quả):", 
-                df_filtered['display_label'].unique()
+                f"Chọn đơn hàng (top {len(matches)} kết quả):" if search_term else f"Chọn đơn hàng ({len(matches)} đơn mới nhất):",
+                list(labels)
             )
 
         # Trích xuất lại mã đơn từ label đã chọn
         if selected_label:
-            ma_don_select = selected_label.split(" | ")[0] # Lấy phần mã đơn đầu tiên
+            ma_don_select = labels[selected_label]
             
             # --- PHẦN CODE XỬ LÝ CHI TIẾT ---
             render_order_detail_view(ma_don_select)
@@ -921,7 +939,8 @@ def render_order_detail_view(ma_don):
             can_print, msg_print = check_print_permission(order_info)
 
             if st.button("🖨️ XEM & IN PHIẾU", use_container_width=True, key=f"btn_print_{ma_don}", disabled=not can_print, help=None if can_print else msg_print):
-                html_content = generate_print_html(order_info, items)
+                with st.spinner("Đang tải ảnh để in offline..."):
+                    html_content = generate_print_html(order_info, items)
                 
                 @st.dialog("🖨️ Xem trước bản in", width="large")
                 def show_preview_dialog(html, m_don):
@@ -958,12 +977,19 @@ def render_order_detail_view(ma_don):
             def auto_upload_multiple_callback(uploader_key, item_id, db_column, version_key):
                 uploaded_files = st.session_state.get(uploader_key)
                 if uploaded_files:
-                    str_urls = upload_multiple_files_to_supabase(uploaded_files, item_id)
+                    bar = st.progress(0, text=f"Đang upload {len(uploaded_files)} file...")
+                    def on_progress(done, total, name, err):
+                        bar.progress(done / total, text=f"{'❌' if err else '✅'} {name} ({done}/{total})")
+
+                    str_urls, errors = upload_multiple_files_to_supabase(uploaded_files, item_id, on_progress=on_progress)
+                    bar.empty()
                     if str_urls:
                         update_item_image(item_id, str_urls, db_column)
                         if version_key in st.session_state:
                             st.session_state[version_key] += 1
-                        st.toast(f"✅ Đã ghi đè {len(uploaded_files)} file mới!", icon="📂")
+                        st.toast(f"✅ Đã ghi đè {len(uploaded_files) - len(errors)} file mới!", icon="📂")
+                    for name, err in errors:
+                        st.toast(f"❌ Lỗi upload {name}: {err}", icon="⚠️")
 
             if items:
                 for item in items:
@@ -1062,23 +1088,22 @@ def render_order_detail_view(ma_don):
                             with cols[2]:
                                 st.write("2️⃣ Kết quả AI")
                                 hien_thi_anh_vuong(item.get('img_sub1'), "Kết quả AI")
-                                if st.button("✨ Gen AI", key=f"ai_{item.get('id')}", type="primary"):
-                                    try:
-                                        input_bytes = None
-                                        up_obj = st.session_state.get(k_main)
-                                        if up_obj: input_bytes = up_obj.getvalue()
-                                        elif item.get('img_main'):
-                                            input_bytes = requests.get(item.get('img_main')).content
-                                        
-                                        if input_bytes:
-                                            with st.spinner("AI đang vẽ..."):
-                                                ai_bytes = gen_anh_mau_theu(input_bytes, f"{item.get('ten_sp')} {item.get('kieu_theu')}")
-                                                if ai_bytes:
-                                                    url = upload_image_to_supabase(ai_bytes, f"item_{item.get('id')}_ai.png")
-                                                    if url and update_item_image(item.get('id'), url, "img_sub1"): st.rerun()
-                                                else: st.error("AI lỗi")
-                                        else: st.warning("Cần ảnh gốc!")
-                                    except: pass
+                                # Gen chạy nền (job_queue) -> không khoá session, F5 vẫn thấy tiến độ
+                                job = latest_job_for_item(item.get('id'))
+                                dang_chay = bool(job and job["status"] in (QUEUED, RUNNING))
+                                if st.button("✨ Gen AI", key=f"ai_{item.get('id')}", type="primary", disabled=dang_chay):
+                                    up_obj = st.session_state.get(k_main)
+                                    if up_obj or item.get('img_main'):
+                                        job_id = submit_gen_mau(item.get('id'), f"{item.get('ten_sp')} {item.get('kieu_theu')}",
+                                                                input_bytes=up_obj.getvalue() if up_obj else None,
+                                                                input_url=None if up_obj else item.get('img_main'))
+                                        st.toast(f"Đã gửi job AI #{job_id}")
+                                        st.rerun()
+                                    else: st.warning("Cần ảnh gốc!")
+                                if dang_chay:
+                                    theo_doi_job_ai(job["id"])
+                                elif job and job["status"] == ERROR:
+                                    st.caption(f"❌ AI lỗi: {job['error']}")
 
                             with cols[3]:
                                 st.write("3️⃣ Ảnh Design")
@@ -1155,6 +1180,12 @@ def render_ai_image_page():
     if 'ai_input_bytes' not in st.session_state: st.session_state.ai_input_bytes = None
     if 'ai_input_url' not in st.session_state: st.session_state.ai_input_url = None
     if 'ai_result_url' not in st.session_state: st.session_state.ai_result_url = None
+    if 'ai_job_id' not in st.session_state: st.session_state.ai_job_id = None
+
+    # Job edit đang chạy nền -> lấy kết quả khi xong
+    job = get_job(st.session_state.ai_job_id) if st.session_state.ai_job_id else None
+    if job and job["status"] == DONE:
+        st.session_state.ai_result_url = job["result_url"]
 
     # Layout 3 cột: Gốc | Kết quả | Prompt
     c_orig, c_res, c_prompt = st.columns([1.2, 1.2, 2.5])
@@ -1187,6 +1218,10 @@ def render_ai_image_page():
             
     with c_res:
         st.info("✨ 2. Kết quả AI")
+        if job and job["status"] in (QUEUED, RUNNING):
+            theo_doi_job_ai(job["id"])
+        elif job and job["status"] == ERROR:
+            st.error(f"❌ {job['error']}")
         if st.session_state.ai_result_url:
             hien_thi_anh_vuong(st.session_state.ai_result_url, "Kết quả AI")
             st.link_button("⬇️ TẢI ẢNH VỀ", st.session_state.ai_result_url, type="primary", use_container_width=True)
@@ -1217,22 +1252,20 @@ def render_ai_image_page():
         
         if st.button("🚀 XỬ LÝ ẢNH (GENERATE)", type="primary", use_container_width=True):
             if st.session_state.ai_input_bytes and prompt_input:
-                with st.spinner("AI đang xử lý..."):
-                    # 1. Gọi AI bằng bytes đã lưu trong session
-                    print(f"DEBUG: Processing AI image with {len(st.session_state.ai_input_bytes)} bytes of input data.")
-                    result_bytes = generate_image_from_ref(st.session_state.ai_input_bytes, prompt_input)
-                    
-                    if result_bytes:
-                        print(f"DEBUG: AI generation successful. Result size: {len(result_bytes)} bytes.")
-                        # 2. Upload kết quả lên Supabase
-                        res_url = upload_image_to_supabase(result_bytes, f"ai_res_{int(time.time())}.png", folder="ai_temp")
-                        if res_url:
-                            st.session_state.ai_result_url = res_url
-                            st.success("✅ Thành công!")
-                            st.rerun()
-                        else:
-                            st.error("❌ Lỗi lưu ảnh kết quả.")
-                    else:
-                        st.error("❌ AI không trả về ảnh. Hãy thử prompt khác.")
+                # Chạy nền: trang không bị khoá trong lúc AI xử lý
+                st.session_state.ai_job_id = submit_edit_anh(st.session_state.ai_input_bytes, prompt_input)
+                st.session_state.ai_result_url = None
+                st.rerun()
             else:
                 st.warning("⚠️ Thiếu ảnh gốc hoặc yêu cầu!")
+
+        # Job gần đây (lưu trong SQLite) -> F5 mất session vẫn lấy lại được kết quả
+        jobs = recent_jobs("edit_anh", limit=5)
+        if jobs:
+            with st.expander("🕘 Job gần đây"):
+                for j in jobs:
+                    when = datetime.fromtimestamp(j["created_at"]).strftime("%H:%M %d/%m")
+                    if j["status"] == DONE:
+                        st.markdown(f"✅ #{j['id']} · {when} · [{j['prompt'][:40]}]({j['result_url']})")
+                    else:
+                        st.caption(f"{'❌' if j['status'] == ERROR else '⏳'} #{j['id']} · {when} · {j['prompt'][:40]} {j['error'] or ''}")
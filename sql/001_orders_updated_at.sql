@@ -0,0 +1,27 @@
+-- 001: Cột updated_at cho bảng orders
+-- Dùng làm watermark cho cache đơn hàng (data_handler.fetch_all_orders):
+-- app chỉ kéo những dòng có updated_at >= lần đồng bộ trước.
+
+alter table public.orders
+    add column if not exists updated_at timestamptz not null default now();
+
+-- Đơn cũ: lấy created_at làm mốc ban đầu
+update public.orders set updated_at = created_at where created_at is not null;
+
+-- Tự cập nhật updated_at mỗi khi đơn bị sửa (kể cả khi sửa trực tiếp trên Supabase)
+create or replace function public.set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists trg_orders_updated_at on public.orders;
+create trigger trg_orders_updated_at
+    before update on public.orders
+    for each row execute function public.set_updated_at();
+
+create index if not exists idx_orders_updated_at on public.orders (updated_at);
@@ -0,0 +1,63 @@
+-- 002: Lọc & phân trang Dashboard ngay trên DB
+-- - Index cho các điều kiện lọc và phân trang keyset (created_at, id).
+-- - Hàm dashboard_kpis: tính KPI theo đúng bộ lọc bằng 1 query tổng hợp
+--   (gọi từ data_handler.fetch_order_kpis).
+
+create index if not exists idx_orders_created_at_id on public.orders (created_at desc, id desc);
+create index if not exists idx_orders_trang_thai on public.orders (trang_thai);
+create index if not exists idx_orders_shop on public.orders (shop);
+create index if not exists idx_orders_ngay_dat on public.orders (ngay_dat);
+create index if not exists idx_orders_ngay_tra on public.orders (ngay_tra);
+create index if not exists idx_orders_tags on public.orders using gin (tags);
+
+create or replace function public.dashboard_kpis(
+    p_trang_thai     text[]  default null,
+    p_shop           text[]  default null,
+    p_tags           text[]  default null,
+    p_co_hen_ngay    boolean default false,
+    p_chua_in        boolean default false,
+    p_ngay_dat_tu    date    default null,
+    p_ngay_dat_den   date    default null,
+    p_ngay_tra_tu    date    default null,
+    p_ngay_tra_den   date    default null,
+    p_status_done    text[]  default '{}',
+    p_status_cancel  text[]  default '{}'
+)
+returns table (
+    tong_don     bigint,
+    da_xong      bigint,
+    da_huy       bigint,
+    dt_ban_hang  numeric,
+    dt_coc       numeric,
+    dt_thuc_nhan numeric
+)
+language sql
+stable
+as $$
+    with loc as (
+        select
+            coalesce(trim(o.trang_thai), '') as stt,
+            coalesce(o.thanh_tien, 0)::numeric as tien,
+            coalesce(o.da_coc, 0)::numeric as coc
+        from public.orders o
+        where (p_trang_thai is null or o.trang_thai = any (p_trang_thai))
+          and (p_shop is null or o.shop = any (p_shop))
+          and (p_tags is null or o.tags && p_tags)
+          and (not p_co_hen_ngay or o.co_hen_ngay is true)
+          and (not p_chua_in or o.da_in is not true)
+          and (p_ngay_dat_tu is null or o.ngay_dat::date >= p_ngay_dat_tu)
+          and (p_ngay_dat_den is null or o.ngay_dat::date <= p_ngay_dat_den)
+          and (p_ngay_tra_tu is null or o.ngay_tra::date >= p_ngay_tra_tu)
+          and (p_ngay_tra_den is null or o.ngay_tra::date <= p_ngay_tra_den)
+    )
+    select
+        count(*),
+        count(*) filter (where stt = any (p_status_done)),
+        count(*) filter (where stt = any (p_status_cancel)),
+        coalesce(sum(tien) filter (where not stt = any (p_status_cancel)), 0),
+        coalesce(sum(coc) filter (where not stt = any (p_status_cancel)), 0),
+        -- Thực nhận: đơn xong tính đủ tiền, đơn đang làm chỉ tính tiền cọc
+        coalesce(sum(case when stt = any (p_status_done) then tien else coc end)
+                 filter (where not stt = any (p_status_cancel)), 0)
+    from loc;
+$$;
@@ -0,0 +1,56 @@
+-- 003: Lưu đơn mới trong 1 transaction (gọi từ data_handler.save_full_order qua RPC)
+-- - Upsert khach_hang theo sdt (cần unique index bên dưới; nếu bảng đang có SĐT trùng
+--   thì phải gộp khách trùng trước khi chạy file này).
+-- - Tạo đơn + items.
+-- - Cộng dồn so_don_hang / tong_tieu nguyên tử (không còn read-modify-write phía app).
+-- Trả về id khách hàng (null nếu đơn không có SĐT).
+
+create unique index if not exists uq_khach_hang_sdt on public.khach_hang (sdt);
+
+create or replace function public.save_full_order(
+    p_order       jsonb,
+    p_items       jsonb default '[]'::jsonb,
+    p_facebook_id text  default null
+)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_sdt      text    := nullif(trim(p_order->>'sdt'), '');
+    v_tien     numeric := coalesce((p_order->>'thanh_tien')::numeric, 0);
+    v_khach_id bigint;
+    o          public.orders;
+begin
+    -- 1. Khách hàng (chỉ xử lý khi có SĐT)
+    if v_sdt is not null then
+        insert into public.khach_hang as k
+            (ho_ten, sdt, dia_chi, nguon_shop, facebook_id, so_don_hang, tong_tieu)
+        values
+            (p_order->>'ten_khach', v_sdt, p_order->>'dia_chi', p_order->>'shop', p_facebook_id, 1, v_tien)
+        on conflict (sdt) do update set
+            ho_ten      = excluded.ho_ten,
+            dia_chi     = excluded.dia_chi,
+            nguon_shop  = excluded.nguon_shop,
+            facebook_id = coalesce(excluded.facebook_id, k.facebook_id),
+            so_don_hang = coalesce(k.so_don_hang, 0) + 1,
+            tong_tieu   = coalesce(k.tong_tieu, 0) + excluded.tong_tieu
+        returning k.id into v_khach_id;
+    end if;
+
+    -- 2. Đơn hàng (jsonb -> đúng kiểu cột của bảng orders)
+    o := jsonb_populate_record(null::public.orders, p_order);
+    insert into public.orders
+        (ma_don, ten_khach, sdt, dia_chi, ngay_dat, ngay_tra, thanh_tien, da_coc, con_lai,
+         httt, van_chuyen, ghi_chu, trang_thai, shop, khach_hang_id, co_hen_ngay)
+    values
+        (o.ma_don, o.ten_khach, o.sdt, o.dia_chi, o.ngay_dat, o.ngay_tra, o.thanh_tien, o.da_coc, o.con_lai,
+         o.httt, o.van_chuyen, o.ghi_chu, o.trang_thai, o.shop, v_khach_id, coalesce(o.co_hen_ngay, false));
+
+    -- 3. Sản phẩm
+    insert into public.order_items (order_id, ten_sp, mau, size, kieu_theu, thong_tin_phu)
+    select o.ma_don, i.ten_sp, i.mau, i.size, i.kieu_theu, i.thong_tin_phu
+    from jsonb_populate_recordset(null::public.order_items, coalesce(p_items, '[]'::jsonb)) as i;
+
+    return v_khach_id;
+end;
+$$;
@@ -0,0 +1,64 @@
+-- 004: Đồng bộ tổng tiêu / số đơn / địa chỉ khách hàng bằng 1 câu UPDATE set-based
+-- Gọi từ data_handler.sync_all_customer_totals qua RPC.
+-- - p_incremental = false: tính lại cho mọi khách có đơn.
+-- - p_incremental = true : chỉ tính lại khách có đơn thay đổi (orders.updated_at, xem 001)
+--                          kể từ lần chạy trước (lưu trong app_sync_state).
+-- Trả về số khách hàng thực sự thay đổi.
+
+create index if not exists idx_orders_khach_hang_id on public.orders (khach_hang_id);
+
+create table if not exists public.app_sync_state (
+    ten           text primary key,
+    lan_chay_cuoi timestamptz
+);
+
+create or replace function public.sync_customer_totals(p_incremental boolean default false)
+returns integer
+language plpgsql
+as $$
+declare
+    v_since   timestamptz;
+    v_started timestamptz := now();
+    v_count   integer;
+begin
+    if p_incremental then
+        select lan_chay_cuoi into v_since
+        from public.app_sync_state
+        where ten = 'customer_totals';
+    end if;
+
+    with touched as (
+        select distinct khach_hang_id
+        from public.orders
+        where khach_hang_id is not null
+          and (v_since is null or updated_at >= v_since)
+    ),
+    agg as (
+        select
+            o.khach_hang_id,
+            sum(coalesce(o.thanh_tien, 0)) as tong_tieu,
+            count(*) as so_don_hang,
+            -- Địa chỉ của đơn mới nhất
+            (array_agg(o.dia_chi order by o.created_at desc))[1] as dia_chi
+        from public.orders o
+        join touched t on t.khach_hang_id = o.khach_hang_id
+        group by o.khach_hang_id
+    )
+    update public.khach_hang k
+    set tong_tieu   = agg.tong_tieu,
+        so_don_hang = agg.so_don_hang,
+        dia_chi     = agg.dia_chi
+    from agg
+    where k.id = agg.khach_hang_id
+      and (k.tong_tieu, k.so_don_hang, k.dia_chi)
+          is distinct from (agg.tong_tieu, agg.so_don_hang, agg.dia_chi);
+
+    get diagnostics v_count = row_count;
+
+    insert into public.app_sync_state (ten, lan_chay_cuoi)
+    values ('customer_totals', v_started)
+    on conflict (ten) do update set lan_chay_cuoi = excluded.lan_chay_cuoi;
+
+    return v_count;
+end;
+$$;
@@ -0,0 +1,16 @@
+-- 005: Cột updated_at cho bảng khach_hang
+-- Dùng làm watermark cho chỉ mục khách hàng trong RAM (data_handler.sync_customer_index):
+-- app chỉ kéo những khách có updated_at >= lần đồng bộ trước.
+-- Cần chạy sau 001 (dùng lại hàm set_updated_at).
+
+alter table public.khach_hang
+    add column if not exists updated_at timestamptz not null default now();
+
+update public.khach_hang set updated_at = created_at where created_at is not null;
+
+drop trigger if exists trg_khach_hang_updated_at on public.khach_hang;
+create trigger trg_khach_hang_updated_at
+    before update on public.khach_hang
+    for each row execute function public.set_updated_at();
+
+create index if not exists idx_khach_hang_updated_at on public.khach_hang (updated_at);
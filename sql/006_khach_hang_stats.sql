@@ -0,0 +1,139 @@
+-- 006: Bảng tổng hợp theo khách hàng (tổng chi tiêu, số đơn, đơn gần nhất, hạng)
+-- Được trigger trên orders cập nhật ngay khi thêm / sửa / hủy / xoá đơn, chỉ tính lại
+-- cho đúng các khách bị ảnh hưởng. Trang Khách hàng đọc view khach_hang_tong_hop
+-- (data_handler.lay_khach_hang_tong_hop) thay vì tải toàn bộ đơn về để groupby.
+-- Đơn hủy không tính vào chi tiêu / số đơn (giống STATUS_CANCEL trong data_handler).
+-- Cần chạy sau 004 (dùng index idx_orders_khach_hang_id).
+
+create table if not exists public.khach_hang_stats (
+    khach_hang_id bigint primary key references public.khach_hang (id) on delete cascade,
+    tong_tieu     numeric not null default 0,
+    so_don        integer not null default 0,
+    don_cuoi      timestamptz,
+    -- Ngưỡng hạng giống trang Khách hàng: Bạc < 500k <= Vàng < 5tr <= Kim Cương
+    hang          text generated always as (
+                      case when tong_tieu >= 5000000 then 'Kim Cương'
+                           when tong_tieu >= 500000  then 'Vàng'
+                           else 'Bạc' end
+                  ) stored,
+    updated_at    timestamptz not null default now()
+);
+
+create index if not exists idx_khach_hang_stats_hang_tieu on public.khach_hang_stats (hang, tong_tieu desc);
+create index if not exists idx_khach_hang_stats_tieu on public.khach_hang_stats (tong_tieu desc);
+
+-- Tính lại (set-based) cho 1 nhóm khách
+create or replace function public.refresh_khach_hang_stats(p_ids bigint[])
+returns void
+language sql
+as $$
+    insert into public.khach_hang_stats as s (khach_hang_id, tong_tieu, so_don, don_cuoi, updated_at)
+    select
+        k.id,
+        coalesce(sum(coalesce(o.thanh_tien, 0)), 0),
+        count(o.id),
+        max(o.created_at),
+        now()
+    from public.khach_hang k
+    left join public.orders o
+           on o.khach_hang_id = k.id
+          and coalesce(trim(o.trang_thai), '') <> all (array['Đã hủy', 'Cancelled', 'Hủy', 'Fail', 'Aborted'])
+    where k.id = any (p_ids)
+    group by k.id
+    on conflict (khach_hang_id) do update
+    set tong_tieu  = excluded.tong_tieu,
+        so_don     = excluded.so_don,
+        don_cuoi   = excluded.don_cuoi,
+        updated_at = excluded.updated_at
+    where (s.tong_tieu, s.so_don, s.don_cuoi)
+          is distinct from (excluded.tong_tieu, excluded.so_don, excluded.don_cuoi);
+$$;
+
+-- Trigger theo câu lệnh (statement-level): cập nhật hàng loạt (bulk_update_orders)
+-- chỉ gọi refresh 1 lần cho tập khách bị ảnh hưởng.
+create or replace function public.trg_orders_khach_hang_stats()
+returns trigger
+language plpgsql
+as $$
+declare
+    v_ids bigint[];
+begin
+    if tg_op = 'INSERT' then
+        select array_agg(distinct khach_hang_id) into v_ids
+        from new_rows where khach_hang_id is not null;
+    elsif tg_op = 'UPDATE' then
+        select array_agg(distinct id) into v_ids
+        from (
+            select n.khach_hang_id as id
+            from new_rows n
+            join old_rows o on o.id = n.id
+            -- Bỏ qua cập nhật không đổi gì liên quan (vd: chỉ đánh dấu đã in)
+            where (n.khach_hang_id, n.thanh_tien, n.trang_thai, n.created_at)
+                  is distinct from (o.khach_hang_id, o.thanh_tien, o.trang_thai, o.created_at)
+            union
+            select o.khach_hang_id
+            from old_rows o
+            join new_rows n on n.id = o.id
+            where o.khach_hang_id is distinct from n.khach_hang_id
+        ) t
+        where id is not null;
+    else
+        select array_agg(distinct khach_hang_id) into v_ids
+        from old_rows where khach_hang_id is not null;
+    end if;
+
+    if v_ids is not null then
+        perform public.refresh_khach_hang_stats(v_ids);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists trg_orders_stats_ins on public.orders;
+create trigger trg_orders_stats_ins
+    after insert on public.orders
+    referencing new table as new_rows
+    for each statement execute function public.trg_orders_khach_hang_stats();
+
+drop trigger if exists trg_orders_stats_upd on public.orders;
+create trigger trg_orders_stats_upd
+    after update on public.orders
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function public.trg_orders_khach_hang_stats();
+
+drop trigger if exists trg_orders_stats_del on public.orders;
+create trigger trg_orders_stats_del
+    after delete on public.orders
+    referencing old table as old_rows
+    for each statement execute function public.trg_orders_khach_hang_stats();
+
+-- Khách mới chưa có đơn cũng có 1 dòng stats (hạng Bạc)
+create or replace function public.trg_khach_hang_stats_init()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into public.khach_hang_stats (khach_hang_id) values (new.id)
+    on conflict (khach_hang_id) do nothing;
+    return new;
+end;
+$$;
+
+drop trigger if exists trg_khach_hang_stats_init on public.khach_hang;
+create trigger trg_khach_hang_stats_init
+    after insert on public.khach_hang
+    for each row execute function public.trg_khach_hang_stats_init();
+
+-- Nạp lần đầu cho toàn bộ khách hiện có
+select public.refresh_khach_hang_stats(array(select id from public.khach_hang));
+
+-- View cho trang Khách hàng: thông tin khách + số liệu tổng hợp
+create or replace view public.khach_hang_tong_hop as
+select
+    k.*,
+    s.tong_tieu  as stats_tong_tieu,
+    s.so_don     as stats_so_don,
+    s.don_cuoi,
+    s.hang
+from public.khach_hang k
+join public.khach_hang_stats s on s.khach_hang_id = k.id;
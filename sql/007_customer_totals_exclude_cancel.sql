@@ -0,0 +1,63 @@
+-- 007: khach_hang.tong_tieu / so_don_hang không tính đơn hủy (giống khach_hang_stats ở 006)
+-- Chỉ mục khách hàng trong RAM xếp hạng theo khach_hang.tong_tieu, trang Khách hàng hiện
+-- số liệu từ khach_hang_stats -> 2 nguồn phải cùng cách tính thì thứ hạng mới khớp số hiện.
+-- Thay hàm của 004 (cùng chữ ký), khách chỉ còn đơn hủy được đưa về 0.
+-- Cần chạy sau 004 và 006.
+
+create or replace function public.sync_customer_totals(p_incremental boolean default false)
+returns integer
+language plpgsql
+as $$
+declare
+    v_since   timestamptz;
+    v_started timestamptz := now();
+    v_count   integer;
+begin
+    if p_incremental then
+        select lan_chay_cuoi into v_since
+        from public.app_sync_state
+        where ten = 'customer_totals';
+    end if;
+
+    with touched as (
+        select distinct khach_hang_id
+        from public.orders
+        where khach_hang_id is not null
+          and (v_since is null or updated_at >= v_since)
+    ),
+    agg as (
+        select
+            o.khach_hang_id,
+            coalesce(sum(coalesce(o.thanh_tien, 0)) filter (where not o.da_huy), 0) as tong_tieu,
+            count(*) filter (where not o.da_huy) as so_don_hang,
+            -- Địa chỉ của đơn mới nhất (kể cả đơn hủy, như 004)
+            (array_agg(o.dia_chi order by o.created_at desc))[1] as dia_chi
+        from (
+            select o.*,
+                   coalesce(trim(o.trang_thai), '') = any (array['Đã hủy', 'Cancelled', 'Hủy', 'Fail', 'Aborted']) as da_huy
+            from public.orders o
+            join touched t on t.khach_hang_id = o.khach_hang_id
+        ) o
+        group by o.khach_hang_id
+    )
+    update public.khach_hang k
+    set tong_tieu   = agg.tong_tieu,
+        so_don_hang = agg.so_don_hang,
+        dia_chi     = agg.dia_chi
+    from agg
+    where k.id = agg.khach_hang_id
+      and (k.tong_tieu, k.so_don_hang, k.dia_chi)
+          is distinct from (agg.tong_tieu, agg.so_don_hang, agg.dia_chi);
+
+    get diagnostics v_count = row_count;
+
+    insert into public.app_sync_state (ten, lan_chay_cuoi)
+    values ('customer_totals', v_started)
+    on conflict (ten) do update set lan_chay_cuoi = excluded.lan_chay_cuoi;
+
+    return v_count;
+end;
+$$;
+
+-- Tính lại toàn bộ theo cách mới
+select public.sync_customer_totals(false);
@@ -0,0 +1,21 @@
+"""Bộ luật trích xuất nhanh: tiền / ngày chỉ tự điền khi chắc chắn."""
+from datetime import date
+
+from modules.chat_parser import parse_chat
+
+TODAY = date(2024, 10, 1)
+
+
+def test_amount_needs_total_keyword_and_real_amount():
+    assert "tong_tien" not in parse_chat("giá 2 cái 500k", TODAY)
+    assert "tong_tien" not in parse_chat("tổng 2 áo", TODAY)
+    out = parse_chat("tổng 850k, cọc 200k", TODAY)
+    assert (out["tong_tien"], out["da_coc"]) == (850000, 200000)
+    assert parse_chat("tt: 1.250.000đ", TODAY)["tong_tien"] == 1250000
+
+
+def test_quantity_is_not_a_return_date():
+    assert "ngay_tra" not in parse_chat("giao 1/2 cái áo", TODAY)
+    assert parse_chat("giao 1/2 cái áo, nhận 15/11", TODAY)["ngay_tra"] == "2024-11-15"
+    assert parse_chat("giao ngày 1/2 nhé", TODAY)["ngay_tra"] == "2025-02-01"
+    assert parse_chat("trả 20/11/2024", TODAY)["ngay_tra"] == "2024-11-20"
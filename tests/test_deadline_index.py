@@ -0,0 +1,33 @@
+"""Chỉ mục hạn trả: delta lớn (> 100 dòng) không để lại khoá trùng / khoá mồ côi."""
+from datetime import date, timedelta
+
+import pandas as pd
+
+from modules.deadline_index import DeadlineIndex
+
+TODAY = date(2024, 5, 10)
+
+
+def _frame(n, status=None, shift=0):
+    rows = []
+    for i in range(n):
+        rows.append({"ma_don": f"DH{i:05d}", "ten_khach": f"Khách {i}",
+                     "ngay_tra": (TODAY + timedelta(days=i % 30 - 10 + shift)).isoformat(),
+                     "co_hen_ngay": i % 3 == 0, "trang_thai": (status or {}).get(i, "Đang sản xuất")})
+    return pd.DataFrame(rows)
+
+
+def test_bulk_status_delta_then_close():
+    index = DeadlineIndex(["Hoàn thành", "Hủy"])
+    index.rebuild(_frame(1000))
+
+    # Delta 150 dòng đổi ngày trả, sau đó 1 đơn được đóng
+    index.upsert_frame(_frame(150, shift=3))
+    assert len(index._keys) == len(set(index._keys)) == len(index)
+    assert index._urgent == sorted(k for k in index._keys if index._orders[k[1]]["co_hen_ngay"])
+
+    index.upsert_frame(_frame(1, status={0: "Hoàn thành"}))
+    overdue = index.overdue(TODAY)
+    assert "DH00000" not in {o["ma_don"] for o in overdue}
+    assert len(index.due_in_next(30, TODAY)) + len(overdue) == len(index) == 999
+    assert sum(index.workload(TODAY - timedelta(days=40), 100)["so_don"]) == 999
@@ -0,0 +1,55 @@
+"""Chỉ mục tìm kiếm đơn hàng: cập nhật delta lớn (> 100 dòng) không làm hỏng danh sách từ."""
+import pandas as pd
+
+from modules.search_index import OrderSearchIndex
+
+
+def _frame(n, rename=None):
+    rows = []
+    for i in range(n):
+        ten = "Yến Xuân" if i == 7 else f"Khách {i}"
+        if rename and i in rename:
+            ten = rename[i]
+        rows.append({"ma_don": f"DH{i:05d}", "ten_khach": ten, "sdt": f"09{i:08d}",
+                     "created_at": f"2024-05-01T10:{i % 60:02d}:00"})
+    return pd.DataFrame(rows)
+
+
+def test_bulk_delta_with_rename_keeps_words_sorted():
+    index = OrderSearchIndex()
+    index.rebuild(_frame(1000))
+    assert [ma for ma, _ in index.search("xuan")] == ["DH00007"]
+
+    # Delta 150 dòng (vd. bulk cập nhật da_in), trong đó 1 khách đổi tên
+    index.upsert_frame(_frame(150, rename={7: "Yến Nhi"}))
+
+    assert index._words == sorted(index._postings)
+    assert index.search("x") == []
+    assert index.search("xuan") == []
+    assert [ma for ma, _ in index.search("nhi")] == ["DH00007"]
+
+
+def test_small_delta_updates_in_place():
+    index = OrderSearchIndex()
+    index.rebuild(_frame(200))
+    index.upsert_frame(_frame(8, rename={7: "Yến Nhi"}))
+
+    assert index._words == sorted(index._postings)
+    assert index.search("xuan") == []
+    assert [ma for ma, _ in index.search("yen nhi")] == ["DH00007"]
+
+
+def test_customer_rebuild_with_duplicate_ids():
+    from modules.search_index import CustomerIndex
+
+    rows = [{"id": i, "ho_ten": f"Khách {i}", "sdt": f"09{i:08d}"} for i in range(200)]
+    # Dòng trùng id (vd. trang bị lệch khi phân trang) -> bản sau ghi đè bản trước
+    rows.append({"id": 5, "ho_ten": "Yến Nhi", "sdt": "0912345678"})
+    index = CustomerIndex()
+    index.rebuild(rows)
+
+    assert index._phones == sorted(index._phone_ids)
+    assert index._words == sorted(index._postings)
+    assert [r["id"] for r in index.search("nhi")] == [5]
+    assert index.get("0900000005") is None
+    assert index.search("0900000005") == []